@@ -0,0 +1,142 @@
+"""
+Batched TRC20 and TRX balance reads
+
+Balance dashboards look at hundreds of deposit and agent addresses.
+Reading them one by one through tronpy costs a blocking contract lookup
+and a balanceOf call per address, in sequence. BalanceReader instead
+sends one triggerconstantcontract (or getaccount, for TRX) per address
+through the provider pool, up to `concurrency` at a time. A page of
+addresses therefore takes about one node round trip.
+
+The balanceOf call data is built without an ABI: the selector is hashed
+once at import, and the encoded argument for each address is cached.
+Balances are cached for `ttl` seconds, and concurrent reads of the same
+balance share one request, so dashboards that refresh together do not
+multiply node traffic.
+"""
+
+import asyncio
+import functools
+import logging
+import time
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+import aiohttp
+from prometheus_client import Counter
+from tronpy.keys import keccak256, to_hex_address
+
+from provider_pool import ProviderPool
+from rate_limiter import PRIORITY_BACKGROUND
+
+logger = logging.getLogger(__name__)
+
+USDT_CONTRACT = "TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t"
+BALANCE_OF_SELECTOR = keccak256(b"balanceOf(address)")[:4].hex()
+
+BALANCE_READS = Counter(
+    "tron_balance_reads_total",
+    "Balance lookups by the batched balance reader",
+    ["result"]  # cached, fetched, error
+)
+
+
+@functools.lru_cache(maxsize=65536)
+def balance_of_data(address: str) -> str:
+    """ABI-encoded balanceOf(address) call: selector plus the address padded to 32 bytes"""
+    return BALANCE_OF_SELECTOR + to_hex_address(address)[2:].lower().rjust(64, "0")
+
+
+class BalanceReader:
+    """Concurrent, cached TRC20 and TRX balance lookups for many addresses"""
+
+    def __init__(
+        self,
+        pool: ProviderPool,
+        get_session: Callable[[], Awaitable[aiohttp.ClientSession]],
+        concurrency: int = 32,
+        ttl: float = 10.0,
+        priority: int = PRIORITY_BACKGROUND
+    ):
+        self.pool = pool
+        self.get_session = get_session
+        self.ttl = ttl
+        self.priority = priority
+        self._slots = asyncio.Semaphore(concurrency)
+        self._cache: Dict[Tuple[str, str], Tuple[int, float]] = {}  # (contract or "TRX", address) -> (raw, expiry)
+        self._in_flight: Dict[Tuple[str, str], asyncio.Future] = {}
+
+    async def trc20_balances(
+        self, addresses: Iterable[str], contract: str = USDT_CONTRACT, decimals: int = 6
+    ) -> Dict[str, Optional[Decimal]]:
+        """Token balance of each address; None where the node could not be read"""
+        raw = await self._read(contract, addresses, functools.partial(self._balance_of, contract))
+        return {address: None if value is None else Decimal(value).scaleb(-decimals) for address, value in raw.items()}
+
+    async def trx_balances(self, addresses: Iterable[str]) -> Dict[str, Optional[Decimal]]:
+        """TRX balance of each address; None where the node could not be read"""
+        raw = await self._read("TRX", addresses, self._account_balance)
+        return {address: None if value is None else Decimal(value).scaleb(-6) for address, value in raw.items()}
+
+    def invalidate(self, address: str):
+        """Forget an address's cached balances, e.g. after sending from it"""
+        for key in [key for key in self._cache if key[1] == address]:
+            del self._cache[key]
+
+    async def _read(
+        self, asset: str, addresses: Iterable[str], fetch: Callable[[str], Awaitable[int]]
+    ) -> Dict[str, Optional[int]]:
+        now = time.monotonic()
+        results: Dict[str, Optional[int]] = {}
+        waiting = {}
+        for address in dict.fromkeys(addresses):
+            key = (asset, address)
+            cached = self._cache.get(key)
+            if cached is not None and cached[1] > now:
+                results[address] = cached[0]
+                BALANCE_READS.labels(result="cached").inc()
+                continue
+            future = self._in_flight.get(key)
+            if future is None:
+                future = self._in_flight[key] = asyncio.ensure_future(self._fetch(key, fetch))
+            waiting[address] = future
+
+        for address, value in zip(waiting, await asyncio.gather(*waiting.values())):
+            results[address] = value
+        return results
+
+    async def _fetch(self, key: Tuple[str, str], fetch: Callable[[str], Awaitable[int]]) -> Optional[int]:
+        try:
+            async with self._slots:
+                value = await fetch(key[1])
+            self._cache[key] = (value, time.monotonic() + self.ttl)
+            BALANCE_READS.labels(result="fetched").inc()
+            return value
+        except Exception as e:
+            BALANCE_READS.labels(result="error").inc()
+            logger.warning(f"Balance read of {key[0]} for {key[1]} failed: {e}")
+            return None
+        finally:
+            del self._in_flight[key]
+
+    async def _balance_of(self, contract: str, address: str) -> int:
+        result = await self._post("/wallet/triggerconstantcontract", {
+            "owner_address": address,
+            "contract_address": contract,
+            "data": balance_of_data(address),
+            "visible": True
+        })
+        constant_result = result.get("constant_result")
+        if not result.get("result", {}).get("result") or not constant_result:
+            raise RuntimeError(f"balanceOf failed: {result.get('result', {}).get('message', result)}")
+        return int(constant_result[0] or "0", 16)
+
+    async def _account_balance(self, address: str) -> int:
+        # An account that never received anything comes back as {}
+        return (await self._post("/wallet/getaccount", {"address": address, "visible": True})).get("balance", 0)
+
+    async def _post(self, path: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        response = await self.pool.request(await self.get_session(), "POST", path, json_body=body, priority=self.priority)
+        if response.status != 200:
+            raise RuntimeError(f"{path} returned {response.status}")
+        return response.json()
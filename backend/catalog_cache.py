@@ -0,0 +1,229 @@
+"""
+Product catalog cache
+
+Serialized product listing pages are cached in an in-process LRU backed by Redis.
+Every entry is keyed under the current catalog version; any product write
+bumps the version, which retires all older entries at once. Entries carry an
+ETag so repeat callers can be answered with 304 Not Modified.
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = "catalog:version"
+ENTRY_KEY_PREFIX = "catalog:entry"
+
+CACHE_LOOKUPS = Counter(
+    "catalog_cache_lookups_total",
+    "Catalog cache lookups by the layer that answered",
+    ["result"]  # local, redis, miss
+)
+CACHE_HIT_RATIO = Gauge(
+    "catalog_cache_hit_ratio",
+    "Share of catalog lookups answered from cache since startup"
+)
+ENTRY_AGE = Histogram(
+    "catalog_cache_entry_age_seconds",
+    "Age of catalog entries when served from cache",
+    buckets=(0.1, 0.5, 1, 5, 15, 30, 60, 120, 300)
+)
+VERSION_STALENESS = Gauge(
+    "catalog_cache_version_staleness_seconds",
+    "Seconds since the local catalog version was last confirmed against Redis"
+)
+VERSION_BUMPS = Counter(
+    "catalog_cache_version_bumps_total",
+    "Catalog version increments caused by product writes"
+)
+
+
+@dataclass
+class CatalogEntry:
+    """A serialized product listing"""
+    body: bytes
+    etag: str
+    version: int
+    created_at: float
+    next_cursor: Optional[str] = None
+
+
+class CatalogCache:
+    """Two-level (process LRU + Redis) cache of serialized product listings"""
+
+    def __init__(
+        self,
+        redis_client=None,
+        max_entries: int = 512,
+        ttl: int = 300,
+        version_check_interval: float = 1.0
+    ):
+        self.redis = redis_client
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version_check_interval = version_check_interval
+
+        self._entries: "OrderedDict[Tuple[int, tuple], CatalogEntry]" = OrderedDict()
+        self._version = 0
+        self._version_checked_at = 0.0
+        self._hits = 0
+        self._lookups = 0
+        self._pending_bumps = set()
+
+    async def current_version(self) -> int:
+        """Catalog version, re-read from Redis at most every version_check_interval"""
+        now = time.monotonic()
+        if self.redis is not None and now - self._version_checked_at >= self.version_check_interval:
+            try:
+                value = await self.redis.get(VERSION_KEY)
+                self._version = max(self._version, int(value or 0))
+                self._version_checked_at = now
+            except Exception as e:
+                logger.warning(f"Failed to read catalog version: {e}")
+
+        VERSION_STALENESS.set(now - self._version_checked_at if self.redis is not None else 0)
+        return self._version
+
+    async def get(self, version: int, key: tuple) -> Optional[CatalogEntry]:
+        """Look up a listing for this catalog version"""
+        self._lookups += 1
+        entry = self._entries.get((version, key))
+        result = "local"
+
+        if entry is not None:
+            self._entries.move_to_end((version, key))
+        elif self.redis is not None:
+            entry = await self._get_redis(version, key)
+            result = "redis"
+            if entry is not None:
+                self._store_local(version, key, entry)
+
+        if entry is None:
+            CACHE_LOOKUPS.labels(result="miss").inc()
+        else:
+            self._hits += 1
+            CACHE_LOOKUPS.labels(result=result).inc()
+            ENTRY_AGE.observe(time.time() - entry.created_at)
+        CACHE_HIT_RATIO.set(self._hits / self._lookups)
+        return entry
+
+    async def put(self, version: int, key: tuple, body: bytes, next_cursor: Optional[str] = None) -> CatalogEntry:
+        """Store a freshly serialized listing"""
+        entry = CatalogEntry(
+            body=body,
+            etag=f'"{version}-{hashlib.sha1(body).hexdigest()[:16]}"',
+            version=version,
+            created_at=time.time(),
+            next_cursor=next_cursor
+        )
+        self._store_local(version, key, entry)
+
+        if self.redis is not None:
+            try:
+                redis_key = self._redis_key(version, key)
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    pipe.hset(redis_key, mapping={
+                        "body": body,
+                        "etag": entry.etag,
+                        "created_at": entry.created_at,
+                        "next_cursor": entry.next_cursor or ""
+                    })
+                    pipe.expire(redis_key, self.ttl)
+                    await pipe.execute()
+            except Exception as e:
+                logger.warning(f"Failed to store catalog entry in Redis: {e}")
+
+        return entry
+
+    async def bump_version(self) -> int:
+        """Retire every cached listing after a product write"""
+        VERSION_BUMPS.inc()
+        if self.redis is not None:
+            try:
+                self._version = max(self._version, int(await self.redis.incr(VERSION_KEY)))
+                self._version_checked_at = time.monotonic()
+            except Exception as e:
+                logger.warning(f"Failed to bump catalog version in Redis: {e}")
+                self._version += 1
+        else:
+            self._version += 1
+
+        self._entries.clear()
+        return self._version
+
+    def bump_version_soon(self):
+        """Schedule a version bump from synchronous code (ORM event hooks)"""
+        # Stop serving local entries right away, Redis catches up with the task
+        self._entries.clear()
+        self._version_checked_at = 0.0
+        try:
+            task = asyncio.get_running_loop().create_task(self.bump_version())
+        except RuntimeError:
+            self._version += 1
+            return
+        self._pending_bumps.add(task)
+        task.add_done_callback(self._pending_bumps.discard)
+
+    def _store_local(self, version: int, key: tuple, entry: CatalogEntry):
+        self._entries[(version, key)] = entry
+        self._entries.move_to_end((version, key))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _get_redis(self, version: int, key: tuple) -> Optional[CatalogEntry]:
+        try:
+            data = await self.redis.hgetall(self._redis_key(version, key))
+        except Exception as e:
+            logger.warning(f"Failed to read catalog entry from Redis: {e}")
+            return None
+
+        if not data:
+            return None
+        return CatalogEntry(
+            body=data[b"body"],
+            etag=data[b"etag"].decode(),
+            version=version,
+            created_at=float(data[b"created_at"]),
+            next_cursor=data.get(b"next_cursor", b"").decode() or None
+        )
+
+    @staticmethod
+    def _redis_key(version: int, key: tuple) -> str:
+        return f"{ENTRY_KEY_PREFIX}:v{version}:" + ":".join("" if part is None else str(part) for part in key)
+
+
+def register_invalidation(cache: CatalogCache, model):
+    """Bump the catalog version whenever a transaction that wrote `model` commits"""
+
+    @event.listens_for(Session, "after_flush")
+    def _track_flush(session, flush_context):
+        for obj in (*session.new, *session.dirty, *session.deleted):
+            if isinstance(obj, model):
+                session.info["catalog_dirty"] = True
+                return
+
+    @event.listens_for(Session, "do_orm_execute")
+    def _track_bulk_statement(orm_execute_state):
+        if (orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert) \
+                and orm_execute_state.bind_mapper is not None \
+                and orm_execute_state.bind_mapper.class_ is model:
+            orm_execute_state.session.info["catalog_dirty"] = True
+
+    @event.listens_for(Session, "after_commit")
+    def _bump_on_commit(session):
+        if session.info.pop("catalog_dirty", False):
+            cache.bump_version_soon()
+
+    @event.listens_for(Session, "after_rollback")
+    def _clear_on_rollback(session):
+        session.info.pop("catalog_dirty", None)
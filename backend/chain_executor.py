@@ -0,0 +1,60 @@
+"""
+Async access to the blocking tronpy client
+
+tronpy's Tron client does synchronous HTTP, so calling it from a coroutine
+stalls the whole event loop for a node round trip. AsyncChain runs those
+calls on a dedicated, bounded thread pool; a semaphore caps how many calls
+may be queued or running, so a burst waits asynchronously instead of
+piling up unbounded work behind the pool.
+"""
+
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from prometheus_client import Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+CHAIN_CALL_DURATION = Histogram(
+    "tron_chain_call_duration_seconds",
+    "Blocking tronpy calls run on the chain executor, including time queued for a worker",
+    ["method"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+CHAIN_CALLS_IN_FLIGHT = Gauge(
+    "tron_chain_calls_in_flight",
+    "tronpy calls queued or running on the chain executor"
+)
+
+
+class AsyncChain:
+    """Awaitable wrappers around a synchronous tronpy.Tron client"""
+
+    def __init__(self, client, max_workers: int = 8, max_in_flight: Optional[int] = None):
+        self.client = client
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tronpy")
+        self._slots = asyncio.Semaphore(max_in_flight or max_workers * 4)
+
+    async def call(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run a blocking callable on the executor"""
+        name = getattr(fn, "__name__", "call")
+        async with self._slots:
+            CHAIN_CALLS_IN_FLIGHT.inc()
+            start = time.perf_counter()
+            try:
+                return await asyncio.get_running_loop().run_in_executor(
+                    self._executor, functools.partial(fn, *args, **kwargs)
+                )
+            finally:
+                CHAIN_CALL_DURATION.labels(method=name).observe(time.perf_counter() - start)
+                CHAIN_CALLS_IN_FLIGHT.dec()
+
+    async def get_account(self, address: str) -> Dict[str, Any]:
+        return await self.call(self.client.get_account, address)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,148 @@
+"""
+Database engine, session factory and SQL statement metrics
+"""
+
+import logging
+import re
+import time
+from typing import Dict, Set
+
+from prometheus_client import Gauge, Histogram
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+logger = logging.getLogger(__name__)
+
+MAX_SHAPE_LENGTH = 300
+MAX_TRACKED_SHAPES = 200  # keeps label cardinality bounded
+
+STATEMENT_DURATION = Histogram(
+    "db_statement_duration_seconds",
+    "SQL statement execution time by query shape",
+    ["shape"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a connection from the pool",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+)
+POOL_CONNECTIONS = Gauge(
+    "db_pool_connections",
+    "Connection pool usage",
+    ["state"]
+)
+
+_PARAM = r"(?:\$\d+(?:::\w+)?|\?|%\(\w+\)s|:\w+)"
+_WHITESPACE = re.compile(r"\s+")
+_PARAM_LISTS = re.compile(rf"\(\s*{_PARAM}(?:\s*,\s*{_PARAM})*\s*\)")
+_REPEATED_LISTS = re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+")
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+_shape_cache: Dict[str, str] = {}
+_known_shapes: Set[str] = set()
+
+
+def statement_shape(statement: str) -> str:
+    """Reduce a SQL statement to its shape so variants of one query share a histogram
+
+    Whitespace is collapsed, IN lists and multi-row VALUES collapse to (...),
+    and inline literals become ?.
+    """
+    shape = _shape_cache.get(statement)
+    if shape is not None:
+        return shape
+
+    shape = _WHITESPACE.sub(" ", statement).strip()
+    shape = _PARAM_LISTS.sub("(...)", shape)
+    shape = _REPEATED_LISTS.sub("(...)", shape)
+    shape = _LITERALS.sub("?", shape)
+    shape = shape[:MAX_SHAPE_LENGTH]
+
+    if shape not in _known_shapes:
+        if len(_known_shapes) >= MAX_TRACKED_SHAPES:
+            shape = "other"
+        else:
+            _known_shapes.add(shape)
+    if len(_shape_cache) < MAX_TRACKED_SHAPES * 10:
+        _shape_cache[statement] = shape
+    return shape
+
+
+class TimedAsyncAdaptedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long each checkout waited for a connection"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the execution context, so a statement that raises leaves nothing behind on the connection
+    if context is not None:
+        context._query_start_time = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "_query_start_time", None)
+    if start is None:
+        return
+    STATEMENT_DURATION.labels(shape=statement_shape(statement)).observe(time.perf_counter() - start)
+
+
+def create_engine(
+    database_url: str,
+    pool_size: int = 10,
+    max_overflow: int = 20,
+    pool_timeout: float = 30,
+    pool_recycle: int = 1800,
+    pool_pre_ping: bool = True,
+    statement_cache_size: int = 500,
+    echo: bool = False
+) -> AsyncEngine:
+    """Create the application's async engine with pool tuning and statement timing"""
+    options = {"echo": echo}
+
+    if not database_url.startswith("sqlite"):
+        options.update(
+            poolclass=TimedAsyncAdaptedQueuePool,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=pool_timeout,
+            pool_recycle=pool_recycle,
+            pool_pre_ping=pool_pre_ping
+        )
+
+    if "+asyncpg" in database_url:
+        # Prepared statements are cached per connection; must be 0 behind pgbouncer in transaction mode
+        options["connect_args"] = {"prepared_statement_cache_size": statement_cache_size}
+
+    engine = create_async_engine(database_url, **options)
+    event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+    logger.info(
+        f"Database engine created (pool_size={pool_size}, max_overflow={max_overflow}, "
+        f"pool_recycle={pool_recycle}, pre_ping={pool_pre_ping}, echo={echo})"
+    )
+    return engine
+
+
+def create_session_factory(engine: AsyncEngine) -> async_sessionmaker:
+    """Build the session factory once; sessions are cheap, factories are not"""
+    return async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+
+def update_pool_gauges(engine: AsyncEngine):
+    """Refresh pool usage gauges, called when metrics are scraped"""
+    pool = engine.sync_engine.pool
+    if not isinstance(pool, AsyncAdaptedQueuePool):
+        return
+    POOL_CONNECTIONS.labels(state="size").set(pool.size())
+    POOL_CONNECTIONS.labels(state="checked_out").set(pool.checkedout())
+    POOL_CONNECTIONS.labels(state="checked_in").set(pool.checkedin())
+    POOL_CONNECTIONS.labels(state="overflow").set(max(pool.overflow(), 0))
@@ -0,0 +1,243 @@
+"""
+Durable delivery job queue
+
+Paid orders are queued on a Redis Stream and delivered by a pool of
+workers in a consumer group, so payment notifications return as soon as
+the payment is recorded. Failed jobs are retried with exponential backoff
+through a delayed set; jobs that keep failing end up in a dead-letter
+stream. Jobs left unacknowledged by a crashed worker are claimed by the
+survivors.
+
+The handler must be idempotent: a job can run more than once.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, List, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+STREAM_KEY = "delivery:jobs"
+GROUP_NAME = "delivery-workers"
+RETRY_KEY = "delivery:retry"
+DEAD_LETTER_KEY = "delivery:dead"
+
+STAGE_DURATION = Histogram(
+    "delivery_stage_duration_seconds",
+    "Time spent in each delivery stage",
+    ["stage"],  # queue_wait, claim, deliver, commit, total
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 15, 60, 300)
+)
+DELIVERY_JOBS = Counter(
+    "delivery_jobs_total",
+    "Delivery job outcomes",
+    ["result"]  # success, retry, dead
+)
+QUEUE_DEPTH = Gauge(
+    "delivery_queue_depth",
+    "Delivery jobs waiting",
+    ["state"]  # pending, retrying, dead
+)
+
+
+@contextmanager
+def timed_stage(stage: str):
+    """Record how long a block of delivery work took"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.labels(stage=stage).observe(time.perf_counter() - start)
+
+
+class DeliveryQueue:
+    """Redis Streams backed worker pool running a delivery handler per order"""
+
+    def __init__(
+        self,
+        redis_client,
+        handler: Callable[[int], Awaitable[None]],
+        concurrency: int = 4,
+        max_attempts: int = 5,
+        backoff_base: float = 2.0,
+        backoff_max: float = 300.0,
+        claim_idle_seconds: float = 60.0
+    ):
+        self.redis = redis_client
+        self.handler = handler
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.claim_idle_seconds = claim_idle_seconds
+        self.consumer_prefix = f"{socket.gethostname()}-{os.getpid()}"
+
+        # Jobs that could not be written to Redis are run from memory
+        self._local_jobs: asyncio.Queue = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+        self._running = False
+
+    async def start(self):
+        """Create the consumer group and start the workers and the retry scheduler"""
+        try:
+            await self.redis.xgroup_create(STREAM_KEY, GROUP_NAME, id="0", mkstream=True)
+        except Exception as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+        self._running = True
+        self._tasks = [
+            asyncio.create_task(self._worker(f"{self.consumer_prefix}-{i}"))
+            for i in range(self.concurrency)
+        ]
+        self._tasks.append(asyncio.create_task(self._scheduler()))
+        logger.info(f"Delivery queue started with {self.concurrency} workers")
+
+    async def stop(self):
+        """Stop the workers; unacknowledged jobs are picked up again later"""
+        self._running = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def enqueue(self, order_id: int, attempt: int = 1):
+        """Queue delivery of a paid order"""
+        job = {"order_id": order_id, "attempt": attempt, "enqueued_at": time.time()}
+        try:
+            await self.redis.xadd(STREAM_KEY, job)
+        except Exception as e:
+            logger.warning(f"Failed to queue delivery of order {order_id} in Redis, running it from memory: {e}")
+            await self._local_jobs.put(job)
+
+    async def dead_letters(self, count: int = 100) -> List[dict]:
+        """Most recent jobs that exhausted their retries"""
+        entries = await self.redis.xrevrange(DEAD_LETTER_KEY, count=count)
+        return [
+            {"id": entry_id.decode(), **{k.decode(): v.decode() for k, v in fields.items()}}
+            for entry_id, fields in entries
+        ]
+
+    async def requeue_dead(self, entry_id: str) -> bool:
+        """Give a dead-lettered job a fresh set of attempts"""
+        entries = await self.redis.xrange(DEAD_LETTER_KEY, min=entry_id, max=entry_id)
+        if not entries or not await self.redis.xdel(DEAD_LETTER_KEY, entry_id):
+            return False
+        await self.enqueue(int(entries[0][1][b"order_id"]))
+        return True
+
+    async def _worker(self, consumer: str):
+        while self._running:
+            try:
+                if not self._local_jobs.empty():
+                    await self._run(None, self._local_jobs.get_nowait())
+                    continue
+
+                response = await self.redis.xreadgroup(
+                    GROUP_NAME, consumer, {STREAM_KEY: ">"}, count=1, block=1000
+                )
+                for _, entries in response or []:
+                    for entry_id, fields in entries:
+                        await self._run(entry_id, self._decode(fields))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Delivery worker {consumer} error: {e}")
+                await asyncio.sleep(1)
+
+    async def _run(self, entry_id: Optional[bytes], job: dict):
+        order_id = job["order_id"]
+        STAGE_DURATION.labels(stage="queue_wait").observe(max(time.time() - job["enqueued_at"], 0))
+
+        try:
+            with timed_stage("total"):
+                await self.handler(order_id)
+            DELIVERY_JOBS.labels(result="success").inc()
+        except Exception as e:
+            await self._fail(job, e)
+
+        if entry_id is not None:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.xack(STREAM_KEY, GROUP_NAME, entry_id)
+                pipe.xdel(STREAM_KEY, entry_id)
+                await pipe.execute()
+
+    async def _fail(self, job: dict, error: Exception):
+        order_id, attempt = job["order_id"], job["attempt"]
+
+        if attempt >= self.max_attempts:
+            DELIVERY_JOBS.labels(result="dead").inc()
+            logger.error(f"Delivery of order {order_id} failed {attempt} times, moving to dead letters: {error}")
+            try:
+                await self.redis.xadd(DEAD_LETTER_KEY, {
+                    "order_id": order_id,
+                    "attempts": attempt,
+                    "error": str(error)[:500],
+                    "failed_at": time.time()
+                })
+            except Exception as e:
+                logger.error(f"Failed to dead-letter delivery of order {order_id}: {e}")
+            return
+
+        DELIVERY_JOBS.labels(result="retry").inc()
+        delay = min(self.backoff_base ** attempt, self.backoff_max)
+        logger.warning(f"Delivery of order {order_id} failed (attempt {attempt}), retrying in {delay:.0f}s: {error}")
+        try:
+            await self.redis.zadd(RETRY_KEY, {f"{order_id}:{attempt + 1}": time.time() + delay})
+        except Exception as e:
+            logger.warning(f"Failed to schedule delivery retry in Redis, retrying from memory: {e}")
+            asyncio.get_running_loop().call_later(
+                delay, self._local_jobs.put_nowait,
+                {"order_id": order_id, "attempt": attempt + 1, "enqueued_at": time.time() + delay}
+            )
+
+    async def _scheduler(self):
+        """Move due retries back onto the stream and claim jobs abandoned by dead consumers"""
+        consumer = f"{self.consumer_prefix}-scheduler"
+        while self._running:
+            try:
+                now = time.time()
+                for member in await self.redis.zrangebyscore(RETRY_KEY, "-inf", now, start=0, num=100):
+                    # Only the replica whose ZREM succeeds re-queues the job
+                    if await self.redis.zrem(RETRY_KEY, member):
+                        order_id, attempt = member.decode().split(":")
+                        await self.enqueue(int(order_id), int(attempt))
+
+                _, claimed, *_ = await self.redis.xautoclaim(
+                    STREAM_KEY, GROUP_NAME, consumer,
+                    min_idle_time=int(self.claim_idle_seconds * 1000), start_id="0-0", count=10
+                )
+                for entry_id, fields in claimed:
+                    logger.warning(f"Claimed abandoned delivery job {entry_id.decode()}")
+                    await self._run(entry_id, self._decode(fields))
+
+                await self._update_depth()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Delivery scheduler error: {e}")
+            await asyncio.sleep(1)
+
+    async def _update_depth(self):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.xlen(STREAM_KEY)
+            pipe.zcard(RETRY_KEY)
+            pipe.xlen(DEAD_LETTER_KEY)
+            pending, retrying, dead = await pipe.execute()
+        QUEUE_DEPTH.labels(state="pending").set(pending + self._local_jobs.qsize())
+        QUEUE_DEPTH.labels(state="retrying").set(retrying)
+        QUEUE_DEPTH.labels(state="dead").set(dead)
+
+    @staticmethod
+    def _decode(fields: dict) -> dict:
+        return {
+            "order_id": int(fields[b"order_id"]),
+            "attempt": int(fields[b"attempt"]),
+            "enqueued_at": float(fields[b"enqueued_at"])
+        }
@@ -44,14 +44,19 @@ CREATE INDEX IF NOT EXISTS idx_users_username ON users(username) WHERE username
 CREATE INDEX IF NOT EXISTS idx_products_category ON products(category);
 CREATE INDEX IF NOT EXISTS idx_products_country ON products(country) WHERE country IS NOT NULL;
 CREATE INDEX IF NOT EXISTS idx_products_status ON products(status);
+CREATE INDEX IF NOT EXISTS idx_products_listing ON products(status, category, country, id);
 CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders(user_id);
+CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders(user_id, created_at, id);
 CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status);
 CREATE INDEX IF NOT EXISTS idx_orders_total_amount ON orders(total_amount);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_orders_pending_amount ON orders(payment_address, total_amount) WHERE status = 'pending_payment';
+CREATE INDEX IF NOT EXISTS idx_orders_pending_expiry ON orders(expires_at) WHERE status = 'pending_payment';
 CREATE INDEX IF NOT EXISTS idx_payments_tx_hash ON payments(tx_hash);
 CREATE INDEX IF NOT EXISTS idx_payments_order_id ON payments(order_id);
 CREATE INDEX IF NOT EXISTS idx_audit_logs_created_at ON audit_logs(created_at);
 
 -- Create a function to generate unique payment amounts
+-- NOTE: the API allocates suffixes through payment_allocator.py; this is kept for manual/admin use
 CREATE OR REPLACE FUNCTION generate_unique_payment_amount(base_amount DECIMAL(10,2))
 RETURNS DECIMAL(18,6) AS $$
 DECLARE
@@ -89,6 +94,8 @@ END;
 $$ LANGUAGE plpgsql;
 
 -- Create a function to clean up expired orders
+-- (the backend's order sweeper expires orders in batches and also releases their
+-- stock and amount suffixes; this unbatched version is kept for manual/admin use)
 CREATE OR REPLACE FUNCTION cleanup_expired_orders()
 RETURNS INTEGER AS $$
 DECLARE
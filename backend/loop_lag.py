@@ -0,0 +1,70 @@
+"""
+Event loop lag probe
+
+A background task sleeps for a fixed interval and measures how late it
+wakes up. Any blocking call on the loop shows up directly as lag, which
+makes this the cheapest way to prove (or catch regressions in) keeping
+blocking work such as tronpy calls off the event loop.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from prometheus_client import Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG = Histogram(
+    "event_loop_lag_seconds",
+    "How late the event loop lag probe woke up",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+LOOP_LAG_MAX = Gauge(
+    "event_loop_lag_max_seconds",
+    "Largest event loop lag in the probe's recent window"
+)
+
+
+class LoopLagProbe:
+    """Measure event loop responsiveness"""
+
+    def __init__(self, interval: float = 0.1, window: int = 600, warn_threshold: float = 0.25):
+        self.interval = interval
+        self.warn_threshold = warn_threshold
+        self.samples = deque(maxlen=window)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def snapshot(self) -> Dict[str, float]:
+        """p50/p99/max lag in seconds over the recent window"""
+        if not self.samples:
+            return {"p50": 0.0, "p99": 0.0, "max": 0.0, "samples": 0}
+        ordered = sorted(self.samples)
+        return {
+            "p50": ordered[len(ordered) // 2],
+            "p99": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))],
+            "max": ordered[-1],
+            "samples": len(ordered)
+        }
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - start - self.interval)
+            self.samples.append(lag)
+            LOOP_LAG.observe(lag)
+            LOOP_LAG_MAX.set(max(self.samples))
+            if lag >= self.warn_threshold:
+                logger.warning(f"Event loop blocked for {lag * 1000:.0f}ms")
@@ -3,21 +3,21 @@ Backend API for TeleBot Sales Platform
 FastAPI application with TRON payment processing
 """
 
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Response, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 from contextlib import asynccontextmanager
 import redis.asyncio as redis
 import os
+import json
 import logging
 from typing import Optional, List
 import uvicorn
 from decimal import Decimal
 import asyncio
-from datetime import datetime, timedelta
-import secrets
+from datetime import datetime, timedelta, timezone
 
 from models import Base, User, Product, Order, Payment, Agent
 from schemas import (
@@ -27,6 +27,16 @@ from schemas import (
 )
 from tron_client import TronClient
 from vault_client import VaultClient
+from payment_allocator import AllocatorUnavailable, PaymentSuffixAllocator, lease_token, suffix_to_amount
+from payment_index import PendingOrderIndex
+from stock_reservation import StockReservations, register_stock_reset
+from delivery_queue import DeliveryQueue, timed_stage
+from order_sweeper import OrderSweeper
+from order_events import order_event, publish_order_events
+from loop_lag import LoopLagProbe
+from database import create_engine, create_session_factory, update_pool_gauges
+from catalog_cache import CatalogCache, register_invalidation
+from pagination import Keyset, InvalidCursor
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -38,26 +48,87 @@ REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 VAULT_ADDR = os.getenv("VAULT_ADDR", "http://localhost:8200")
 VAULT_TOKEN = os.getenv("VAULT_TOKEN") or os.getenv("DEV_VAULT_TOKEN")
 ENVIRONMENT = os.getenv("ENVIRONMENT", "development")
+ORDER_TIMEOUT_MINUTES = int(os.getenv("ORDER_TIMEOUT_MINUTES", "15"))
+# Suffixes stay reserved this long after expiry so a late payment cannot match a newer order
+PAYMENT_GRACE_SECONDS = int(os.getenv("PAYMENT_GRACE_SECONDS", "300"))
+# A paid order's suffix is reused only after this long, so a duplicate transfer cannot pay a newer order
+PAYMENT_SUFFIX_COOLDOWN = int(os.getenv("PAYMENT_SUFFIX_COOLDOWN", "600"))
+PAYMENT_SUFFIX_RECLAIM_INTERVAL = float(os.getenv("PAYMENT_SUFFIX_RECLAIM_INTERVAL", "60"))  # seconds
+NOTIFY_BATCH_MAX = int(os.getenv("NOTIFY_BATCH_MAX", "1000"))
+
+# Stock reservation; products with at least STOCK_HOT_THRESHOLD units get sharded counters
+STOCK_HOT_THRESHOLD = int(os.getenv("STOCK_HOT_THRESHOLD", "100"))
+STOCK_HOT_SHARDS = int(os.getenv("STOCK_HOT_SHARDS", "8"))
+
+# Delivery worker pool
+DELIVERY_CONCURRENCY = int(os.getenv("DELIVERY_CONCURRENCY", "4"))
+DELIVERY_MAX_ATTEMPTS = int(os.getenv("DELIVERY_MAX_ATTEMPTS", "5"))
+DELIVERY_BACKOFF_BASE = float(os.getenv("DELIVERY_BACKOFF_BASE", "2"))  # seconds, raised to the attempt number
+DELIVERY_BACKOFF_MAX = float(os.getenv("DELIVERY_BACKOFF_MAX", "300"))
+
+# Expired order sweeper
+ORDER_SWEEP_INTERVAL = float(os.getenv("ORDER_SWEEP_INTERVAL", "60"))  # seconds
+ORDER_SWEEP_BATCH_SIZE = int(os.getenv("ORDER_SWEEP_BATCH_SIZE", "5000"))
+
+# Database pool tuning
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500"))
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() == "true"
+
+# Product catalog cache
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "512"))
+CATALOG_CACHE_TTL = int(os.getenv("CATALOG_CACHE_TTL", "300"))  # seconds
+MAX_PAGE_SIZE = 200
+
+# Keyset pagination orderings, backed by idx_products_listing / idx_orders_user_created
+PRODUCT_KEYSET = Keyset(Product.id)
+ORDER_HISTORY_KEYSET = Keyset(Order.created_at, Order.id, descending=True)
 
 # Security
 security = HTTPBearer()
 
 # Global variables
 engine = None
+async_session_factory = None
 redis_client = None
 vault_client = None
 tron_client = None
+payment_allocator = None
+payment_index = None
+stock_reservations = None
+delivery_queue = None
+order_sweeper = None
+catalog_cache = None
+loop_lag_probe = None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan management"""
-    global engine, redis_client, vault_client, tron_client
+    global engine, async_session_factory, redis_client, vault_client, tron_client, payment_allocator, payment_index, stock_reservations, delivery_queue, order_sweeper, catalog_cache, loop_lag_probe
     
     # Startup
     logger.info("Starting TeleBot Sales API...")
     
+    # Reports event loop stalls, e.g. from blocking calls made on the loop
+    loop_lag_probe = LoopLagProbe()
+    loop_lag_probe.start()
+    
     # Database
-    engine = create_async_engine(DATABASE_URL, echo=True)
+    engine = create_engine(
+        DATABASE_URL,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+        echo=DB_ECHO
+    )
+    async_session_factory = create_session_factory(engine)
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
     
@@ -70,7 +141,45 @@ async def lifespan(app: FastAPI):
     await vault_client.initialize_secrets()
     
     # TRON client
-    tron_client = TronClient(vault_client)
+    tron_client = TronClient(vault_client, redis_client=redis_client)
+    
+    # Payment amount suffix allocator
+    payment_allocator = PaymentSuffixAllocator(redis_client, reclaim_interval=PAYMENT_SUFFIX_RECLAIM_INTERVAL)
+    payment_allocator.start()
+    
+    # Pending order match index for payment notifications
+    payment_index = PendingOrderIndex(redis_client, grace_seconds=PAYMENT_GRACE_SECONDS)
+    await warm_payment_index()
+    
+    # Stock reservations taken at order time
+    stock_reservations = StockReservations(redis_client, hot_threshold=STOCK_HOT_THRESHOLD, hot_shards=STOCK_HOT_SHARDS)
+    register_stock_reset(stock_reservations, Product)
+    
+    # Product catalog cache, invalidated by any committed product write
+    catalog_cache = CatalogCache(redis_client, max_entries=CATALOG_CACHE_SIZE, ttl=CATALOG_CACHE_TTL)
+    register_invalidation(catalog_cache, Product)
+    
+    # Delivery workers; paid orders left over from a previous run are queued again
+    delivery_queue = DeliveryQueue(
+        redis_client,
+        trigger_delivery,
+        concurrency=DELIVERY_CONCURRENCY,
+        max_attempts=DELIVERY_MAX_ATTEMPTS,
+        backoff_base=DELIVERY_BACKOFF_BASE,
+        backoff_max=DELIVERY_BACKOFF_MAX
+    )
+    await delivery_queue.start()
+    await requeue_undelivered_orders()
+    
+    # Expire unpaid orders once their payment grace period is over
+    order_sweeper = OrderSweeper(
+        engine,
+        release_expired_orders,
+        interval=ORDER_SWEEP_INTERVAL,
+        batch_size=ORDER_SWEEP_BATCH_SIZE,
+        grace_seconds=PAYMENT_GRACE_SECONDS
+    )
+    order_sweeper.start()
     
     logger.info("All services initialized successfully")
     
@@ -78,6 +187,12 @@ async def lifespan(app: FastAPI):
     
     # Shutdown
     logger.info("Shutting down services...")
+    await loop_lag_probe.stop()
+    await order_sweeper.stop()
+    await payment_allocator.stop()
+    await delivery_queue.stop()
+    await tron_client.close()
+    await vault_client.close()
     await redis_client.close()
     await engine.dispose()
 
@@ -100,8 +215,7 @@ app.add_middleware(
 # Dependency injection
 async def get_db() -> AsyncSession:
     """Get database session"""
-    async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
-    async with async_session() as session:
+    async with async_session_factory() as session:
         yield session
 
 async def get_redis():
@@ -135,6 +249,12 @@ async def health_check():
         }
     }
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: SQL statement latency by shape, pool checkout waits and pool usage"""
+    update_pool_gauges(engine)
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 @app.post("/api/v1/users", response_model=UserResponse)
 async def create_user(
     user_data: UserCreate,
@@ -186,26 +306,83 @@ async def get_user(
 async def list_products(
     category: Optional[str] = None,
     country: Optional[str] = None,
-    skip: int = 0,
-    limit: int = 100,
+    after: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    skip: int = Query(0, ge=0, deprecated=True),
+    if_none_match: Optional[str] = Header(None),
     db: AsyncSession = Depends(get_db)
 ):
-    """List products with optional filtering"""
-    from sqlalchemy import select
+    """List products with optional filtering
+    
+    Pages are keyset-paginated: pass the X-Next-Cursor header of a response
+    as `after` to fetch the next page. Listings are served from the catalog
+    cache; callers sending the ETag of their previous response get 304 Not
+    Modified while the catalog is unchanged.
+    """
+    cache_key = (category, country, after or f"skip={skip}", limit)
+    version = await catalog_cache.current_version()
+    entry = await catalog_cache.get(version, cache_key)
     
-    query = select(Product).where(Product.status == "active")
+    if entry is None:
+        from sqlalchemy import select
+        
+        query = select(Product).where(Product.status == "active")
+        
+        if category:
+            query = query.where(Product.category == category)
+        if country:
+            query = query.where(Product.country == country)
+        
+        if skip and not after:
+            # Legacy OFFSET paging, kept for existing callers
+            query = query.order_by(Product.id).offset(skip).limit(limit + 1)
+        else:
+            try:
+                query = PRODUCT_KEYSET.apply(query, after, limit)
+            except InvalidCursor as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        
+        result = await db.execute(query)
+        products, next_cursor = PRODUCT_KEYSET.page(result.scalars().all(), limit)
+        
+        body = json.dumps(
+            [ProductResponse.from_orm(product).model_dump(mode="json") for product in products]
+        ).encode()
+        entry = await catalog_cache.put(version, cache_key, body, next_cursor)
     
-    if category:
-        query = query.where(Product.category == category)
-    if country:
-        query = query.where(Product.country == country)
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if entry.next_cursor:
+        headers["X-Next-Cursor"] = entry.next_cursor
+    if if_none_match == entry.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+@app.get("/api/v1/users/{tg_id}/orders", response_model=List[OrderResponse])
+async def list_user_orders(
+    tg_id: int,
+    response: Response,
+    after: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_db)
+):
+    """Order history for a user, newest first
     
-    query = query.offset(skip).limit(limit)
+    Keyset-paginated like product listings: pass the X-Next-Cursor header
+    of a response as `after` to fetch the next page.
+    """
+    from sqlalchemy import select
+    
+    try:
+        query = ORDER_HISTORY_KEYSET.apply(select(Order).where(Order.user_id == tg_id), after, limit)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     result = await db.execute(query)
-    products = result.scalars().all()
+    orders, next_cursor = ORDER_HISTORY_KEYSET.page(result.scalars().all(), limit)
     
-    return [ProductResponse.from_orm(product) for product in products]
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return [OrderResponse.from_orm(order) for order in orders]
 
 @app.post("/api/v1/orders", response_model=OrderResponse)
 async def create_order(
@@ -229,8 +406,17 @@ async def create_order(
         
         # Calculate total amount with unique precision
         base_amount = product.price * order_data.quantity
-        unique_suffix = await generate_unique_payment_amount()
-        total_amount = base_amount + Decimal(f"0.00{unique_suffix}")
+        payment_address = await vault_client.get_secret("payment/tron-address")
+        created_at = datetime.utcnow()
+        # The suffix lease names the order by its creation time, so only this order can release it
+        token = lease_token(created_at)
+        try:
+            unique_suffix = await generate_unique_payment_amount(payment_address, base_amount, token)
+        except AllocatorUnavailable:
+            raise HTTPException(status_code=503, detail="Payment service temporarily unavailable, please retry shortly")
+        if unique_suffix is None:
+            raise HTTPException(status_code=503, detail="Too many pending orders for this amount, please retry shortly")
+        total_amount = suffix_to_amount(base_amount, unique_suffix)
         
         # Create order
         order = Order(
@@ -240,14 +426,36 @@ async def create_order(
             unit_price=product.price,
             total_amount=total_amount,
             status="pending_payment",
-            payment_address=await vault_client.get_secret("payment/tron-address"),
-            expires_at=datetime.utcnow() + timedelta(minutes=15),
-            created_at=datetime.utcnow()
+            payment_address=payment_address,
+            expires_at=created_at + timedelta(minutes=ORDER_TIMEOUT_MINUTES),
+            created_at=created_at
         )
         
         db.add(order)
-        await db.commit()
+        try:
+            await db.flush()
+            if not await reserve_stock(order, db):
+                await db.rollback()
+                await payment_allocator.release(payment_address, base_amount, unique_suffix, token)
+                raise HTTPException(status_code=409, detail="Insufficient stock")
+            try:
+                await db.commit()
+            except Exception:
+                await stock_reservations.release(order.id)
+                raise
+        except HTTPException:
+            raise
+        except Exception:
+            await payment_allocator.release(payment_address, base_amount, unique_suffix, token)
+            raise
         await db.refresh(order)
+        await payment_index.add(order.payment_address, order.total_amount, order.id, order.expires_at)
+        
+        # Payment monitors poll faster while orders are waiting for payment
+        await publish_order_events(redis_client, [order_event(
+            "created", order.id, order.payment_address, order.total_amount,
+            deadline=order.expires_at.replace(tzinfo=timezone.utc).timestamp() + PAYMENT_GRACE_SECONDS
+        )])
         
         # Schedule payment monitoring
         background_tasks.add_task(monitor_payment, order.id)
@@ -255,6 +463,8 @@ async def create_order(
         logger.info(f"Created order {order.id} for user {user.tg_id}")
         return OrderResponse.from_orm(order)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error creating order: {e}")
         raise HTTPException(status_code=500, detail="Failed to create order")
@@ -267,61 +477,265 @@ async def payment_notification(
 ):
     """Internal endpoint for payment notifications from blockchain monitor"""
     try:
-        # Find matching order by payment amount and address
-        from sqlalchemy import select, and_
+        results = await process_payment_notifications([payment_data], db)
         
-        query = select(Order).where(
-            and_(
-                Order.total_amount == payment_data.amount,
-                Order.payment_address == payment_data.to_address,
-                Order.status == "pending_payment"
+    except Exception as e:
+        logger.error(f"Error processing payment notification: {e}")
+        raise HTTPException(status_code=500, detail="Failed to process payment")
+    
+    # success: the order was paid; pending: recorded, awaiting confirmations; duplicate: already recorded
+    result = results[0]
+    if result["status"] == "no_match":
+        return {"status": "no_match"}
+    return {"status": result["status"], "order_id": result["order_id"]}
+
+@app.post("/internal/payments/notify-batch")
+async def payment_notification_batch(
+    notifications: List[PaymentNotification],
+    db: AsyncSession = Depends(get_db),
+    _: bool = Depends(verify_token)
+):
+    """Internal endpoint for batched payment notifications, e.g. monitor catch-up after an outage"""
+    if len(notifications) > NOTIFY_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {NOTIFY_BATCH_MAX} notifications per batch")
+    
+    try:
+        results = await process_payment_notifications(notifications, db)
+        
+    except Exception as e:
+        logger.error(f"Error processing payment notification batch: {e}")
+        raise HTTPException(status_code=500, detail="Failed to process payments")
+    
+    matched = sum(1 for result in results if result["status"] in ("success", "pending"))
+    logger.info(f"Processed payment batch: {len(results)} notifications, {matched} matched")
+    return {"results": results, "matched": matched}
+
+@app.post("/internal/products/{product_id}/stock/reset")
+async def reset_product_stock(
+    product_id: int,
+    _: bool = Depends(verify_token)
+):
+    """Re-seed a product's stock counters, after products.stock was changed outside the ORM"""
+    await stock_reservations.reset(product_id)
+    return {"status": "reset"}
+
+@app.get("/internal/deliveries/dead")
+async def list_dead_deliveries(
+    count: int = Query(100, ge=1, le=1000),
+    _: bool = Depends(verify_token)
+):
+    """Delivery jobs that exhausted their retries"""
+    return {"jobs": await delivery_queue.dead_letters(count)}
+
+@app.post("/internal/deliveries/dead/{entry_id}/retry")
+async def retry_dead_delivery(
+    entry_id: str,
+    _: bool = Depends(verify_token)
+):
+    """Queue a dead-lettered delivery job again"""
+    if not await delivery_queue.requeue_dead(entry_id):
+        raise HTTPException(status_code=404, detail="Dead-lettered job not found")
+    return {"status": "queued"}
+
+async def process_payment_notifications(
+    notifications: List[PaymentNotification],
+    db: AsyncSession
+) -> List[dict]:
+    """Match, record and settle payment notifications in a single transaction
+    
+    Returns one result per notification, in order, with status success,
+    pending (recorded, awaiting confirmations), duplicate or no_match. A
+    confirmed notification for a transfer recorded as pending upgrades that
+    payment and pays its order.
+    """
+    from sqlalchemy import select, update, insert
+    
+    results = [{"tx_hash": n.tx_hash, "status": "no_match", "order_id": None} for n in notifications]
+    
+    # Resolve orders from the match index; misses never reach the database
+    candidates = {}
+    seen_hashes = set()
+    order_ids = await payment_index.lookup_many(
+        [(notification.to_address, notification.amount) for notification in notifications]
+    )
+    for i, (notification, order_id) in enumerate(zip(notifications, order_ids)):
+        if order_id is None:
+            logger.warning(f"No matching order found for payment: {notification.tx_hash}")
+            continue
+        if notification.tx_hash in seen_hashes:
+            results[i]["status"] = "duplicate"
+            continue
+        seen_hashes.add(notification.tx_hash)
+        candidates[i] = order_id
+    
+    if not candidates:
+        return results
+    
+    # Skip transfers that were already recorded, unless one recorded as pending is now confirmed
+    result = await db.execute(
+        select(Payment.id, Payment.tx_hash, Payment.order_id, Payment.status).where(
+            Payment.tx_hash.in_([notifications[i].tx_hash for i in candidates])
+        )
+    )
+    recorded = {row.tx_hash: row for row in result.all()}
+    upgrades = {}
+    for i in list(candidates):
+        payment = recorded.get(notifications[i].tx_hash)
+        if payment is None:
+            continue
+        if payment.status == "pending" and notifications[i].confirmations >= 1:
+            candidates[i] = payment.order_id
+            upgrades[i] = payment.id
+            continue
+        results[i]["status"] = "duplicate"
+        del candidates[i]
+    
+    # Flip every confirmed order in one conditional UPDATE; it guards against stale
+    # index entries from other replicas and against two transfers for one order
+    confirmed_ids = {
+        order_id for i, order_id in candidates.items()
+        if notifications[i].confirmations >= 1
+    }
+    paid_orders = {}
+    if confirmed_ids:
+        result = await db.execute(
+            update(Order)
+            .where(Order.id.in_(confirmed_ids), Order.status == "pending_payment")
+            .values(status="paid", paid_at=datetime.utcnow())
+            .returning(
+                Order.id, Order.payment_address, Order.total_amount,
+                Order.unit_price, Order.quantity, Order.created_at
             )
+            .execution_options(synchronize_session=False)
         )
+        paid_orders = {row.id: row for row in result.all()}
+    
+    settled = set()
+    rows = []
+    upgraded_rows = []
+    for i, order_id in candidates.items():
+        notification = notifications[i]
+        confirmed = notification.confirmations >= 1
+        if confirmed and (order_id not in paid_orders or order_id in settled):
+            await payment_index.remove(notification.to_address, notification.amount, order_id)
+            logger.warning(f"Order {order_id} is no longer pending for payment: {notification.tx_hash}")
+            continue
+        if confirmed:
+            settled.add(order_id)
+        results[i]["status"] = "success" if confirmed else "pending"
+        results[i]["order_id"] = order_id
         
-        result = await db.execute(query)
-        order = result.scalar_one_or_none()
-        
-        if not order:
-            logger.warning(f"No matching order found for payment: {payment_data.tx_hash}")
-            return {"status": "no_match"}
+        if i in upgrades:
+            upgraded_rows.append({
+                "id": upgrades[i],
+                "confirmations": notification.confirmations,
+                "status": "confirmed",
+                "updated_at": datetime.utcnow()
+            })
+            continue
+        rows.append({
+            "order_id": order_id,
+            "tx_hash": notification.tx_hash,
+            "from_address": notification.from_address,
+            "to_address": notification.to_address,
+            "amount": notification.amount,
+            "token": notification.token,
+            "confirmations": notification.confirmations,
+            "status": "confirmed" if confirmed else "pending",
+            "created_at": datetime.utcnow()
+        })
+    
+    if rows:
+        await db.execute(insert(Payment), rows)
+    if upgraded_rows:
+        await db.execute(update(Payment), upgraded_rows)
+    await db.commit()
+    
+    for order_id in settled:
+        # The amount no longer identifies a pending order, recycle its suffix
+        paid_order = paid_orders[order_id]
+        await payment_index.remove(paid_order.payment_address, paid_order.total_amount, order_id)
+        await payment_allocator.release_for_order(paid_order, cooldown=PAYMENT_SUFFIX_COOLDOWN)
+        await stock_reservations.commit(order_id)
         
-        # Create payment record
-        payment = Payment(
-            order_id=order.id,
-            tx_hash=payment_data.tx_hash,
-            from_address=payment_data.from_address,
-            to_address=payment_data.to_address,
-            amount=payment_data.amount,
-            token=payment_data.token,
-            confirmations=payment_data.confirmations,
-            status="confirmed" if payment_data.confirmations >= 1 else "pending",
-            created_at=datetime.utcnow()
+        # Delivery runs on the worker pool; the notification returns once the payment is recorded
+        await delivery_queue.enqueue(order_id)
+    
+    await publish_order_events(redis_client, (
+        order_event("paid", order_id, paid_orders[order_id].payment_address, paid_orders[order_id].total_amount)
+        for order_id in settled
+    ))
+    
+    for result in results:
+        if result["status"] in ("success", "pending"):
+            logger.info(f"Payment processed for order {result['order_id']}: {result['tx_hash']}")
+    
+    return results
+
+async def generate_unique_payment_amount(payment_address: str, base_amount: Decimal, token: str) -> Optional[int]:
+    """Allocate a unique 4-digit suffix for payment amount, None if all are taken"""
+    lease_seconds = ORDER_TIMEOUT_MINUTES * 60 + PAYMENT_GRACE_SECONDS
+    return await payment_allocator.allocate(payment_address, base_amount, lease_seconds, token)
+
+async def reserve_stock(order: Order, db: AsyncSession) -> bool:
+    """Reserve the order's units until it expires, retrying once after reclaiming expired reservations"""
+    from sqlalchemy import select, func
+    
+    async def load_available() -> int:
+        # Physical stock minus units held by other orders that were not delivered yet
+        result = await db.execute(
+            select(func.coalesce(func.sum(Order.quantity), 0)).where(
+                Order.product_id == order.product_id,
+                Order.status.in_(["pending_payment", "paid", "delivering"]),
+                Order.id != order.id
+            )
         )
-        
-        db.add(payment)
-        
-        # Update order status
-        if payment_data.confirmations >= 1:
-            order.status = "paid"
-            order.paid_at = datetime.utcnow()
-            
-            # Trigger delivery process
-            await trigger_delivery(order.id, db)
-        
-        await db.commit()
-        
-        logger.info(f"Payment processed for order {order.id}: {payment_data.tx_hash}")
-        return {"status": "success", "order_id": order.id}
-        
-    except Exception as e:
-        logger.error(f"Error processing payment notification: {e}")
-        raise HTTPException(status_code=500, detail="Failed to process payment")
+        product = await db.get(Product, order.product_id)
+        return product.stock - int(result.scalar())
+    
+    ttl_seconds = ORDER_TIMEOUT_MINUTES * 60 + PAYMENT_GRACE_SECONDS
+    for attempt in range(2):
+        if await stock_reservations.reserve(order.id, order.product_id, order.quantity, ttl_seconds, load_available):
+            return True
+        if attempt == 0 and not await stock_reservations.reclaim_expired():
+            break
+    return False
+
+async def warm_payment_index():
+    """Load every pending order into the payment match index"""
+    from sqlalchemy import select
+    
+    async with async_session_factory() as session:
+        result = await session.execute(
+            select(Order.id, Order.payment_address, Order.total_amount, Order.expires_at)
+            .where(Order.status == "pending_payment")
+        )
+        await payment_index.warm(result.all())
 
-async def generate_unique_payment_amount() -> str:
-    """Generate unique 4-digit suffix for payment amount"""
-    # Simple implementation - in production, use distributed counter or UUID-based
-    suffix = secrets.randbelow(10000)
-    return f"{suffix:04d}"
+async def requeue_undelivered_orders():
+    """Queue delivery of paid orders that were never delivered, e.g. after a crash"""
+    from sqlalchemy import select
+    
+    async with async_session_factory() as session:
+        result = await session.execute(select(Order.id).where(Order.status == "paid"))
+        order_ids = result.scalars().all()
+    
+    for order_id in order_ids:
+        await delivery_queue.enqueue(order_id)
+    if order_ids:
+        logger.info(f"Queued {len(order_ids)} undelivered paid orders")
+
+async def release_expired_orders(orders: List):
+    """Free what a batch of just-expired orders held and announce their expiry"""
+    for order in orders:
+        await payment_index.remove(order.payment_address, order.total_amount, order.id)
+        await payment_allocator.release_for_order(order)
+        await stock_reservations.release(order.id)
+    
+    await publish_order_events(redis_client, (
+        order_event("expired", order.id, order.payment_address, order.total_amount)
+        for order in orders
+    ))
 
 async def monitor_payment(order_id: int):
     """Background task to monitor payment for an order"""
@@ -329,35 +743,54 @@ async def monitor_payment(order_id: int):
     # For now, it's a placeholder
     logger.info(f"Started payment monitoring for order {order_id}")
 
-async def trigger_delivery(order_id: int, db: AsyncSession):
-    """Trigger product delivery after payment confirmation"""
-    try:
-        order = await db.get(Order, order_id)
-        if not order:
+async def trigger_delivery(order_id: int):
+    """Deliver a paid order; run by the delivery workers
+    
+    Idempotent: only an order still in `paid` is delivered, and the status
+    change, stock decrement and completion commit together, so a job that
+    runs twice or is retried after a crash delivers at most once.
+    """
+    from sqlalchemy import update
+    
+    async with async_session_factory() as db:
+        # Claim the order; a concurrent duplicate job blocks on the row lock and then finds nothing
+        with timed_stage("claim"):
+            result = await db.execute(
+                update(Order)
+                .where(Order.id == order_id, Order.status == "paid")
+                .values(status="delivering")
+                .returning(Order.product_id, Order.quantity)
+                .execution_options(synchronize_session=False)
+            )
+            order = result.first()
+        if order is None:
+            await db.rollback()
             return
         
-        # Update order status
-        order.status = "delivering"
-        
-        # Decrease product stock
-        product = await db.get(Product, order.product_id)
-        if product:
-            product.stock -= order.quantity
-        
-        # In a real implementation, this would:
-        # 1. Decrypt and retrieve the product file
-        # 2. Generate a temporary download link
-        # 3. Send the link to the user via bot
+        with timed_stage("deliver"):
+            # In a real implementation, this would:
+            # 1. Decrypt and retrieve the product file
+            # 2. Generate a temporary download link
+            # 3. Send the link to the user via bot
+            pass
         
-        order.status = "completed"
-        order.delivered_at = datetime.utcnow()
-        
-        await db.commit()
+        with timed_stage("commit"):
+            # Decrease physical stock; the units were already reserved when the order was created
+            await db.execute(
+                update(Product)
+                .where(Product.id == order.product_id)
+                .values(stock=Product.stock - order.quantity)
+                .execution_options(synchronize_session=False)
+            )
+            await db.execute(
+                update(Order)
+                .where(Order.id == order_id)
+                .values(status="completed", delivered_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
         
         logger.info(f"Delivery completed for order {order_id}")
-        
-    except Exception as e:
-        logger.error(f"Error in delivery process: {e}")
 
 if __name__ == "__main__":
     uvicorn.run(
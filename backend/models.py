@@ -2,7 +2,7 @@
 Database models for TeleBot Sales Platform
 """
 
-from sqlalchemy import Column, Integer, String, Decimal, DateTime, Text, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Numeric, DateTime, Text, Boolean, ForeignKey, Index, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -18,9 +18,9 @@ class User(Base):
     first_name = Column(String(255), nullable=True)
     last_name = Column(String(255), nullable=True)
     language_code = Column(String(10), default="en")
-    balance = Column(Decimal(10, 2), default=0.00)
+    balance = Column(Numeric(10, 2), default=0.00)
     total_orders = Column(Integer, default=0)
-    total_spent = Column(Decimal(10, 2), default=0.00)
+    total_spent = Column(Numeric(10, 2), default=0.00)
     is_active = Column(Boolean, default=True)
     is_admin = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -39,8 +39,8 @@ class Product(Base):
     category = Column(String(100), nullable=False, index=True)  # session, api, etc.
     country = Column(String(100), nullable=True, index=True)
     type = Column(String(100), nullable=True)  # phone, email, etc.
-    price = Column(Decimal(10, 2), nullable=False)
-    cost_price = Column(Decimal(10, 2), nullable=True)
+    price = Column(Numeric(10, 2), nullable=False)
+    cost_price = Column(Numeric(10, 2), nullable=True)
     stock = Column(Integer, default=0)
     file_path_encrypted = Column(String(500), nullable=True)  # Path to encrypted file
     status = Column(String(50), default="active")  # active, inactive, out_of_stock
@@ -51,6 +51,11 @@ class Product(Base):
     
     # Relationships
     orders = relationship("Order", back_populates="product")
+    
+    __table_args__ = (
+        # Covers filtered, keyset-paginated catalog listings
+        Index("idx_products_listing", "status", "category", "country", "id"),
+    )
 
 class Order(Base):
     """Order model"""
@@ -60,8 +65,8 @@ class Order(Base):
     user_id = Column(Integer, ForeignKey("users.tg_id"), nullable=False, index=True)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
     quantity = Column(Integer, nullable=False)
-    unit_price = Column(Decimal(10, 2), nullable=False)
-    total_amount = Column(Decimal(18, 6), nullable=False, unique=True)  # Unique for payment matching
+    unit_price = Column(Numeric(10, 2), nullable=False)
+    total_amount = Column(Numeric(18, 6), nullable=False)  # Unique among pending orders, see uq_orders_pending_amount
     status = Column(String(50), default="pending_payment")  # pending_payment, paid, delivering, completed, cancelled, expired
     payment_address = Column(String(255), nullable=False)
     download_token = Column(String(255), nullable=True)  # Temporary download token
@@ -75,6 +80,28 @@ class Order(Base):
     user = relationship("User", back_populates="orders")
     product = relationship("Product", back_populates="orders")
     payments = relationship("Payment", back_populates="order")
+    
+    __table_args__ = (
+        # Keyset-paginated order history per user, newest first
+        Index("idx_orders_user_created", "user_id", "created_at", "id"),
+        # Payment amount suffixes are recycled once an order closes, so the amount
+        # only has to be unique per address among orders still awaiting payment
+        Index(
+            "uq_orders_pending_amount",
+            "payment_address",
+            "total_amount",
+            unique=True,
+            postgresql_where=text("status = 'pending_payment'"),
+            sqlite_where=text("status = 'pending_payment'")
+        ),
+        # Expired-order sweeper scans pending orders by deadline
+        Index(
+            "idx_orders_pending_expiry",
+            "expires_at",
+            postgresql_where=text("status = 'pending_payment'"),
+            sqlite_where=text("status = 'pending_payment'")
+        ),
+    )
 
 class Payment(Base):
     """Payment transaction model"""
@@ -85,7 +112,7 @@ class Payment(Base):
     tx_hash = Column(String(255), nullable=False, unique=True, index=True)
     from_address = Column(String(255), nullable=False)
     to_address = Column(String(255), nullable=False)
-    amount = Column(Decimal(18, 6), nullable=False)
+    amount = Column(Numeric(18, 6), nullable=False)
     token = Column(String(50), default="USDT-TRC20")
     confirmations = Column(Integer, default=0)
     status = Column(String(50), default="pending")  # pending, confirmed, failed
@@ -103,11 +130,11 @@ class Agent(Base):
     name = Column(String(255), nullable=False)
     email = Column(String(255), nullable=False, unique=True)
     api_key = Column(String(255), nullable=False, unique=True)
-    commission_rate = Column(Decimal(5, 2), default=10.00)  # Percentage
+    commission_rate = Column(Numeric(5, 2), default=10.00)  # Percentage
     is_active = Column(Boolean, default=True)
     payment_address = Column(String(255), nullable=True)  # Agent's TRON address
-    total_sales = Column(Decimal(10, 2), default=0.00)
-    total_commission = Column(Decimal(10, 2), default=0.00)
+    total_sales = Column(Numeric(10, 2), default=0.00)
+    total_commission = Column(Numeric(10, 2), default=0.00)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -153,8 +180,8 @@ class PaymentRule(Base):
     min_confirmations = Column(Integer, default=1)
     payment_timeout_minutes = Column(Integer, default=15)
     allowed_tokens = Column(Text, default='["USDT-TRC20"]')  # JSON array
-    min_amount = Column(Decimal(18, 6), default=0.000001)
-    max_amount = Column(Decimal(18, 6), default=999999.999999)
+    min_amount = Column(Numeric(18, 6), default=0.000001)
+    max_amount = Column(Numeric(18, 6), default=999999.999999)
     precision_digits = Column(Integer, default=6)  # For unique amount generation
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
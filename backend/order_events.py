@@ -0,0 +1,52 @@
+"""
+Order lifecycle events
+
+Published on a Redis pub/sub channel so other services (e.g. the payment
+monitor) can react to orders opening and closing without polling the
+database. Events are best effort: subscribers must tolerate missed ones.
+"""
+
+import json
+import logging
+import time
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+ORDER_EVENTS_CHANNEL = "orders:events"
+
+
+def order_event(
+    event_type: str, order_id: int, payment_address: str, total_amount, deadline: Optional[float] = None
+) -> dict:
+    """Build an event payload; event_type is created, paid or expired
+    
+    deadline (epoch seconds) is when a created order stops accepting payment.
+    """
+    event = {
+        "type": event_type,
+        "order_id": order_id,
+        "payment_address": payment_address,
+        "total_amount": str(total_amount),
+        "at": time.time()
+    }
+    if deadline is not None:
+        event["deadline"] = deadline
+    return event
+
+
+async def publish_order_events(redis_client, events: Iterable[dict]) -> int:
+    """Publish events in one round trip, returning how many were sent"""
+    events = list(events)
+    if redis_client is None or not events:
+        return 0
+
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for event in events:
+                pipe.publish(ORDER_EVENTS_CHANNEL, json.dumps(event))
+            await pipe.execute()
+    except Exception as e:
+        logger.warning(f"Failed to publish {len(events)} order events: {e}")
+        return 0
+    return len(events)
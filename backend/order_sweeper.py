@@ -0,0 +1,152 @@
+"""
+Expired order sweeper
+
+Periodically moves unpaid orders past their deadline to `expired`, in
+bounded batches so no statement locks or rewrites more than batch_size
+rows. Each committed batch is handed to a callback that releases what the
+orders held (stock, amount suffix, match index entry). On PostgreSQL an
+advisory lock makes sure only one replica sweeps at a time.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List
+
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import select, text, update
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from models import Order
+
+logger = logging.getLogger(__name__)
+
+# pg_try_advisory_lock key shared by every backend replica
+SWEEP_LOCK_KEY = 0x7E1E_0001
+
+SWEEP_DURATION = Histogram(
+    "order_sweep_duration_seconds",
+    "Duration of expired order sweeps",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+SWEEP_ROWS = Histogram(
+    "order_sweep_rows",
+    "Orders expired per sweep",
+    buckets=(0, 1, 10, 100, 1000, 5000, 10000, 50000, 100000)
+)
+ORDERS_EXPIRED = Counter(
+    "orders_expired_total",
+    "Orders moved to expired by the sweeper"
+)
+SWEEP_SKIPPED = Counter(
+    "order_sweep_skipped_total",
+    "Sweeps skipped because another replica holds the sweep lock"
+)
+LAST_SWEEP = Gauge(
+    "order_sweep_last_success_timestamp_seconds",
+    "When the last sweep finished"
+)
+
+
+class OrderSweeper:
+    """Expire overdue pending orders on a schedule"""
+
+    def __init__(
+        self,
+        engine: AsyncEngine,
+        on_expired: Callable[[List], Awaitable[None]],
+        interval: float = 60.0,
+        batch_size: int = 5000,
+        grace_seconds: float = 0
+    ):
+        self.engine = engine
+        self.on_expired = on_expired
+        self.interval = interval
+        self.batch_size = batch_size
+        self.grace_seconds = grace_seconds
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._loop())
+        logger.info(f"Order sweeper started (interval={self.interval}s, batch_size={self.batch_size})")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def sweep(self) -> int:
+        """Expire every overdue order, returning how many were expired (-1 if another replica is sweeping)"""
+        start = time.perf_counter()
+        # Late payments are still accepted during the grace period
+        cutoff = datetime.utcnow() - timedelta(seconds=self.grace_seconds)
+        expired = 0
+        batches = 0
+
+        async with self.engine.connect() as conn:
+            advisory = conn.dialect.name == "postgresql"
+            if advisory:
+                if not await conn.scalar(text("SELECT pg_try_advisory_lock(:key)"), {"key": SWEEP_LOCK_KEY}):
+                    await conn.rollback()
+                    SWEEP_SKIPPED.inc()
+                    return -1
+                await conn.commit()
+
+            try:
+                while True:
+                    overdue = (
+                        select(Order.id)
+                        .where(Order.status == "pending_payment", Order.expires_at < cutoff)
+                        .order_by(Order.expires_at)
+                        .limit(self.batch_size)
+                        .with_for_update(skip_locked=True)
+                    )
+                    result = await conn.execute(
+                        update(Order)
+                        .where(Order.id.in_(overdue.scalar_subquery()), Order.status == "pending_payment")
+                        .values(status="expired")
+                        .returning(
+                            Order.id, Order.product_id, Order.payment_address,
+                            Order.total_amount, Order.unit_price, Order.quantity, Order.created_at
+                        )
+                    )
+                    rows = result.all()
+                    await conn.commit()
+
+                    if not rows:
+                        break
+                    batches += 1
+                    expired += len(rows)
+                    # Stock and suffix leases expire on their own, so a failure here only delays their release
+                    await self.on_expired(rows)
+                    if len(rows) < self.batch_size:
+                        break
+            finally:
+                if advisory:
+                    # A failed statement leaves the transaction aborted; the unlock needs a fresh one
+                    await conn.rollback()
+                    await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": SWEEP_LOCK_KEY})
+                    await conn.commit()
+
+        duration = time.perf_counter() - start
+        SWEEP_DURATION.observe(duration)
+        SWEEP_ROWS.observe(expired)
+        ORDERS_EXPIRED.inc(expired)
+        LAST_SWEEP.set_to_current_time()
+        if expired:
+            logger.info(f"Expired {expired} orders in {batches} batches ({duration:.2f}s)")
+        else:
+            logger.debug(f"Order sweep found nothing to expire ({duration:.3f}s)")
+        return expired
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Order sweep failed: {e}")
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,86 @@
+"""
+Keyset (cursor) pagination helpers
+
+Pages are addressed by an opaque cursor holding the ordering key of the
+last row served, so fetching page N costs the same as fetching page 1
+instead of scanning and discarding N * limit rows like OFFSET does.
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Sequence, Tuple
+
+from sqlalchemy import tuple_
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor cannot be decoded"""
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """Encode ordering key values as an opaque, URL-safe cursor"""
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> List[Any]:
+    """Decode a cursor produced by encode_cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor("Malformed cursor") from e
+
+    if not isinstance(values, list):
+        raise InvalidCursor("Malformed cursor")
+    return values
+
+
+class Keyset:
+    """Ordering columns of a keyset-paginated query
+
+    The columns must form a unique key (end with the primary key) and
+    should be covered by an index together with the query's filters.
+    """
+
+    def __init__(self, *columns, descending: bool = False):
+        self.columns = columns
+        self.descending = descending
+
+    def apply(self, query, after: Optional[str], limit: int):
+        """Order the query, seek past the cursor and fetch one extra row to detect more pages"""
+        if after:
+            values = self._parse(decode_cursor(after))
+            key = tuple_(*self.columns)
+            query = query.where(key < tuple_(*values) if self.descending else key > tuple_(*values))
+
+        order = [column.desc() if self.descending else column.asc() for column in self.columns]
+        return query.order_by(*order).limit(limit + 1)
+
+    def page(self, rows: Sequence[Any], limit: int) -> Tuple[List[Any], Optional[str]]:
+        """Split the fetched rows into the page and the cursor of the next one"""
+        rows = list(rows)
+        if len(rows) <= limit:
+            return rows, None
+
+        rows = rows[:limit]
+        last = rows[-1]
+        return rows, encode_cursor([getattr(last, column.key) for column in self.columns])
+
+    def _parse(self, values: List[Any]) -> List[Any]:
+        if len(values) != len(self.columns):
+            raise InvalidCursor("Cursor does not match this listing")
+
+        parsed = []
+        for column, value in zip(self.columns, values):
+            try:
+                if column.type.python_type is datetime:
+                    value = datetime.fromisoformat(value)
+                elif column.type.python_type is int:
+                    value = int(value)
+            except (TypeError, ValueError) as e:
+                raise InvalidCursor("Malformed cursor") from e
+            parsed.append(value)
+        return parsed
@@ -0,0 +1,290 @@
+"""
+Unique payment amount suffix allocator
+
+Every pending order is identified on-chain by its exact amount, so two
+pending orders for the same payment address and base price must never share
+the same 6-decimal suffix. Suffixes are tracked in a free-suffix bitmap per
+(payment address, base amount): in Redis, or in-process when no Redis is
+configured. When a configured Redis fails, allocation fails too: the local
+bitmap knows nothing of the suffixes other replicas leased, so falling back
+to it could give two open orders the same amount.
+
+Each lease carries a token naming the order that holds it, so a late
+release from an order that already gave its suffix up cannot free it from
+under the next order. A paid order's suffix is held for a cooldown before
+reuse, so a duplicate transfer sent after payment never matches a new order.
+"""
+
+import asyncio
+import heapq
+import logging
+import time
+from decimal import Decimal
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Suffix N is encoded as base_amount + N / 1_000_000 (0.00XXXX)
+SUFFIX_CAPACITY = 10000
+SUFFIX_SCALE = Decimal("0.000001")
+
+BITMAP_KEY_PREFIX = "payalloc:bitmap"
+LEASES_KEY = "payalloc:leases"
+
+
+class AllocatorUnavailable(Exception):
+    """Redis is configured but could not be reached, so no suffix can safely be handed out"""
+
+# Bit 0 is reserved so a payment of exactly the base amount never matches an order.
+# KEYS[1] = bitmap, KEYS[2] = lease zset
+# ARGV[1] = capacity, ARGV[2] = lease expiry (epoch seconds),
+# ARGV[3] / ARGV[4] = lease member before / after the suffix
+ALLOCATE_SCRIPT = """
+if redis.call('GETBIT', KEYS[1], 0) == 0 then
+    redis.call('SETBIT', KEYS[1], 0, 1)
+end
+local pos = redis.call('BITPOS', KEYS[1], 0)
+if pos < 0 or pos >= tonumber(ARGV[1]) then
+    return -1
+end
+redis.call('SETBIT', KEYS[1], pos, 1)
+redis.call('ZADD', KEYS[2], ARGV[2], ARGV[3] .. pos .. ARGV[4])
+return pos
+"""
+
+# The member names the holding order, so only that order's lease is released.
+# A cooldown keeps the bit set and moves the lease's expiry up to ARGV[3] instead.
+# KEYS[1] = bitmap, KEYS[2] = lease zset
+# ARGV[1] = lease member, ARGV[2] = suffix, ARGV[3] = reusable from (epoch seconds, 0 = now)
+RELEASE_SCRIPT = """
+if not redis.call('ZSCORE', KEYS[2], ARGV[1]) then
+    return 0
+end
+if tonumber(ARGV[3]) > 0 then
+    redis.call('ZADD', KEYS[2], 'XX', ARGV[3], ARGV[1])
+    return 1
+end
+redis.call('ZREM', KEYS[2], ARGV[1])
+redis.call('SETBIT', KEYS[1], ARGV[2], 0)
+return 1
+"""
+
+
+def normalize_base_amount(base_amount: Decimal) -> str:
+    """Canonical string form of a base amount, used in allocator keys"""
+    return str(Decimal(base_amount).quantize(Decimal("0.01")))
+
+
+def suffix_to_amount(base_amount: Decimal, suffix: int) -> Decimal:
+    """Build the unique payable amount for a base amount and suffix"""
+    return (Decimal(base_amount) + Decimal(suffix) * SUFFIX_SCALE).quantize(SUFFIX_SCALE)
+
+
+def amount_to_suffix(base_amount: Decimal, total_amount: Decimal) -> int:
+    """Recover the suffix from an order's total and base amounts"""
+    return int((Decimal(total_amount) - Decimal(base_amount)) / SUFFIX_SCALE)
+
+
+def lease_token(created_at: datetime) -> str:
+    """Lease token of an order, from its creation time, set before its suffix is allocated"""
+    return created_at.strftime("%Y%m%d%H%M%S%f")
+
+
+class PaymentSuffixAllocator:
+    """Hands out and takes back payment amount suffixes in O(1)
+
+    Each (address, base amount) pair owns a bitmap of SUFFIX_CAPACITY bits.
+    Allocation claims the lowest clear bit and records a lease that expires
+    with the order, so suffixes of orders that are never closed explicitly
+    are still reclaimed, by start()'s background loop or when a bitmap is full.
+    """
+
+    def __init__(self, redis_client=None, capacity: int = SUFFIX_CAPACITY, reclaim_interval: float = 60.0):
+        self.redis = redis_client
+        self.capacity = capacity
+        self.reclaim_interval = reclaim_interval
+        self._task = None
+        self._allocate_script = None
+        self._release_script = None
+        if self.redis is not None:
+            self._allocate_script = self.redis.register_script(ALLOCATE_SCRIPT)
+            self._release_script = self.redis.register_script(RELEASE_SCRIPT)
+
+        # In-process fallback state
+        self._bitmaps: Dict[Tuple[str, str], int] = {}
+        self._leases: Dict[str, float] = {}
+        self._lease_heap: List[Tuple[float, str]] = []
+
+    @staticmethod
+    def _lease_member(address: str, base: str, suffix, token: str) -> str:
+        return f"{address}|{base}|{suffix}|{token}"
+
+    @staticmethod
+    def _bitmap_key(address: str, base: str) -> str:
+        return f"{BITMAP_KEY_PREFIX}:{address}:{base}"
+
+    async def allocate(
+        self,
+        address: str,
+        base_amount: Decimal,
+        lease_seconds: float,
+        token: str
+    ) -> Optional[int]:
+        """Reserve a free suffix for the order named by token, or return None when the suffix space is full
+
+        Raises AllocatorUnavailable when Redis fails.
+        """
+        base = normalize_base_amount(base_amount)
+        expires_at = time.time() + lease_seconds
+
+        suffix = await self._allocate_once(address, base, expires_at, token)
+        if suffix is None:
+            # Space looks full - reclaim leases of orders nobody closed and retry once
+            if await self.reclaim_expired() > 0:
+                suffix = await self._allocate_once(address, base, expires_at, token)
+
+        if suffix is None:
+            logger.warning(f"Payment suffix space exhausted for {address} / {base}")
+        return suffix
+
+    async def release(
+        self,
+        address: str,
+        base_amount: Decimal,
+        suffix: int,
+        token: str,
+        cooldown: float = 0
+    ) -> bool:
+        """Return a suffix to the free pool, at once or after `cooldown` seconds
+
+        Only the lease of the order named by token is released, so releasing
+        twice, or after the suffix went to another order, is a no-op.
+        """
+        base = normalize_base_amount(base_amount)
+        member = self._lease_member(address, base, suffix, token)
+        reusable_at = time.time() + cooldown if cooldown > 0 else 0
+
+        if self._release_script is not None:
+            try:
+                released = await self._release_script(
+                    keys=[self._bitmap_key(address, base), LEASES_KEY],
+                    args=[member, suffix, reusable_at]
+                )
+                return bool(released)
+            except Exception as e:
+                # The lease runs out and is reclaimed then
+                logger.warning(f"Redis suffix release failed: {e}")
+                return False
+
+        return self._release_local(address, base, suffix, member, reusable_at)
+
+    async def release_for_order(self, order, cooldown: float = 0) -> bool:
+        """Release the suffix held by an order (needs its amounts, payment address and created_at)"""
+        base_amount = order.unit_price * order.quantity
+        suffix = amount_to_suffix(base_amount, order.total_amount)
+        return await self.release(
+            order.payment_address, base_amount, suffix, lease_token(order.created_at), cooldown
+        )
+
+    async def reclaim_expired(self, now: Optional[float] = None) -> int:
+        """Release every suffix whose lease has run out"""
+        now = now or time.time()
+        reclaimed = 0
+
+        if self.redis is not None:
+            try:
+                members = await self.redis.zrangebyscore(LEASES_KEY, "-inf", now)
+                for member in members:
+                    if isinstance(member, bytes):
+                        member = member.decode()
+                    address, base, suffix = member.split("|")[:3]
+                    if await self._release_script(
+                        keys=[self._bitmap_key(address, base), LEASES_KEY],
+                        args=[member, suffix, 0]
+                    ):
+                        reclaimed += 1
+            except Exception as e:
+                logger.warning(f"Redis suffix reclaim failed: {e}")
+
+        while self._lease_heap and self._lease_heap[0][0] <= now:
+            expires_at, member = heapq.heappop(self._lease_heap)
+            # A member can be released and re-leased; only honour the live lease
+            if self._leases.get(member) != expires_at:
+                continue
+            address, base, suffix = member.split("|")[:3]
+            if self._release_local(address, base, int(suffix), member):
+                reclaimed += 1
+
+        if reclaimed:
+            logger.info(f"Reclaimed {reclaimed} expired payment suffixes")
+        return reclaimed
+
+    def start(self):
+        """Reclaim expired and cooled-down leases every reclaim_interval seconds"""
+        self._task = asyncio.create_task(self._reclaim_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _reclaim_loop(self):
+        while True:
+            await asyncio.sleep(self.reclaim_interval)
+            try:
+                await self.reclaim_expired()
+            except Exception as e:
+                logger.error(f"Payment suffix reclaim failed: {e}")
+
+    async def _allocate_once(self, address: str, base: str, expires_at: float, token: str) -> Optional[int]:
+        if self._allocate_script is not None:
+            try:
+                suffix = await self._allocate_script(
+                    keys=[self._bitmap_key(address, base), LEASES_KEY],
+                    args=[self.capacity, expires_at, f"{address}|{base}|", f"|{token}"]
+                )
+                return None if int(suffix) < 0 else int(suffix)
+            except Exception as e:
+                logger.error(f"Redis suffix allocation failed: {e}")
+                raise AllocatorUnavailable(str(e)) from e
+
+        return self._allocate_local(address, base, expires_at, token)
+
+    def _allocate_local(self, address: str, base: str, expires_at: float, token: str) -> Optional[int]:
+        key = (address, base)
+        bitmap = self._bitmaps.get(key, 1)  # bit 0 reserved
+
+        # Lowest clear bit: (x + 1) flips the trailing ones, & ~x isolates the new bit
+        suffix = ((bitmap + 1) & ~bitmap).bit_length() - 1
+        if suffix >= self.capacity:
+            return None
+
+        self._bitmaps[key] = bitmap | (1 << suffix)
+        member = self._lease_member(address, base, suffix, token)
+        self._leases[member] = expires_at
+        heapq.heappush(self._lease_heap, (expires_at, member))
+        return suffix
+
+    def _release_local(self, address: str, base: str, suffix: int, member: str, reusable_at: float = 0) -> bool:
+        if member not in self._leases:
+            return False
+        if reusable_at > 0:
+            self._leases[member] = reusable_at
+            heapq.heappush(self._lease_heap, (reusable_at, member))
+            return True
+        del self._leases[member]
+
+        key = (address, base)
+        bitmap = self._bitmaps.get(key, 1) & ~(1 << suffix)
+        if bitmap == 1:
+            self._bitmaps.pop(key, None)
+        else:
+            self._bitmaps[key] = bitmap
+        return True
+
+    def local_occupancy(self, address: str, base_amount: Decimal) -> int:
+        """Number of suffixes currently leased from the in-process bitmap"""
+        bitmap = self._bitmaps.get((address, normalize_base_amount(base_amount)), 1)
+        return bin(bitmap).count("1") - 1
@@ -0,0 +1,170 @@
+"""
+Pending order match index
+
+Maps (payment address, exact amount) to the id of the pending order that is
+waiting for that payment, so incoming transfers are matched without a
+database query. Entries live in Redis (shared between API replicas) and are
+mirrored in process. Redis is authoritative: another replica may have
+reused an address and amount for a newer order, so every lookup is answered
+from Redis and the mirror only serves while Redis is unreachable, or when
+there is no Redis at all.
+"""
+
+import logging
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+INDEX_KEY_PREFIX = "payidx"
+
+# Delete an entry only while it still names the given order.
+# KEYS[1] = address hash, ARGV[1] = amount, ARGV[2] = order id
+REMOVE_SCRIPT = """
+local value = redis.call('HGET', KEYS[1], ARGV[1])
+if value and string.match(value, '^[^:]+') == ARGV[2] then
+    return redis.call('HDEL', KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+
+def normalize_amount(amount) -> str:
+    """Canonical 6-decimal string form of a payment amount"""
+    return str(Decimal(amount).quantize(Decimal("0.000001")))
+
+
+def _to_epoch(value: datetime) -> float:
+    """Order timestamps are naive UTC datetimes"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class PendingOrderIndex:
+    """(payment address, amount) -> pending order id"""
+
+    def __init__(self, redis_client=None, grace_seconds: int = 0):
+        self.redis = redis_client
+        self.grace_seconds = grace_seconds
+        self._local: Dict[Tuple[str, str], Tuple[int, float]] = {}
+        self.stats = {"hits": 0, "misses": 0, "redis_lookups": 0}
+        self._remove_script = None
+        if self.redis is not None:
+            self._remove_script = self.redis.register_script(REMOVE_SCRIPT)
+
+    @staticmethod
+    def _key(address: str) -> str:
+        return f"{INDEX_KEY_PREFIX}:{address}"
+
+    async def add(self, address: str, amount, order_id: int, expires_at: datetime):
+        """Register a pending order under its payment address and amount"""
+        amount_key = normalize_amount(amount)
+        deadline = _to_epoch(expires_at) + self.grace_seconds
+        self._local[(address, amount_key)] = (order_id, deadline)
+
+        if self.redis is not None:
+            try:
+                key = self._key(address)
+                ttl = int(deadline - time.time()) + 60
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    pipe.hset(key, amount_key, f"{order_id}:{deadline}")
+                    # Keep idle addresses from lingering once all their orders are gone
+                    pipe.expire(key, ttl, gt=True)
+                    pipe.expire(key, ttl, nx=True)
+                    await pipe.execute()
+            except Exception as e:
+                logger.warning(f"Failed to index order {order_id} in Redis: {e}")
+
+    async def remove(self, address: str, amount, order_id: int):
+        """Drop an order's entry once it is paid, expired or cancelled
+
+        An entry that already names a newer order for the same amount is left alone.
+        """
+        amount_key = normalize_amount(amount)
+        entry = self._local.get((address, amount_key))
+        if entry is not None and entry[0] == order_id:
+            del self._local[(address, amount_key)]
+
+        if self.redis is not None:
+            try:
+                await self._remove_script(keys=[self._key(address)], args=[amount_key, order_id])
+            except Exception as e:
+                logger.warning(f"Failed to remove payment index entry {address}/{amount_key}: {e}")
+
+    async def lookup(self, address: str, amount, now: Optional[float] = None) -> Optional[int]:
+        """Return the pending order id waiting for this exact payment, if any"""
+        return (await self.lookup_many([(address, amount)], now))[0]
+
+    async def lookup_many(self, payments: Iterable[Tuple[str, Any]], now: Optional[float] = None) -> List[Optional[int]]:
+        """lookup() for many (address, amount) pairs, answered from Redis in one round trip"""
+        keys = [(address, normalize_amount(amount)) for address, amount in payments]
+        now = now or time.time()
+
+        entries = {key: self._local.get(key) for key in keys}
+        if self.redis is not None and keys:
+            try:
+                stored = await self._lookup_redis(list(entries))
+            except Exception as e:
+                logger.warning(f"Payment index Redis lookup failed, using local mirror: {e}")
+            else:
+                for key, entry in stored.items():
+                    if entry is None:
+                        self._local.pop(key, None)
+                    else:
+                        self._local[key] = entry
+                entries = stored
+
+        return [await self._resolve(address, amount_key, entries[(address, amount_key)], now)
+                for address, amount_key in keys]
+
+    async def _resolve(self, address: str, amount_key: str, entry: Optional[Tuple[int, float]],
+                       now: float) -> Optional[int]:
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+
+        order_id, deadline = entry
+        if deadline < now:
+            self.stats["misses"] += 1
+            await self.remove(address, amount_key, order_id)
+            return None
+
+        self.stats["hits"] += 1
+        return order_id
+
+    async def warm(self, orders: Iterable):
+        """Load pending orders (objects with id, payment_address, total_amount, expires_at)"""
+        count = 0
+        for order in orders:
+            await self.add(order.payment_address, order.total_amount, order.id, order.expires_at)
+            count += 1
+        logger.info(f"Payment match index warmed with {count} pending orders")
+
+    async def _lookup_redis(self, keys: List[Tuple[str, str]]) -> Dict[Tuple[str, str], Optional[Tuple[int, float]]]:
+        """One HMGET per distinct address, all in a single pipeline"""
+        self.stats["redis_lookups"] += 1
+        by_address: Dict[str, List[str]] = {}
+        for address, amount_key in keys:
+            by_address.setdefault(address, []).append(amount_key)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for address, amount_keys in by_address.items():
+                pipe.hmget(self._key(address), amount_keys)
+            answers = await pipe.execute()
+
+        entries = {}
+        for (address, amount_keys), values in zip(by_address.items(), answers):
+            for amount_key, value in zip(amount_keys, values):
+                if value is None:
+                    entries[(address, amount_key)] = None
+                    continue
+                if isinstance(value, bytes):
+                    value = value.decode()
+                order_id, deadline = value.split(":", 1)
+                entries[(address, amount_key)] = (int(order_id), float(deadline))
+        return entries
+
+    def __len__(self) -> int:
+        return len(self._local)
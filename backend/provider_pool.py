@@ -0,0 +1,332 @@
+"""
+TRON node provider pool
+
+Requests go to the healthiest of several nodes rather than a single
+TRON_NODE_URL. Each node keeps an EWMA of its latency and error rate and
+is ranked by them. A read that has not answered within the node's p95
+latency is hedged with a second request to the next node, and the first
+good answer wins. A node that keeps failing is ejected for an
+exponentially growing period; once that runs out it gets a trial
+request, and a success readmits it.
+
+Only indexed nodes (TronGrid or compatible) are used for the /v1 account
+history API. Plain full nodes serve /wallet calls. Requests to indexed
+nodes take a token from the RateLimiter first and carry the API key it
+hands out; a 429 puts that key on cooldown and the request is tried once
+more after it.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional
+
+import aiohttp
+from prometheus_client import Counter, Gauge
+
+from rate_limiter import PRIORITY_BACKGROUND, PRIORITY_DEFAULT, RateLimiter
+
+logger = logging.getLogger(__name__)
+
+NODE_REQUESTS = Counter(
+    "tron_node_requests_total",
+    "Requests sent to each TRON node",
+    ["node", "result"]
+)
+NODE_LATENCY = Gauge(
+    "tron_node_latency_ewma_seconds",
+    "Latency EWMA of each TRON node",
+    ["node"]
+)
+NODE_ERROR_RATE = Gauge(
+    "tron_node_error_rate_ewma",
+    "Error rate EWMA of each TRON node",
+    ["node"]
+)
+NODE_EJECTED = Gauge(
+    "tron_node_ejected",
+    "1 while a TRON node is ejected from rotation",
+    ["node"]
+)
+HEDGED_REQUESTS = Counter(
+    "tron_hedged_requests_total",
+    "Reads that were hedged with a second request, by which one answered first",
+    ["winner"]
+)
+
+# Statuses that say nothing about the request itself; another node may answer it
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class ProviderError(Exception):
+    """Every node tried for a request failed"""
+
+
+@dataclass
+class TronNode:
+    """A TRON HTTP endpoint; indexed nodes also serve the /v1 account history API"""
+    url: str
+    indexed: bool = True
+
+
+def nodes_from_env(default_url: str = "https://api.trongrid.io") -> List[TronNode]:
+    """TRON_NODE_URLS (TronGrid-compatible, falls back to TRON_NODE_URL) plus TRON_FULL_NODE_URLS (/wallet only)"""
+    indexed = os.getenv("TRON_NODE_URLS") or os.getenv("TRON_NODE_URL") or default_url
+    full = os.getenv("TRON_FULL_NODE_URLS", "")
+    nodes = [TronNode(url.strip().rstrip("/")) for url in indexed.split(",") if url.strip()]
+    nodes += [TronNode(url.strip().rstrip("/"), indexed=False) for url in full.split(",") if url.strip()]
+    return nodes
+
+
+@dataclass
+class ProviderResponse:
+    """Status and body of a request, read before its connection was released"""
+    status: int
+    body: bytes
+    node: str
+
+    def json(self) -> Any:
+        return json.loads(self.body) if self.body else {}
+
+
+class NodeHealth:
+    """Latency and error EWMAs and ejection state of one node"""
+
+    def __init__(self, node: TronNode, window: int):
+        self.node = node
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.in_flight = 0
+
+    def p95(self) -> Optional[float]:
+        if len(self.latencies) < 20:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[int(len(ordered) * 0.95)]
+
+
+class ProviderPool:
+    """Routes TRON HTTP requests over several nodes by health"""
+
+    def __init__(
+        self,
+        nodes: List[TronNode],
+        limiter: Optional[RateLimiter] = None,
+        alpha: float = 0.2,
+        hedge_default: float = 1.0,
+        hedge_min: float = 0.05,
+        max_attempts: int = 3,
+        eject_failures: int = 3,
+        eject_error_rate: float = 0.5,
+        eject_base: float = 15.0,
+        eject_max: float = 300.0,
+        latency_window: int = 200
+    ):
+        if not nodes:
+            raise ValueError("ProviderPool needs at least one node")
+        self.nodes = [NodeHealth(node, latency_window) for node in nodes]
+        self.limiter = limiter
+        self.alpha = alpha
+        self.hedge_default = hedge_default
+        self.hedge_min = hedge_min
+        self.max_attempts = max_attempts
+        self.eject_failures = eject_failures
+        self.eject_error_rate = eject_error_rate
+        self.eject_base = eject_base
+        self.eject_max = eject_max
+
+    @property
+    def primary_url(self) -> str:
+        return self.nodes[0].node.url
+
+    def ranked(self, path: str) -> List[NodeHealth]:
+        """Nodes able to serve path, healthiest first; ejected ones only when nothing else is left"""
+        eligible = [h for h in self.nodes if h.node.indexed or not path.startswith("/v1/")]
+        now = time.monotonic()
+        available = [h for h in eligible if h.ejected_until <= now]
+        if available:
+            return sorted(available, key=self._score)
+        return sorted(eligible, key=lambda h: h.ejected_until)
+
+    def _score(self, health: NodeHealth) -> float:
+        # Unmeasured nodes score 0 so each one is tried early
+        latency = health.latency or 0.0
+        return latency * (1 + 4 * health.error_rate) * (1 + health.in_flight / 10)
+
+    def hedge_delay(self, health: NodeHealth) -> float:
+        p95 = health.p95()
+        return self.hedge_default if p95 is None else max(p95, self.hedge_min)
+
+    async def request(
+        self,
+        session: aiohttp.ClientSession,
+        method: str,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        json_body: Any = None,
+        hedge: bool = True,
+        priority: int = PRIORITY_DEFAULT
+    ) -> ProviderResponse:
+        """Send a request to the best node, failing over and (for reads) hedging as needed
+
+        Returns the first response that is not a retryable error. If every
+        node tried answered with one, the last of those is returned;
+        ProviderError is raised if none answered at all. priority is the
+        rate limiter lane the request waits in.
+        """
+        response = await self._request_once(session, method, path, params, json_body, hedge, priority)
+        if response.status == 429 and self.limiter is not None:
+            # Rate limited everywhere: the next attempt waits out the keys' Retry-After
+            response = await self._request_once(session, method, path, params, json_body, hedge, priority)
+        return response
+
+    async def _request_once(self, session, method, path, params, json_body, hedge, priority) -> ProviderResponse:
+        candidates = self.ranked(path)[:self.max_attempts]
+        if not candidates:
+            raise ProviderError(f"No TRON node serves {path}")
+        if len(candidates) == 1:
+            # Nothing to fail over or hedge to
+            try:
+                return await self._send(session, candidates[0], method, path, params, json_body, priority)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                raise ProviderError(f"TRON node failed for {path}: {e}") from e
+
+        tasks: Dict[asyncio.Task, NodeHealth] = {}
+        launched = 0
+
+        def launch(lane: int):
+            nonlocal launched
+            health = candidates[launched]
+            launched += 1
+            task = asyncio.create_task(self._send(session, health, method, path, params, json_body, lane))
+            tasks[task] = health
+
+        launch(priority)
+        primary = candidates[0]
+        hedged = False
+        last_response: Optional[ProviderResponse] = None
+        last_error: Optional[Exception] = None
+        try:
+            while tasks:
+                timeout = None
+                if hedge and not hedged and len(tasks) == 1 and launched < len(candidates):
+                    timeout = self.hedge_delay(next(iter(tasks.values())))
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # A hedge is opportunistic, so it never eats into a higher lane's rate limit reserve
+                    hedged = True
+                    launch(max(priority, PRIORITY_BACKGROUND))
+                    continue
+
+                for task in done:
+                    health = tasks.pop(task)
+                    try:
+                        response = task.result()
+                    except Exception as e:
+                        last_error = e
+                        continue
+                    if response.status not in RETRYABLE_STATUSES:
+                        if hedged:
+                            HEDGED_REQUESTS.labels(winner="primary" if health is primary else "hedge").inc()
+                        return response
+                    last_response = response
+
+                if not tasks and launched < len(candidates):
+                    launch(priority)
+        finally:
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+        if last_response is not None:
+            return last_response
+        raise ProviderError(f"All TRON nodes failed for {path}: {last_error}")
+
+    async def _send(self, session, health: NodeHealth, method, path, params, json_body, priority) -> ProviderResponse:
+        url = f"{health.node.url}{path}"
+        api_key = None
+        if self.limiter is not None and health.node.indexed:
+            api_key = await self.limiter.acquire(priority)
+        health.in_flight += 1
+        start = time.monotonic()
+        try:
+            headers = api_key.headers if api_key else None
+            async with session.request(method, url, params=params, json=json_body, headers=headers) as response:
+                body = await response.read()
+                status = response.status
+                retry_after = response.headers.get("Retry-After")
+        except asyncio.CancelledError:
+            NODE_REQUESTS.labels(node=health.node.url, result="cancelled").inc()
+            raise
+        except Exception:
+            self._record_failure(health)
+            raise
+        finally:
+            health.in_flight -= 1
+
+        if status == 429 and api_key is not None:
+            self.limiter.penalize(api_key, retry_after)
+        if status in RETRYABLE_STATUSES:
+            self._record_failure(health)
+        else:
+            self._record_success(health, time.monotonic() - start)
+        return ProviderResponse(status, body, health.node.url)
+
+    def _record_success(self, health: NodeHealth, elapsed: float):
+        url = health.node.url
+        health.latency = elapsed if health.latency is None else self.alpha * elapsed + (1 - self.alpha) * health.latency
+        health.latencies.append(elapsed)
+        health.error_rate *= 1 - self.alpha
+        health.consecutive_failures = 0
+        if health.ejections and health.ejected_until <= time.monotonic():
+            # Trial request after an ejection went through
+            health.ejections = 0
+            health.error_rate = 0.0
+            NODE_EJECTED.labels(node=url).set(0)
+            logger.info(f"TRON node {url} readmitted")
+        NODE_REQUESTS.labels(node=url, result="ok").inc()
+        NODE_LATENCY.labels(node=url).set(health.latency)
+        NODE_ERROR_RATE.labels(node=url).set(health.error_rate)
+
+    def _record_failure(self, health: NodeHealth):
+        url = health.node.url
+        health.error_rate = self.alpha + (1 - self.alpha) * health.error_rate
+        health.consecutive_failures += 1
+        NODE_REQUESTS.labels(node=url, result="error").inc()
+        NODE_ERROR_RATE.labels(node=url).set(health.error_rate)
+
+        now = time.monotonic()
+        if health.ejected_until > now:
+            return
+        if health.consecutive_failures >= self.eject_failures or health.error_rate >= self.eject_error_rate:
+            period = min(self.eject_base * 2 ** health.ejections, self.eject_max)
+            health.ejected_until = now + period
+            health.ejections += 1
+            health.consecutive_failures = 0
+            NODE_EJECTED.labels(node=url).set(1)
+            logger.warning(f"TRON node {url} ejected for {period:.0f}s (error rate {health.error_rate:.2f})")
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Per-node health, for status endpoints"""
+        now = time.monotonic()
+        return [
+            {
+                "node": h.node.url,
+                "indexed": h.node.indexed,
+                "latency_ms": round(h.latency * 1000, 1) if h.latency is not None else None,
+                "p95_ms": round(h.p95() * 1000, 1) if h.p95() is not None else None,
+                "error_rate": round(h.error_rate, 3),
+                "ejected": h.ejected_until > now,
+                "in_flight": h.in_flight
+            }
+            for h in self.nodes
+        ]
@@ -0,0 +1,179 @@
+"""
+Client-side rate limiting and API key rotation for TronGrid
+
+Every process calling TronGrid takes a token from a per-key token bucket
+kept in Redis before it sends, so monitors and the backend share each
+key's QPS budget instead of discovering it through 429s. Keys are used in
+smooth weighted round-robin order, weighted by their QPS. A 429 puts its
+key on cooldown for the Retry-After period.
+
+Calls come in priority lanes. A lane may only take a token while the
+bucket holds more than that lane's reserve, so payment detection (no
+reserve) can still get tokens when balance lookups and other background
+calls are already being held back. A reserve never exceeds the bucket
+less one token, so with a burst of 1 the lanes share the bucket equally.
+
+Without Redis the buckets are kept in process.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import time
+from typing import List, Optional
+
+from prometheus_client import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes, most important first
+PRIORITY_PAYMENT = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_BACKGROUND = 2
+
+# Share of a bucket each lane leaves untouched for the lanes above it
+LANE_RESERVE = {PRIORITY_PAYMENT: 0.0, PRIORITY_DEFAULT: 0.25, PRIORITY_BACKGROUND: 0.5}
+LANE_NAMES = {PRIORITY_PAYMENT: "payment", PRIORITY_DEFAULT: "default", PRIORITY_BACKGROUND: "background"}
+
+BUCKET_KEY_PREFIX = "tron:ratelimit"
+MAX_RETRY_AFTER = 60.0
+
+RATE_LIMIT_WAIT = Histogram(
+    "tron_rate_limit_wait_seconds",
+    "Time TRON calls waited for a rate limit token",
+    ["lane"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+RATE_LIMITED_RESPONSES = Counter(
+    "tron_rate_limited_responses_total",
+    "429 responses received per API key",
+    ["key"]
+)
+
+# Refill and take one token; returns 0 when taken, else milliseconds until one is available to this lane
+TAKE_TOKEN_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local reserve = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate / 1000)
+local wait = 0
+if tokens - 1 >= reserve then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 + reserve - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+return wait
+"""
+
+
+class ApiKey:
+    """A TronGrid API key (or the keyless quota) with its QPS budget"""
+
+    def __init__(self, key: Optional[str], qps: float, burst: Optional[float] = None):
+        self.key = key
+        self.qps = qps
+        self.burst = burst or max(qps, 1.0)
+        self.name = hashlib.sha1(key.encode()).hexdigest()[:12] if key else "anonymous"
+        self.current_weight = 0.0
+        self.cooldown_until = 0.0
+        self.tokens = self.burst
+        self.refilled_at = time.monotonic()
+
+    @property
+    def headers(self):
+        return {"TRON-PRO-API-KEY": self.key} if self.key else {}
+
+
+class RateLimiter:
+    """Token buckets per API key, shared through Redis when available"""
+
+    def __init__(self, keys: List[ApiKey], redis_client=None):
+        if not keys:
+            raise ValueError("RateLimiter needs at least one key")
+        self.keys = keys
+        self.redis = redis_client
+        self._take_script = redis_client.register_script(TAKE_TOKEN_SCRIPT) if redis_client else None
+
+    async def acquire(self, priority: int = PRIORITY_DEFAULT) -> ApiKey:
+        """Wait for a token in the given lane; returns the key to send the request with"""
+        start = time.monotonic()
+        while True:
+            now = time.monotonic()
+            available = [k for k in self.keys if k.cooldown_until <= now]
+            if not available:
+                await asyncio.sleep(min(k.cooldown_until for k in self.keys) - now)
+                continue
+
+            wait = None
+            for key in self._rotation(available):
+                key_wait = await self._take(key, priority)
+                if key_wait == 0:
+                    RATE_LIMIT_WAIT.labels(lane=LANE_NAMES.get(priority, "default")).observe(time.monotonic() - start)
+                    return key
+                wait = key_wait if wait is None else min(wait, key_wait)
+            # Jitter keeps processes that were refused together from retrying in lockstep
+            await asyncio.sleep(wait * random.uniform(1.0, 1.2))
+
+    def penalize(self, key: ApiKey, retry_after: Optional[str] = None):
+        """Put a key that got a 429 on cooldown, for Retry-After seconds when the server sent it"""
+        try:
+            delay = float(retry_after) if retry_after else 1.0
+        except ValueError:
+            delay = 1.0
+        delay = min(max(delay, 0.1), MAX_RETRY_AFTER)
+        key.cooldown_until = max(key.cooldown_until, time.monotonic() + delay)
+        RATE_LIMITED_RESPONSES.labels(key=key.name).inc()
+        logger.warning(f"TronGrid key {key.name} rate limited, cooling down for {delay:.1f}s")
+
+    def _rotation(self, available: List[ApiKey]) -> List[ApiKey]:
+        """Smooth weighted round-robin pick first, then the other keys as fallbacks"""
+        total = sum(k.qps for k in available)
+        for key in available:
+            key.current_weight += key.qps
+        chosen = max(available, key=lambda k: k.current_weight)
+        chosen.current_weight -= total
+        return [chosen] + [k for k in available if k is not chosen]
+
+    async def _take(self, key: ApiKey, priority: int) -> float:
+        """0 when a token was taken, else seconds until one should be available to this lane"""
+        # A lane must still be able to take the last token, or a small bucket would refuse it forever
+        reserve = min(key.burst * LANE_RESERVE.get(priority, LANE_RESERVE[PRIORITY_DEFAULT]), key.burst - 1)
+        if self._take_script is not None:
+            try:
+                wait_ms = await self._take_script(
+                    keys=[f"{BUCKET_KEY_PREFIX}:{key.name}"],
+                    args=[key.qps, key.burst, reserve]
+                )
+                return int(wait_ms) / 1000
+            except Exception as e:
+                logger.warning(f"Redis rate limiter unavailable, using local bucket: {e}")
+
+        now = time.monotonic()
+        key.tokens = min(key.burst, key.tokens + (now - key.refilled_at) * key.qps)
+        key.refilled_at = now
+        if key.tokens - 1 >= reserve:
+            key.tokens -= 1
+            return 0
+        return (1 + reserve - key.tokens) / key.qps
+
+
+def limiter_from_env(redis_client=None) -> Optional[RateLimiter]:
+    """TRON_API_KEYS as `key[:qps],...`, or a keyless TRON_RATE_LIMIT_QPS quota; None when neither is set"""
+    default_qps = float(os.getenv("TRON_API_KEY_QPS", "15"))
+    keys = []
+    for entry in os.getenv("TRON_API_KEYS", "").split(","):
+        key, _, qps = entry.strip().partition(":")
+        if key:
+            keys.append(ApiKey(key, float(qps) if qps else default_qps))
+    if not keys and os.getenv("TRON_RATE_LIMIT_QPS"):
+        keys.append(ApiKey(None, float(os.getenv("TRON_RATE_LIMIT_QPS"))))
+    return RateLimiter(keys, redis_client) if keys else None
@@ -0,0 +1,366 @@
+"""
+Atomic stock reservation
+
+Stock is reserved when an order is created and given back if the order
+expires unpaid, so concurrent buyers can never be sold more than is in
+stock. Available quantities live in Redis counters (in-process fallback);
+products.stock in the database stays the physical count and is only
+decremented on delivery.
+
+Hot products are split over several counter shards: each checkout
+decrements one shard, so a popular item spreads its load over several keys
+(and cluster nodes) instead of serializing every checkout on one.
+
+Counters are seeded from the database the first time a product is
+reserved. A committed change to Product.stock through the ORM resets them
+(register_stock_reset), so restocks and admin edits are picked up by the
+next reservation.
+
+A seed already leaves out the units of open orders, so a reservation taken
+before a reset must not add its units to the new counters when it is
+released. Every reset bumps the product's seed epoch; each reservation
+records the epoch it was taken in, and releasing one from an earlier
+epoch only forgets it. Its units come back with the next reseed.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+SHARDS_KEY = "stock:{product_id}:shards"
+EPOCH_KEY = "stock:{product_id}:epoch"  # bumped by every reset, never deleted
+COUNTER_KEY = "stock:{product_id}:{shard}"
+RESERVATION_KEY = "stockres:{order_id}"
+EXPIRIES_KEY = "stockres:expiries"
+
+# KEYS[1] = shard counter, ARGV[1] = quantity. Takes all of it or nothing.
+TAKE_EXACT_SCRIPT = """
+local available = tonumber(redis.call('GET', KEYS[1]) or '0')
+local wanted = tonumber(ARGV[1])
+if available >= wanted then
+    redis.call('DECRBY', KEYS[1], wanted)
+    return wanted
+end
+return 0
+"""
+
+# KEYS[1] = shard counter, ARGV[1] = quantity. Takes as much as it can.
+TAKE_UP_TO_SCRIPT = """
+local available = tonumber(redis.call('GET', KEYS[1]) or '0')
+local taken = math.min(available, tonumber(ARGV[1]))
+if taken > 0 then
+    redis.call('DECRBY', KEYS[1], taken)
+end
+return taken
+"""
+
+# KEYS[1] = epoch, KEYS[2..] = shard counters, ARGV[1] = the reservation's epoch, ARGV[2..] = units.
+# Gives the units back only while the counters are the ones the reservation took them from.
+RELEASE_SCRIPT = """
+if (redis.call('GET', KEYS[1]) or '0') ~= ARGV[1] then
+    return 0
+end
+for i = 2, #KEYS do
+    redis.call('INCRBY', KEYS[i], ARGV[i])
+end
+return 1
+"""
+
+
+class StockReservations:
+    """Reserve, commit and release product stock for orders"""
+
+    def __init__(self, redis_client=None, hot_threshold: int = 100, hot_shards: int = 8):
+        self.redis = redis_client
+        self.hot_threshold = hot_threshold
+        self.hot_shards = hot_shards
+        self._take_exact = None
+        self._take_up_to = None
+        self._release = None
+        if self.redis is not None:
+            self._take_exact = self.redis.register_script(TAKE_EXACT_SCRIPT)
+            self._take_up_to = self.redis.register_script(TAKE_UP_TO_SCRIPT)
+            self._release = self.redis.register_script(RELEASE_SCRIPT)
+
+        # In-process fallback state; reservations are (product_id, taken per shard, expires_at, epoch)
+        self._local_counters: Dict[int, List[int]] = {}
+        self._local_epochs: Dict[int, int] = {}
+        self._local_reservations: Dict[int, Tuple[int, Dict[int, int], float, int]] = {}
+        self._pending_resets: Set[asyncio.Task] = set()
+
+    def shard_count(self, available: int) -> int:
+        """Products with plenty of stock get sharded counters"""
+        return self.hot_shards if available >= self.hot_threshold else 1
+
+    async def reserve(
+        self,
+        order_id: int,
+        product_id: int,
+        quantity: int,
+        ttl_seconds: float,
+        load_available: Callable[[], Awaitable[int]]
+    ) -> bool:
+        """Atomically reserve stock for an order
+
+        load_available is only awaited the first time a product is seen and
+        must return its stock minus quantities held by open orders.
+        """
+        if self.redis is not None:
+            try:
+                return await self._reserve_redis(order_id, product_id, quantity, ttl_seconds, load_available)
+            except Exception as e:
+                logger.warning(f"Redis stock reservation failed, using local counters: {e}")
+
+        return await self._reserve_local(order_id, product_id, quantity, ttl_seconds, load_available)
+
+    async def commit(self, order_id: int):
+        """The order was paid: the reserved units are sold and must never return to the pool"""
+        if self.redis is not None:
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    pipe.delete(RESERVATION_KEY.format(order_id=order_id))
+                    pipe.zrem(EXPIRIES_KEY, order_id)
+                    await pipe.execute()
+            except Exception as e:
+                logger.warning(f"Failed to commit stock reservation for order {order_id}: {e}")
+
+        self._local_reservations.pop(order_id, None)
+
+    async def release(self, order_id: int) -> bool:
+        """Give reserved units back, e.g. when the order expires. Releasing twice is a no-op."""
+        if self.redis is not None:
+            try:
+                key = RESERVATION_KEY.format(order_id=order_id)
+                async with self.redis.pipeline(transaction=True) as pipe:
+                    pipe.hgetall(key)
+                    pipe.delete(key)
+                    pipe.zrem(EXPIRIES_KEY, order_id)
+                    reservation, deleted, _ = await pipe.execute()
+
+                # Only the caller whose DELETE removed the reservation gives the units back
+                if deleted:
+                    product_id = int(reservation[b"product_id"])
+                    keys, units = [EPOCH_KEY.format(product_id=product_id)], []
+                    for field, taken in reservation.items():
+                        if field.startswith(b"shard:"):
+                            shard = int(field[len(b"shard:"):])
+                            keys.append(COUNTER_KEY.format(product_id=product_id, shard=shard))
+                            units.append(int(taken))
+                    epoch = reservation.get(b"epoch", b"0").decode()
+                    if not await self._release(keys=keys, args=[epoch, *units]):
+                        logger.info(f"Stock reservation of order {order_id} predates a reset, not returned")
+                    return True
+            except Exception as e:
+                logger.warning(f"Failed to release stock reservation for order {order_id}: {e}")
+
+        reservation = self._local_reservations.pop(order_id, None)
+        if reservation is None:
+            return False
+        product_id, shards, _, epoch = reservation
+        counters = self._local_counters.get(product_id)
+        if counters is not None and epoch == self._local_epochs.get(product_id, 0):
+            for shard, taken in shards.items():
+                counters[shard] += taken
+        return True
+
+    async def reclaim_expired(self, now: Optional[float] = None) -> int:
+        """Release every reservation whose order was never paid or closed"""
+        now = now or time.time()
+        expired = []
+
+        if self.redis is not None:
+            try:
+                expired = [int(order_id) for order_id in await self.redis.zrangebyscore(EXPIRIES_KEY, "-inf", now)]
+            except Exception as e:
+                logger.warning(f"Failed to list expired stock reservations: {e}")
+
+        expired.extend(
+            order_id for order_id, (_, _, expires_at, _) in self._local_reservations.items()
+            if expires_at <= now
+        )
+
+        released = 0
+        for order_id in set(expired):
+            if await self.release(order_id):
+                released += 1
+
+        if released:
+            logger.info(f"Released {released} expired stock reservations")
+        return released
+
+    async def reset(self, product_id: int):
+        """Forget a product's counters so they are re-seeded, e.g. after a restock"""
+        if self.redis is not None:
+            try:
+                shards, _ = self._parse_shards(await self.redis.get(SHARDS_KEY.format(product_id=product_id)))
+                keys = [SHARDS_KEY.format(product_id=product_id)]
+                keys += [COUNTER_KEY.format(product_id=product_id, shard=s) for s in range(shards)]
+                async with self.redis.pipeline(transaction=True) as pipe:
+                    pipe.incr(EPOCH_KEY.format(product_id=product_id))
+                    pipe.delete(*keys)
+                    await pipe.execute()
+            except Exception as e:
+                logger.warning(f"Failed to reset stock counters for product {product_id}: {e}")
+        self._reset_local(product_id)
+        logger.info(f"Reset stock counters for product {product_id}")
+
+    def reset_soon(self, product_ids: Set[int]):
+        """Schedule counter resets from synchronous code (ORM event hooks)"""
+        for product_id in product_ids:
+            self._reset_local(product_id)
+            try:
+                task = asyncio.get_running_loop().create_task(self.reset(product_id))
+            except RuntimeError:
+                continue
+            self._pending_resets.add(task)
+            task.add_done_callback(self._pending_resets.discard)
+
+    def _reset_local(self, product_id: int):
+        self._local_counters.pop(product_id, None)
+        self._local_epochs[product_id] = self._local_epochs.get(product_id, 0) + 1
+
+    @staticmethod
+    def _parse_shards(value) -> Tuple[int, int]:
+        """(shard count, seed epoch) from the shards key; (0, 0) when the product is not seeded"""
+        if value is None:
+            return 0, 0
+        shards, _, epoch = (value.decode() if isinstance(value, bytes) else str(value)).partition(":")
+        return int(shards), int(epoch or 0)
+
+    async def _reserve_redis(self, order_id, product_id, quantity, ttl_seconds, load_available) -> bool:
+        seeded = await self.redis.get(SHARDS_KEY.format(product_id=product_id))
+        if seeded is None:
+            seeded = await self._seed_redis(product_id, await load_available())
+        shards, epoch = self._parse_shards(seeded)
+
+        counters = [COUNTER_KEY.format(product_id=product_id, shard=s) for s in range(shards)]
+        start = random.randrange(shards)
+        order = [(start + i) % shards for i in range(shards)]
+
+        # Fast path: one shard covers the whole order
+        taken: Dict[int, int] = {}
+        for shard in order:
+            if int(await self._take_exact(keys=[counters[shard]], args=[quantity])):
+                taken[shard] = quantity
+                break
+
+        # Slow path: gather from several shards, giving everything back if it is not enough
+        if not taken:
+            remaining = quantity
+            for shard in order:
+                got = int(await self._take_up_to(keys=[counters[shard]], args=[remaining]))
+                if got:
+                    taken[shard] = got
+                    remaining -= got
+                if remaining == 0:
+                    break
+
+            if remaining > 0:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for shard, got in taken.items():
+                        pipe.incrby(counters[shard], got)
+                    await pipe.execute()
+                return False
+
+        key = RESERVATION_KEY.format(order_id=order_id)
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.hset(key, mapping={
+                    "product_id": product_id,
+                    "epoch": epoch,
+                    **{f"shard:{shard}": got for shard, got in taken.items()}
+                })
+                pipe.zadd(EXPIRIES_KEY, {order_id: time.time() + ttl_seconds})
+                await pipe.execute()
+        except Exception:
+            # Not recorded, so nothing would ever release it: give the units back before falling back
+            try:
+                await self._release(
+                    keys=[EPOCH_KEY.format(product_id=product_id), *(counters[shard] for shard in taken)],
+                    args=[epoch, *taken.values()]
+                )
+            except Exception as e:
+                logger.warning(f"Failed to return stock taken for order {order_id}: {e}")
+            raise
+        return True
+
+    async def _seed_redis(self, product_id: int, available: int) -> str:
+        """Seed the counters unless another replica did; returns the shards key value"""
+        shards = self.shard_count(available)
+        epoch = int(await self.redis.get(EPOCH_KEY.format(product_id=product_id)) or 0)
+        seeded = f"{shards}:{epoch}"
+        # Whoever sets the shard count first seeds the counters; NX keeps a seed that
+        # races a reset from overwriting counters another replica already decremented
+        if await self.redis.set(SHARDS_KEY.format(product_id=product_id), seeded, nx=True):
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for shard, amount in enumerate(self._split(available, shards)):
+                    pipe.set(COUNTER_KEY.format(product_id=product_id, shard=shard), amount, nx=True)
+                await pipe.execute()
+            logger.info(f"Seeded stock counters for product {product_id}: {available} units over {shards} shards")
+            return seeded
+        return await self.redis.get(SHARDS_KEY.format(product_id=product_id))
+
+    async def _reserve_local(self, order_id, product_id, quantity, ttl_seconds, load_available) -> bool:
+        counters = self._local_counters.get(product_id)
+        if counters is None:
+            available = await load_available()
+            counters = self._local_counters.setdefault(
+                product_id, self._split(available, self.shard_count(available))
+            )
+
+        if sum(counters) < quantity:
+            return False
+
+        taken: Dict[int, int] = {}
+        remaining = quantity
+        start = random.randrange(len(counters))
+        for i in range(len(counters)):
+            shard = (start + i) % len(counters)
+            got = min(counters[shard], remaining)
+            if got:
+                counters[shard] -= got
+                taken[shard] = got
+                remaining -= got
+            if remaining == 0:
+                break
+
+        self._local_reservations[order_id] = (
+            product_id, taken, time.time() + ttl_seconds, self._local_epochs.get(product_id, 0)
+        )
+        return True
+
+    @staticmethod
+    def _split(available: int, shards: int) -> List[int]:
+        base, extra = divmod(max(available, 0), shards)
+        return [base + (1 if shard < extra else 0) for shard in range(shards)]
+
+
+def register_stock_reset(reservations: StockReservations, model):
+    """Reset a product's counters whenever a transaction that changed its stock commits
+
+    Covers products written through the ORM. Stock changed with a bulk or raw
+    statement has to be followed by StockReservations.reset.
+    """
+
+    @event.listens_for(Session, "after_flush")
+    def _track_stock(session, flush_context):
+        for obj in (*session.new, *session.dirty):
+            if isinstance(obj, model) and (obj in session.new or inspect(obj).attrs.stock.history.has_changes()):
+                session.info.setdefault("stock_reset", set()).add(obj.id)
+
+    @event.listens_for(Session, "after_commit")
+    def _reset_on_commit(session):
+        product_ids = session.info.pop("stock_reset", None)
+        if product_ids:
+            reservations.reset_soon(product_ids)
+
+    @event.listens_for(Session, "after_rollback")
+    def _clear_on_rollback(session):
+        session.info.pop("stock_reset", None)
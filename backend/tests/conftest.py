@@ -0,0 +1,22 @@
+"""
+Backend unit tests
+
+The backend modules import each other by plain name, as they do when the
+service runs from backend/. Run from backend/:
+
+    python -m pytest tests
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+
+@pytest.fixture
+def redis_client():
+    """An in-memory Redis with Lua scripting"""
+    fakeredis = pytest.importorskip("fakeredis")
+    return fakeredis.FakeAsyncRedis()
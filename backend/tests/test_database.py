@@ -0,0 +1,36 @@
+import asyncio
+
+import pytest
+from prometheus_client import REGISTRY
+from sqlalchemy import text
+
+from database import create_engine, statement_shape
+
+pytest.importorskip("aiosqlite")
+
+
+def timed(statement):
+    return REGISTRY.get_sample_value(
+        "db_statement_duration_seconds_count", {"shape": statement_shape(statement)}
+    ) or 0
+
+
+def test_failed_statements_leave_no_timing_behind():
+    good, bad = "SELECT 1", "SELECT * FROM no_such_table"
+    engine = create_engine("sqlite+aiosqlite://")
+
+    async def run():
+        async with engine.connect() as conn:
+            for _ in range(3):
+                with pytest.raises(Exception):
+                    await conn.execute(text(bad))
+            await conn.execute(text(good))
+            info = dict((await conn.get_raw_connection()).info)
+        await engine.dispose()
+        return info
+
+    before = timed(good)
+    info = asyncio.run(run())
+    assert timed(good) == before + 1
+    assert timed(bad) == 0
+    assert "query_start_time" not in info
@@ -0,0 +1,104 @@
+import asyncio
+import time
+from datetime import datetime
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+
+from payment_allocator import AllocatorUnavailable, PaymentSuffixAllocator, lease_token, suffix_to_amount
+
+ADDRESS = "TQn9Y2khEsLJW1ChVWFMSMeRDow5KcbLSE"
+BASE = Decimal("10.00")
+
+
+@pytest.fixture(params=["local", "redis"])
+def allocator(request):
+    if request.param == "local":
+        return PaymentSuffixAllocator(capacity=4)
+    return PaymentSuffixAllocator(request.getfixturevalue("redis_client"), capacity=4)
+
+
+def test_allocates_lowest_free_suffix_and_skips_zero(allocator):
+    async def run():
+        return [await allocator.allocate(ADDRESS, BASE, 60, f"order-{i}") for i in range(4)]
+
+    assert asyncio.run(run()) == [1, 2, 3, None]
+
+
+def test_release_frees_suffix_for_the_next_order(allocator):
+    async def run():
+        first = await allocator.allocate(ADDRESS, BASE, 60, "a")
+        assert await allocator.release(ADDRESS, BASE, first, "a")
+        assert not await allocator.release(ADDRESS, BASE, first, "a")
+        return first, await allocator.allocate(ADDRESS, BASE, 60, "b")
+
+    first, second = asyncio.run(run())
+    assert first == second == 1
+
+
+def test_late_release_by_previous_holder_keeps_new_lease(allocator):
+    async def run():
+        suffix = await allocator.allocate(ADDRESS, BASE, 60, "old")
+        await allocator.release(ADDRESS, BASE, suffix, "old")
+        assert await allocator.allocate(ADDRESS, BASE, 60, "new") == suffix
+        # e.g. the sweeper expiring the old order after it was cancelled
+        assert not await allocator.release(ADDRESS, BASE, suffix, "old")
+        return await allocator.allocate(ADDRESS, BASE, 60, "next")
+
+    assert asyncio.run(run()) == 2
+
+
+def test_cooldown_holds_suffix_until_reclaimed(allocator):
+    async def run():
+        suffix = await allocator.allocate(ADDRESS, BASE, 60, "paid")
+        assert await allocator.release(ADDRESS, BASE, suffix, "paid", cooldown=30)
+        held = await allocator.allocate(ADDRESS, BASE, 60, "other")
+        assert await allocator.reclaim_expired(now=time.time() + 10) == 0
+        assert await allocator.reclaim_expired(now=time.time() + 31) == 1
+        return suffix, held, await allocator.allocate(ADDRESS, BASE, 60, "after")
+
+    suffix, held, after = asyncio.run(run())
+    assert held != suffix
+    assert after == suffix
+
+
+def test_expired_leases_are_reclaimed_when_space_is_full(allocator):
+    async def run():
+        for i in range(3):
+            await allocator.allocate(ADDRESS, BASE, -1, f"stale-{i}")
+        return await allocator.allocate(ADDRESS, BASE, 60, "fresh")
+
+    assert asyncio.run(run()) == 1
+
+
+def test_release_for_order_uses_the_order_token(allocator):
+    created_at = datetime(2026, 1, 2, 3, 4, 5, 678901)
+
+    async def run():
+        suffix = await allocator.allocate(ADDRESS, BASE, 60, lease_token(created_at))
+        order = SimpleNamespace(
+            payment_address=ADDRESS, unit_price=Decimal("5.00"), quantity=2,
+            total_amount=suffix_to_amount(BASE, suffix), created_at=created_at
+        )
+        stale = SimpleNamespace(**{**vars(order), "created_at": datetime(2026, 1, 1)})
+        return await allocator.release_for_order(stale), await allocator.release_for_order(order)
+
+    assert asyncio.run(run()) == (False, True)
+
+
+def test_allocation_fails_instead_of_falling_back_when_redis_fails(redis_client):
+    allocator = PaymentSuffixAllocator(redis_client, capacity=4)
+
+    async def unreachable(*args, **kwargs):
+        raise ConnectionError("Redis is down")
+
+    async def run():
+        taken = await allocator.allocate(ADDRESS, BASE, 60, "before")
+        allocator._allocate_script = unreachable
+        # The local bitmap does not know `taken`, so it would hand it out a second time
+        with pytest.raises(AllocatorUnavailable):
+            await allocator.allocate(ADDRESS, BASE, 60, "during")
+        return taken, allocator.local_occupancy(ADDRESS, BASE)
+
+    assert asyncio.run(run()) == (1, 0)
@@ -0,0 +1,96 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from payment_index import PendingOrderIndex
+
+ADDRESS = "TQn9Y2khEsLJW1ChVWFMSMeRDow5KcbLSE"
+AMOUNT = "10.000001"
+
+
+def expires_in(seconds: float) -> datetime:
+    return datetime.utcnow() + timedelta(seconds=seconds)
+
+
+def test_lookup_and_remove_without_redis():
+    index = PendingOrderIndex()
+
+    async def run():
+        await index.add(ADDRESS, AMOUNT, 1, expires_in(60))
+        found = await index.lookup(ADDRESS, "10.0000010")
+        await index.remove(ADDRESS, AMOUNT, 2)
+        kept = await index.lookup(ADDRESS, AMOUNT)
+        await index.remove(ADDRESS, AMOUNT, 1)
+        return found, kept, await index.lookup(ADDRESS, AMOUNT)
+
+    assert asyncio.run(run()) == (1, 1, None)
+
+
+def test_expired_entry_is_a_miss_until_grace_runs_out():
+    index = PendingOrderIndex(grace_seconds=30)
+
+    async def run():
+        await index.add(ADDRESS, AMOUNT, 1, expires_in(-10))
+        in_grace = await index.lookup(ADDRESS, AMOUNT)
+        return in_grace, await index.lookup(ADDRESS, AMOUNT, now=time.time() + 60)
+
+    assert asyncio.run(run()) == (1, None)
+
+
+def test_lookup_follows_another_replicas_newer_order(redis_client):
+    ours, theirs = PendingOrderIndex(redis_client), PendingOrderIndex(redis_client)
+
+    async def run():
+        await ours.add(ADDRESS, AMOUNT, 1, expires_in(60))
+        # The other replica reuses the amount for a newer order
+        await theirs.add(ADDRESS, AMOUNT, 2, expires_in(60))
+        return await ours.lookup(ADDRESS, AMOUNT)
+
+    assert asyncio.run(run()) == 2
+
+
+def test_remove_of_old_order_keeps_newer_entry(redis_client):
+    ours, theirs = PendingOrderIndex(redis_client), PendingOrderIndex(redis_client)
+
+    async def run():
+        await ours.add(ADDRESS, AMOUNT, 1, expires_in(60))
+        await theirs.add(ADDRESS, AMOUNT, 2, expires_in(60))
+        await ours.remove(ADDRESS, AMOUNT, 1)
+        kept = await theirs.lookup(ADDRESS, AMOUNT)
+        await theirs.remove(ADDRESS, AMOUNT, 2)
+        return kept, await ours.lookup(ADDRESS, AMOUNT)
+
+    assert asyncio.run(run()) == (2, None)
+
+
+def test_local_mirror_serves_while_redis_is_down():
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    index = PendingOrderIndex(fakeredis.FakeAsyncRedis(server=server))
+
+    async def run():
+        await index.add(ADDRESS, AMOUNT, 1, expires_in(60))
+        server.connected = False
+        return await index.lookup(ADDRESS, AMOUNT)
+
+    assert asyncio.run(run()) == 1
+
+
+def test_lookup_many_answers_every_payment_in_one_round_trip(redis_client):
+    other = "TWbTaqskoFmsQdpaDmrfkDK4zQ9NXqetpd"
+    ours, theirs = PendingOrderIndex(redis_client), PendingOrderIndex(redis_client)
+
+    async def run():
+        await theirs.add(ADDRESS, AMOUNT, 1, expires_in(60))
+        await theirs.add(ADDRESS, "20.000002", 2, expires_in(60))
+        await theirs.add(other, AMOUNT, 3, expires_in(60))
+        await theirs.add(other, "30.000003", 4, expires_in(-10))
+        return await ours.lookup_many([
+            (ADDRESS, AMOUNT), (other, AMOUNT), (ADDRESS, "20.000002"),
+            (ADDRESS, "99.000009"), (other, "30.000003"), (ADDRESS, AMOUNT)
+        ])
+
+    assert asyncio.run(run()) == [1, 3, 2, None, None, 1]
+    assert ours.stats["redis_lookups"] == 1
@@ -0,0 +1,43 @@
+import asyncio
+from datetime import datetime
+
+from tron_client import PaymentMonitor
+
+
+class StandInClient:
+    payment_address = "TQn9Y2khEsLJW1ChVWFMSMeRDow5KcbLSE"
+
+    def __init__(self, transactions):
+        self.transactions = transactions
+        self.committed = None
+
+    async def get_new_transactions(self, address):
+        return self.transactions
+
+    async def commit_new_transactions(self, address, unhandled=()):
+        self.committed = set(unhandled)
+
+
+def transfer(tx_hash, confirmations=1, token="USDT-TRC20"):
+    return {
+        "tx_hash": tx_hash, "from_address": "TSender", "to_address": StandInClient.payment_address,
+        "amount": 1, "token": token, "confirmations": confirmations, "timestamp": datetime(2026, 1, 1)
+    }
+
+
+def test_skipped_and_failed_transfers_hold_the_cursor():
+    client = StandInClient([
+        transfer("sent"), transfer("trx", token="TRX"), transfer("unconfirmed", confirmations=0),
+        transfer("refused"), transfer("later")
+    ])
+    monitor = PaymentMonitor(client, "http://backend")
+    sent = []
+
+    async def send_notifications(payloads):
+        sent.extend(payload["tx_hash"] for payload in payloads)
+        return None if payloads[0]["tx_hash"] == "refused" else [payloads[0]["tx_hash"]]
+
+    monitor.send_notifications = send_notifications
+    asyncio.run(monitor.check_payments())
+    assert sent == ["sent", "refused", "later"]
+    assert client.committed == {"unconfirmed", "refused"}
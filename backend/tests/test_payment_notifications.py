@@ -0,0 +1,108 @@
+import asyncio
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import select
+
+pytest.importorskip("aiosqlite")
+
+import main
+from database import create_engine, create_session_factory
+from models import Base, Order, Payment
+from payment_allocator import PaymentSuffixAllocator, lease_token
+from payment_index import PendingOrderIndex
+from schemas import PaymentNotification
+from stock_reservation import StockReservations
+
+ADDRESS = "TQn9Y2khEsLJW1ChVWFMSMeRDow5KcbLSE"
+AMOUNT = Decimal("10.000001")
+
+
+class RecordingQueue:
+    def __init__(self):
+        self.enqueued = []
+
+    async def enqueue(self, order_id: int):
+        self.enqueued.append(order_id)
+
+
+def notification(confirmations: int) -> PaymentNotification:
+    return PaymentNotification(
+        tx_hash="a" * 64, from_address="TSender", to_address=ADDRESS,
+        amount=AMOUNT, token="USDT-TRC20", confirmations=confirmations
+    )
+
+
+@pytest.fixture
+def service(monkeypatch, tmp_path):
+    """main's payment globals over a SQLite database holding one pending order"""
+    engine = create_engine(f"sqlite+aiosqlite:///{tmp_path / 'orders.db'}")
+    created_at = datetime.utcnow()
+    monkeypatch.setattr(main, "payment_index", PendingOrderIndex())
+    monkeypatch.setattr(main, "payment_allocator", PaymentSuffixAllocator())
+    monkeypatch.setattr(main, "stock_reservations", StockReservations())
+    monkeypatch.setattr(main, "delivery_queue", RecordingQueue())
+    monkeypatch.setattr(main, "redis_client", None)
+
+    async def setup():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        await main.payment_allocator.allocate(ADDRESS, Decimal("10.00"), 60, lease_token(created_at))
+        async with create_session_factory(engine)() as db:
+            order = Order(
+                user_id=1, product_id=1, quantity=1, unit_price=Decimal("10.00"), total_amount=AMOUNT,
+                status="pending_payment", payment_address=ADDRESS,
+                expires_at=created_at + timedelta(minutes=15), created_at=created_at
+            )
+            db.add(order)
+            await db.commit()
+            await main.payment_index.add(ADDRESS, AMOUNT, order.id, order.expires_at)
+
+    asyncio.run(setup())
+    yield create_session_factory(engine)
+    asyncio.run(engine.dispose())
+
+
+def process(session_factory, notifications):
+    async def run():
+        async with session_factory() as db:
+            results = await main.process_payment_notifications(notifications, db)
+        async with session_factory() as db:
+            order = (await db.execute(select(Order))).scalar_one()
+            payments = (await db.execute(select(Payment))).scalars().all()
+            return results, order.status, [(p.status, p.confirmations) for p in payments]
+
+    return asyncio.run(run())
+
+
+def test_confirmed_transfer_pays_the_order(service):
+    results, status, payments = process(service, [notification(1)])
+    assert results[0]["status"] == "success"
+    assert status == "paid"
+    assert payments == [("confirmed", 1)]
+    assert main.delivery_queue.enqueued == [results[0]["order_id"]]
+
+
+def test_confirmation_upgrades_a_pending_payment(service):
+    results, status, payments = process(service, [notification(0)])
+    assert (results[0]["status"], status, payments) == ("pending", "pending_payment", [("pending", 0)])
+
+    results, status, payments = process(service, [notification(19)])
+    assert results[0]["status"] == "success"
+    assert status == "paid"
+    assert payments == [("confirmed", 19)]
+
+
+def test_repeated_pending_notifications_are_duplicates(service):
+    process(service, [notification(0)])
+    results, status, payments = process(service, [notification(0), notification(0)])
+    assert [result["status"] for result in results] == ["duplicate", "duplicate"]
+    assert (status, payments) == ("pending_payment", [("pending", 0)])
+
+
+def test_transfers_after_payment_no_longer_match(service):
+    process(service, [notification(1)])
+    results, _, payments = process(service, [notification(5)])
+    assert results[0]["status"] == "no_match"
+    assert payments == [("confirmed", 1)]
@@ -0,0 +1,82 @@
+import asyncio
+import time
+
+import pytest
+
+from rate_limiter import PRIORITY_BACKGROUND, PRIORITY_DEFAULT, PRIORITY_PAYMENT, ApiKey, RateLimiter
+
+
+@pytest.fixture(params=["local", "redis"])
+def shared(request):
+    """None for in-process buckets, else a Redis the buckets are kept in"""
+    return request.getfixturevalue("redis_client") if request.param == "redis" else None
+
+
+@pytest.mark.parametrize("priority", [PRIORITY_BACKGROUND, PRIORITY_DEFAULT, PRIORITY_PAYMENT])
+@pytest.mark.parametrize("qps", [0.5, 1.0, 1.2])
+def test_every_lane_gets_a_token_from_a_small_bucket(shared, qps, priority):
+    limiter = RateLimiter([ApiKey(f"k-{qps}-{priority}", qps)], shared)
+
+    async def run():
+        return await asyncio.wait_for(limiter.acquire(priority), timeout=2)
+
+    assert asyncio.run(run()).qps == qps
+
+
+def test_background_calls_leave_the_reserve_to_payments(shared):
+    # Almost no refill, so only the burst of 4 tokens is there to take
+    key = ApiKey("k", 0.001, burst=4)
+    limiter = RateLimiter([key], shared)
+
+    async def run():
+        background = [await limiter._take(key, PRIORITY_BACKGROUND) for _ in range(3)]
+        payment = [await limiter._take(key, PRIORITY_PAYMENT) for _ in range(3)]
+        return background, payment
+
+    background, payment = asyncio.run(run())
+    # Half the bucket is background's to take, the rest stays for payments
+    assert background[:2] == [0, 0] and background[2] > 0
+    assert payment[:2] == [0, 0] and payment[2] > 0
+
+
+def test_keys_are_used_in_proportion_to_their_qps(shared):
+    fast, slow = ApiKey("fast", 300), ApiKey("slow", 100)
+    limiter = RateLimiter([fast, slow], shared)
+
+    async def run():
+        return [(await limiter.acquire()).key for _ in range(8)]
+
+    picks = asyncio.run(run())
+    assert picks.count("fast") == 6 and picks.count("slow") == 2
+    # Smooth: the slow key's turns are spread out, not bunched together
+    assert "slowslow" not in "".join(picks)
+
+
+def test_a_rate_limited_key_cools_down_for_retry_after(shared):
+    limited, other = ApiKey("limited", 100), ApiKey("other", 100)
+    limiter = RateLimiter([limited, other], shared)
+
+    async def run():
+        limiter.penalize(limited, "0.3")
+        during = [(await limiter.acquire()).key for _ in range(4)]
+        limiter.penalize(other, "0.3")
+        started = time.monotonic()
+        after = await limiter.acquire()
+        return during, after.key, time.monotonic() - started
+
+    during, after, waited = asyncio.run(run())
+    assert during == ["other"] * 4
+    # Both keys cooling down: the call waits for the first to come back
+    assert after == "limited"
+    assert 0.1 <= waited < 1.0
+
+
+def test_retry_after_is_bounded():
+    key = ApiKey("k", 10)
+    limiter = RateLimiter([key])
+
+    limiter.penalize(key, "not a number")
+    assert key.cooldown_until - time.monotonic() == pytest.approx(1.0, abs=0.1)
+    key.cooldown_until = 0
+    limiter.penalize(key, "3600")
+    assert key.cooldown_until - time.monotonic() == pytest.approx(60.0, abs=0.1)
@@ -0,0 +1,143 @@
+import asyncio
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import select
+
+from stock_reservation import COUNTER_KEY, SHARDS_KEY, StockReservations, register_stock_reset
+
+
+def available(amount: int):
+    async def load():
+        return amount
+    return load
+
+
+@pytest.fixture(params=["local", "redis"])
+def reservations(request):
+    if request.param == "local":
+        return StockReservations(hot_threshold=10, hot_shards=4)
+    return StockReservations(request.getfixturevalue("redis_client"), hot_threshold=10, hot_shards=4)
+
+
+def test_reserves_until_stock_runs_out_and_release_gives_back(reservations):
+    async def run():
+        taken = [await reservations.reserve(order_id, 1, 3, 60, available(20)) for order_id in range(8)]
+        assert await reservations.release(0)
+        assert not await reservations.release(0)
+        return taken, await reservations.reserve(100, 1, 3, 60, available(20))
+
+    taken, after_release = asyncio.run(run())
+    assert taken == [True] * 6 + [False] * 2
+    assert after_release
+
+
+def test_reset_reseeds_from_the_database(reservations):
+    async def run():
+        assert await reservations.reserve(1, 1, 5, 60, available(5))
+        assert not await reservations.reserve(2, 1, 1, 60, available(5))
+        await reservations.reset(1)
+        # Restocked to 8; the first order still holds 5
+        return await reservations.reserve(2, 1, 3, 60, available(3))
+
+    assert asyncio.run(run())
+
+
+def test_seed_keeps_counters_another_replica_decremented(redis_client):
+    ours, theirs = StockReservations(redis_client), StockReservations(redis_client)
+
+    async def run():
+        await redis_client.set(COUNTER_KEY.format(product_id=1, shard=0), 2)
+        # We won the shard count but the other replica's counter is already live
+        await ours._seed_redis(1, 5)
+        assert not await theirs.reserve(1, 1, 3, 60, available(5))
+        return int(await redis_client.get(COUNTER_KEY.format(product_id=1, shard=0)))
+
+    assert asyncio.run(run()) == 2
+
+
+def test_orm_stock_change_resets_counters(redis_client, tmp_path):
+    pytest.importorskip("aiosqlite")
+    from database import create_engine, create_session_factory
+    from models import Base, Product
+
+    reservations = StockReservations(redis_client)
+    register_stock_reset(reservations, Product)
+    engine = create_engine(f"sqlite+aiosqlite:///{tmp_path / 'products.db'}")
+
+    async def run():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessions = create_session_factory(engine)
+        async with sessions() as db:
+            db.add(Product(id=1, name="p", category="api", price=Decimal("1.00"), stock=1))
+            await db.commit()
+        assert await reservations.reserve(1, 1, 1, 60, available(1))
+
+        async with sessions() as db:
+            product = (await db.execute(select(Product))).scalar_one()
+            product.name = "renamed"
+            await db.commit()
+        await asyncio.gather(*reservations._pending_resets)
+        kept = await redis_client.exists(SHARDS_KEY.format(product_id=1))
+
+        async with sessions() as db:
+            product = (await db.execute(select(Product))).scalar_one()
+            product.stock = 10
+            await db.commit()
+        await asyncio.gather(*reservations._pending_resets)
+        reset = not await redis_client.exists(SHARDS_KEY.format(product_id=1))
+        await engine.dispose()
+        return kept, reset
+
+    assert asyncio.run(run()) == (1, True)
+
+
+def test_release_after_a_reset_does_not_count_units_twice(reservations):
+    async def run():
+        assert await reservations.reserve(1, 1, 4, 60, available(10))
+        # Restock: the reseed already leaves out the 4 units order 1 holds
+        await reservations.reset(1)
+        assert await reservations.reserve(2, 1, 6, 60, available(6))
+        # Order 1 expires; its units must not be added to the reseeded counters
+        assert await reservations.release(1)
+        return await reservations.reserve(3, 1, 1, 60, available(6))
+
+    assert not asyncio.run(run())
+
+
+def test_release_in_the_same_epoch_gives_units_back_after_a_reset_of_another_product(reservations):
+    async def run():
+        assert await reservations.reserve(1, 1, 2, 60, available(2))
+        await reservations.reset(2)
+        assert await reservations.release(1)
+        return await reservations.reserve(2, 1, 2, 60, available(2))
+
+    assert asyncio.run(run())
+
+
+class FailingRecord:
+    """Passes everything to the real client except the pipeline recording a reservation"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def pipeline(self, transaction=True):
+        if transaction:
+            raise ConnectionError("connection reset while recording the reservation")
+        return self.client.pipeline(transaction=transaction)
+
+
+def test_units_taken_before_a_failed_record_are_given_back(redis_client):
+    reservations = StockReservations(redis_client)
+
+    async def run():
+        reservations.redis = FailingRecord(redis_client)
+        # Falls back to the local counters after the Redis record fails
+        assert await reservations.reserve(1, 1, 3, 60, available(5))
+        return int(await redis_client.get(COUNTER_KEY.format(product_id=1, shard=0)))
+
+    assert asyncio.run(run()) == 5
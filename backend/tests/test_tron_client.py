@@ -0,0 +1,55 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+from tron_client import TronClient
+
+ADDRESS = "TQn9Y2khEsLJW1ChVWFMSMeRDow5KcbLSE"
+
+
+class StandInNode:
+    """Answers the chain head and the two history listings; records every path asked for"""
+
+    def __init__(self):
+        self.paths = []
+
+    async def request(self, session, method, path, params=None, json_body=None, priority=None):
+        self.paths.append(path)
+        if path == "/wallet/getnowblock":
+            body = {"block_header": {"raw_data": {"number": 120}}}
+        elif path.endswith("/trc20"):
+            body = {"data": [{"block_timestamp": int(time.time() * 1000), "transaction_id": "usdt", "from": "TSender",
+                              "to": ADDRESS, "value": "1000000",
+                              "token_info": {"symbol": "USDT", "decimals": 6}}], "meta": {}}
+        elif path.endswith("/transactions"):
+            body = {"data": [], "meta": {}}
+        else:
+            body = {"blockNumber": 100}
+        return SimpleNamespace(status=200, body=json.dumps(body).encode(), json=lambda: body)
+
+
+def test_new_transactions_without_block_lookups_and_fenced_commit(redis_client):
+    client = TronClient(None, redis_client=redis_client)
+    client.pool = node = StandInNode()
+    fenced = []
+
+    async def fence(address, key, value):
+        fenced.append((address, key))
+        return True
+
+    client.history_fence = fence
+
+    async def run():
+        transactions = await client.get_new_transactions(ADDRESS, resolve_blocks=False)
+        await client.commit_new_transactions(ADDRESS)
+        await client.close()
+        return transactions
+
+    transactions = asyncio.run(run())
+    assert [(tx["tx_hash"], tx["block_number"], tx["confirmations"]) for tx in transactions] == [("usdt", None, 0)]
+    assert "/wallet/gettransactioninfobyid" not in node.paths
+    assert fenced == [
+        (ADDRESS, f"monitor:history-cursor:{ADDRESS}:trx"),
+        (ADDRESS, f"monitor:history-cursor:{ADDRESS}:trc20")
+    ]
@@ -0,0 +1,114 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from trongrid_history import CURSOR_KEY_PREFIX, TronGridHistory
+
+
+class StandInListing:
+    """A TronGrid listing answering the min_timestamp / fingerprint walk in pages"""
+
+    def __init__(self, items):
+        self.items = items  # (block_timestamp, id)
+
+    async def request(self, session, method, path, params=None, priority=None):
+        matching = [item for item in self.items if item[0] >= params["min_timestamp"]]
+        offset = int(params.get("fingerprint") or 0)
+        page = matching[offset:offset + params["limit"]]
+        body = {
+            "data": [{"block_timestamp": timestamp, "transaction_id": item_id} for timestamp, item_id in page],
+            "meta": {"fingerprint": str(offset + len(page))} if offset + len(page) < len(matching) else {}
+        }
+        return SimpleNamespace(status=200, body=json.dumps(body).encode(), json=lambda: body)
+
+
+def history(listing, redis_client=None, page_size=200):
+    # Look back far enough to see the whole stand-in listing
+    return TronGridHistory("addr:trc20", listing, "/v1/accounts/addr/transactions/trc20",
+                           redis_client=redis_client, page_size=page_size, initial_lookback=10 ** 12)
+
+
+def ids(items):
+    return [item["transaction_id"] for item in items]
+
+
+def test_fetch_returns_only_new_items_after_commit():
+    listing = StandInListing([(1000, "a"), (2000, "b"), (2000, "c")])
+    h = history(listing)
+
+    async def run():
+        first = ids(await h.fetch_new(None))
+        await h.commit()
+        listing.items += [(2000, "d"), (3000, "e")]
+        second = ids(await h.fetch_new(None))
+        await h.commit()
+        return first, second, ids(await h.fetch_new(None))
+
+    assert asyncio.run(run()) == (["a", "b", "c"], ["d", "e"], [])
+
+
+def test_uncommitted_and_discarded_fetches_come_back():
+    h = history(StandInListing([(1000, "a"), (2000, "b")]))
+
+    async def run():
+        first = ids(await h.fetch_new(None))
+        again = ids(await h.fetch_new(None))
+        h.discard()
+        await h.commit()
+        return first, again, ids(await h.fetch_new(None))
+
+    first, again, after_discard = asyncio.run(run())
+    assert first == again == after_discard == ["a", "b"]
+
+
+def test_commit_stops_at_first_unhandled_item():
+    h = history(StandInListing([(1000, "a"), (2000, "b"), (2000, "c"), (3000, "d")]))
+
+    async def run():
+        await h.fetch_new(None)
+        await h.commit(unhandled={"c"})
+        retried = ids(await h.fetch_new(None))
+        await h.commit(unhandled={"a"})  # not in this fetch
+        return retried, ids(await h.fetch_new(None))
+
+    assert asyncio.run(run()) == (["c", "d"], [])
+
+
+def test_commit_with_first_item_unhandled_keeps_cursor():
+    h = history(StandInListing([(1000, "a"), (2000, "b")]))
+
+    async def run():
+        await h.fetch_new(None)
+        await h.commit(unhandled={"a"})
+        return ids(await h.fetch_new(None))
+
+    assert asyncio.run(run()) == ["a", "b"]
+
+
+def test_burst_is_followed_across_pages_and_resumed_from_unhandled():
+    items = [(1000 + i, f"tx{i:03d}") for i in range(25)]
+    h = history(StandInListing(items), page_size=10)
+
+    async def run():
+        first = ids(await h.fetch_new(None))
+        await h.commit(unhandled={"tx012"})
+        return first, ids(await h.fetch_new(None))
+
+    first, retried = asyncio.run(run())
+    assert first == [item_id for _, item_id in items]
+    assert retried == first[12:]
+
+
+def test_cursor_is_persisted_and_restored(redis_client):
+    listing = StandInListing([(1000, "a"), (2000, "b")])
+
+    async def run():
+        h = history(listing, redis_client)
+        await h.fetch_new(None)
+        await h.commit(unhandled={"b"})
+        stored = json.loads(await redis_client.get(f"{CURSOR_KEY_PREFIX}:addr:trc20"))
+        return stored, ids(await history(listing, redis_client).fetch_new(None))
+
+    stored, restored = asyncio.run(run())
+    assert stored["last_timestamp"] == 1000
+    assert restored == ["b"]
@@ -0,0 +1,56 @@
+import asyncio
+
+from aiohttp import web
+
+from vault_client import VaultClient
+
+
+class StandInVault:
+    def __init__(self):
+        self.status = 200
+        self.value = "first"
+
+    async def read(self, request):
+        if self.status != 200:
+            return web.json_response({"errors": []}, status=self.status)
+        return web.json_response({"data": {"data": {"value": self.value}, "metadata": {"version": 1}}})
+
+
+async def with_vault(run):
+    vault = StandInVault()
+    app = web.Application()
+    app.router.add_get("/v1/secret/data/{path:.*}", vault.read)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    client = VaultClient(f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}", "token")
+    try:
+        return await run(vault, client)
+    finally:
+        await client.close()
+        await runner.cleanup()
+
+
+def test_error_status_keeps_last_good_value():
+    async def run(vault, client):
+        assert await client.get_secret("api/internal-token") == "first"
+        served = []
+        for status in (500, 503, 403):
+            vault.status = status
+            served.append(await client._refresh("api/internal-token", "refresh"))
+        vault.status, vault.value = 200, "second"
+        served.append(await client._refresh("api/internal-token", "refresh"))
+        return served, await client.get_secret("api/internal-token")
+
+    served, cached = asyncio.run(with_vault(run))
+    assert served == ["first", "first", "first", "second"]
+    assert cached == "second"
+
+
+def test_missing_secret_is_cached_as_none():
+    async def run(vault, client):
+        vault.status = 404
+        return await client.get_secret("payment/tron-address"), "payment/tron-address" in client._cache
+
+    assert asyncio.run(with_vault(run)) == (None, True)
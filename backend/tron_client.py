@@ -3,8 +3,12 @@ TRON blockchain client for payment processing
 """
 
 import asyncio
+import functools
 import logging
-from typing import Optional, Dict, Any
+import os
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Awaitable, Callable, Collection
 from decimal import Decimal
 from datetime import datetime
 import aiohttp
@@ -13,18 +17,95 @@ from tronpy import Tron
 from tronpy.providers import HTTPProvider
 
 from vault_client import VaultClient
+from trongrid_history import TronGridHistory
+from chain_executor import AsyncChain
+from balance_reader import USDT_CONTRACT, BalanceReader
+from provider_pool import ProviderPool, TronNode, nodes_from_env
+from rate_limiter import PRIORITY_BACKGROUND, PRIORITY_PAYMENT, limiter_from_env
 
 logger = logging.getLogger(__name__)
 
+# HTTP connection pool tuning for TronGrid and the backend API
+HTTP_POOL_LIMIT = int(os.getenv("TRON_HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("TRON_HTTP_POOL_LIMIT_PER_HOST", "20"))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("TRON_HTTP_KEEPALIVE_TIMEOUT", "30"))  # seconds an idle connection is kept
+HTTP_DNS_CACHE_TTL = int(os.getenv("TRON_HTTP_DNS_CACHE_TTL", "300"))  # seconds
+HTTP_TIMEOUT = aiohttp.ClientTimeout(
+    total=float(os.getenv("TRON_HTTP_TIMEOUT", "15")),
+    connect=float(os.getenv("TRON_HTTP_CONNECT_TIMEOUT", "5")),
+    sock_read=float(os.getenv("TRON_HTTP_READ_TIMEOUT", "10"))
+)
+# Worker threads for the blocking tronpy client, kept off the event loop
+CHAIN_WORKERS = int(os.getenv("TRON_CHAIN_WORKERS", "8"))
+# Balance reads for many addresses: node calls in flight, and seconds a balance is reused
+BALANCE_READ_CONCURRENCY = int(os.getenv("BALANCE_READ_CONCURRENCY", "32"))
+BALANCE_CACHE_TTL = float(os.getenv("BALANCE_CACHE_TTL", "10"))
+
+# The chain head is fetched at most this often and shared by every caller (one TRON block)
+HEAD_MAX_AGE = 3.0
+# Block numbers of recently seen transactions, resolved once each
+TX_BLOCK_CACHE_SIZE = 10000
+
+def create_http_session(headers: Optional[Dict[str, str]] = None) -> aiohttp.ClientSession:
+    """Long-lived session with a pooled, keepalive connector; close it on shutdown"""
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_LIMIT,
+        limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        enable_cleanup_closed=True
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=HTTP_TIMEOUT, headers=headers)
+
 class TronClient:
-    """TRON blockchain client for payment monitoring and processing"""
+    """TRON blockchain client for payment monitoring and processing
     
-    def __init__(self, vault_client: VaultClient, node_url: Optional[str] = None):
+    All HTTP calls share one pooled session, so polling reuses open
+    connections instead of paying for TCP/TLS setup and DNS on every request.
+    They are routed over the nodes in TRON_NODE_URLS / TRON_FULL_NODE_URLS
+    by a ProviderPool, or to node_url alone when one is given, and share the
+    TronGrid rate limit and API keys (TRON_API_KEYS) with other processes.
+    """
+    
+    def __init__(self, vault_client: VaultClient, node_url: Optional[str] = None, redis_client=None):
         self.vault_client = vault_client
-        self.node_url = node_url or "https://api.trongrid.io"
+        self.pool = ProviderPool(
+            [TronNode(node_url)] if node_url else nodes_from_env(),
+            limiter=limiter_from_env(redis_client)
+        )
+        self.node_url = self.pool.primary_url  # tronpy's synchronous client talks to this one
+        self.redis = redis_client  # persists incremental history cursors when given
+        # Set by a monitor that shares the cursors with other replicas: fence(address, key, value)
+        # persists a cursor only while this replica holds the address's lease
+        self.history_fence: Optional[Callable[[str, str, str], Awaitable[bool]]] = None
+        self._histories: Dict[str, TronGridHistory] = {}
+        self.balances = BalanceReader(
+            self.pool, self.get_session, concurrency=BALANCE_READ_CONCURRENCY, ttl=BALANCE_CACHE_TTL
+        )
         self.client = None
+        self.chain: Optional[AsyncChain] = None
         self.private_key = None
         self.payment_address = None
+        self.session = None
+        self.head_block: Optional[int] = None
+        self.head_updated_at = 0.0
+        self._head_lock = asyncio.Lock()
+        self._tx_blocks: "OrderedDict[str, int]" = OrderedDict()
+        
+    async def get_session(self) -> aiohttp.ClientSession:
+        """Get or create the shared HTTP session"""
+        if self.session is None or self.session.closed:
+            self.session = create_http_session()
+        return self.session
+    
+    async def close(self):
+        """Close the HTTP session and its pooled connections"""
+        if self.session:
+            await self.session.close()
+            self.session = None
+        if self.chain:
+            self.chain.close()
+            self.chain = None
         
     async def initialize(self):
         """Initialize TRON client with secrets from Vault"""
@@ -36,6 +117,7 @@ class TronClient:
             # Initialize TRON client
             provider = HTTPProvider(self.node_url)
             self.client = Tron(provider)
+            self.chain = AsyncChain(self.client, max_workers=CHAIN_WORKERS)
             
             logger.info(f"TRON client initialized with address: {self.payment_address}")
             
@@ -49,7 +131,7 @@ class TronClient:
             if not self.client:
                 await self.initialize()
                 
-            account = self.client.get_account(address)
+            account = await self.chain.get_account(address)
             return {
                 "address": address,
                 "balance": account.get("balance", 0) / 1_000_000,  # Convert from sun to TRX
@@ -62,91 +144,65 @@ class TronClient:
     
     async def get_trc20_balances(self, address: str) -> Dict[str, float]:
         """Get TRC20 token balances"""
-        balances = {}
-        
-        # USDT contract on TRON
-        usdt_contract = "TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t"
-        
-        try:
-            async with aiohttp.ClientSession() as session:
-                # Get USDT balance
-                url = f"{self.node_url}/v1/accounts/{address}/transactions/trc20"
-                params = {
-                    "contract_address": usdt_contract,
-                    "limit": 1
-                }
-                
-                async with session.get(url, params=params) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        # This is a simplified implementation
-                        # In production, you'd need to query the contract directly
-                        balances["USDT"] = 0.0
-                        
-        except Exception as e:
-            logger.error(f"Error getting TRC20 balances: {e}")
-            
-        return balances
+        usdt = (await self.balances.trc20_balances([address], USDT_CONTRACT))[address]
+        return {} if usdt is None else {"USDT": float(usdt)}
+    
+    async def get_balances(self, addresses: List[str]) -> Dict[str, Dict[str, Optional[Decimal]]]:
+        """TRX and USDT balances of many addresses in about one round trip; None where a read failed"""
+        trx, usdt = await asyncio.gather(
+            self.balances.trx_balances(addresses),
+            self.balances.trc20_balances(addresses, USDT_CONTRACT)
+        )
+        return {address: {"TRX": trx[address], "USDT": usdt[address]} for address in addresses}
     
     async def get_recent_transactions(
         self, 
         address: str, 
         limit: int = 50,
-        only_to: bool = True
+        only_to: bool = True,
+        resolve_blocks: bool = True
     ) -> list:
-        """Get recent transactions for an address"""
+        """Get recent transactions for an address
+        
+        With resolve_blocks=False the per-transfer block lookups of USDT
+        transfers are skipped; their confirmations stay 0 until
+        resolve_confirmations is called, so callers can run those lookups
+        concurrently.
+        """
         transactions = []
         
         try:
-            async with aiohttp.ClientSession() as session:
-                # Get TRX transactions
-                url = f"{self.node_url}/v1/accounts/{address}/transactions"
-                params = {
-                    "limit": limit,
-                    "only_to": "true" if only_to else "false"
-                }
-                
-                async with session.get(url, params=params) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        trx_txs = data.get("data", [])
-                        
-                        for tx in trx_txs:
-                            transactions.append({
-                                "tx_hash": tx.get("txID"),
-                                "from_address": tx.get("raw_data", {}).get("contract", [{}])[0].get("parameter", {}).get("value", {}).get("owner_address"),
-                                "to_address": address,
-                                "amount": tx.get("raw_data", {}).get("contract", [{}])[0].get("parameter", {}).get("value", {}).get("amount", 0) / 1_000_000,
-                                "token": "TRX",
-                                "timestamp": datetime.fromtimestamp(tx.get("block_timestamp", 0) / 1000),
-                                "confirmations": self._calculate_confirmations(tx.get("block_timestamp", 0))
-                            })
-                
-                # Get TRC20 transactions (USDT)
-                url = f"{self.node_url}/v1/accounts/{address}/transactions/trc20"
-                params = {
-                    "limit": limit,
-                    "only_to": "true" if only_to else "false"
-                }
+            session = await self.get_session()
+            head = await self.get_latest_block_number()
+            
+            # Get TRX transactions
+            params = {
+                "limit": limit,
+                "only_to": "true" if only_to else "false"
+            }
+            
+            response = await self.pool.request(session, "GET", f"/v1/accounts/{address}/transactions", params=params)
+            if response.status == 200:
+                trx_txs = response.json().get("data", [])
                 
-                async with session.get(url, params=params) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        trc20_txs = data.get("data", [])
-                        
-                        for tx in trc20_txs:
-                            # Focus on USDT transactions
-                            if tx.get("token_info", {}).get("symbol") == "USDT":
-                                transactions.append({
-                                    "tx_hash": tx.get("transaction_id"),
-                                    "from_address": tx.get("from"),
-                                    "to_address": tx.get("to"),
-                                    "amount": float(tx.get("value", 0)) / pow(10, tx.get("token_info", {}).get("decimals", 6)),
-                                    "token": "USDT-TRC20",
-                                    "timestamp": datetime.fromtimestamp(tx.get("block_timestamp", 0) / 1000),
-                                    "confirmations": self._calculate_confirmations(tx.get("block_timestamp", 0))
-                                })
+                for tx in trx_txs:
+                    transactions.append(self._parse_trx_transfer(tx, address, head))
+            
+            # Get TRC20 transactions (USDT)
+            params = {
+                "limit": limit,
+                "only_to": "true" if only_to else "false"
+            }
+            
+            response = await self.pool.request(session, "GET", f"/v1/accounts/{address}/transactions/trc20", params=params)
+            if response.status == 200:
+                trc20_txs = response.json().get("data", [])
                 
+                for tx in trc20_txs:
+                    # Focus on USDT transactions
+                    if tx.get("token_info", {}).get("symbol") == "USDT":
+                        transactions.append(await self._parse_trc20_transfer(tx, head, resolve_blocks))
+            
         except Exception as e:
             logger.error(f"Error getting recent transactions: {e}")
             
@@ -154,18 +210,166 @@ class TronClient:
         transactions.sort(key=lambda x: x["timestamp"], reverse=True)
         return transactions[:limit]
     
-    def _calculate_confirmations(self, block_timestamp: int) -> int:
-        """Calculate number of confirmations based on block timestamp"""
-        # Simplified calculation - in production, you'd query current block height
-        if block_timestamp == 0:
+    async def resolve_confirmations(self, transaction: Dict[str, Any]) -> int:
+        """Fill in the block and confirmations of a transfer fetched with resolve_blocks=False"""
+        if not transaction.get("block_number"):
+            transaction["block_number"] = await self.get_transaction_block(transaction["tx_hash"])
+        transaction["confirmations"] = self._calculate_confirmations(
+            transaction["block_number"], await self.get_latest_block_number()
+        )
+        return transaction["confirmations"]
+    
+    async def get_new_transactions(self, address: str, resolve_blocks: bool = True) -> list:
+        """Confirmed transfers to an address since the last commit_new_transactions, oldest first
+        
+        Only items newer than a persisted cursor are downloaded, and bursts
+        larger than a page are followed through TronGrid's pagination.
+        resolve_blocks=False skips the USDT block lookups as in
+        get_recent_transactions.
+        """
+        transactions = []
+        
+        try:
+            session = await self.get_session()
+            head = await self.get_latest_block_number()
+        except Exception as e:
+            logger.error(f"Error getting new transactions: {e}")
+            return transactions
+        
+        for kind in ("trx", "trc20"):
+            history = self._history(address, kind)
+            parsed = []
+            try:
+                for tx in await history.fetch_new(session):
+                    if kind == "trx":
+                        parsed.append(self._parse_trx_transfer(tx, address, head))
+                    # Focus on USDT transactions
+                    elif tx.get("token_info", {}).get("symbol") == "USDT":
+                        parsed.append(await self._parse_trc20_transfer(tx, head, resolve_blocks))
+            except Exception as e:
+                # Nothing of this listing is committed; it is fetched again next time
+                history.discard()
+                logger.error(f"Error getting new {kind} transactions: {e}")
+                continue
+            transactions.extend(parsed)
+        
+        transactions.sort(key=lambda x: x["timestamp"])
+        return transactions
+    
+    async def commit_new_transactions(self, address: str, unhandled: Collection[str] = ()):
+        """Move the history cursors past what get_new_transactions returned
+        
+        Each listing stops in front of its first transfer whose tx_hash is in
+        unhandled, so that transfer is returned again by the next call.
+        """
+        for kind in ("trx", "trc20"):
+            await self._history(address, kind).commit(unhandled)
+    
+    async def load_history(self, address: str):
+        """Reload an address's persisted cursors, which another replica may have moved"""
+        for kind in ("trx", "trc20"):
+            await self._history(address, kind).load()
+    
+    def _history(self, address: str, kind: str) -> TronGridHistory:
+        name = f"{address}:{kind}"
+        history = self._histories.get(name)
+        if history is None:
+            suffix = "/trc20" if kind == "trc20" else ""
+            history = self._histories[name] = TronGridHistory(
+                name,
+                self.pool,
+                f"/v1/accounts/{address}/transactions{suffix}",
+                # Unconfirmed transfers come back too, as in payment-monitor/trongrid_history.py:
+                # they fail the block-height confirmation gate and hold the cursor until they pass
+                params={"only_to": "true"},
+                id_field="transaction_id" if kind == "trc20" else "txID",
+                redis_client=self.redis,
+                fence=functools.partial(self.history_fence, address) if self.history_fence else None
+            )
+        return history
+    
+    def _parse_trx_transfer(self, tx: Dict[str, Any], address: str, head: Optional[int]) -> Dict[str, Any]:
+        value = tx.get("raw_data", {}).get("contract", [{}])[0].get("parameter", {}).get("value", {})
+        return {
+            "tx_hash": tx.get("txID"),
+            "from_address": value.get("owner_address"),
+            "to_address": address,
+            "amount": value.get("amount", 0) / 1_000_000,
+            "token": "TRX",
+            "timestamp": datetime.fromtimestamp(tx.get("block_timestamp", 0) / 1000),
+            "block_number": tx.get("blockNumber"),
+            "confirmations": self._calculate_confirmations(tx.get("blockNumber", 0), head)
+        }
+    
+    async def _parse_trc20_transfer(
+        self, tx: Dict[str, Any], head: Optional[int], resolve_block: bool = True
+    ) -> Dict[str, Any]:
+        # TronGrid's TRC20 history has no block number; it costs one lookup per transfer
+        block_number = await self.get_transaction_block(tx.get("transaction_id")) if resolve_block else None
+        return {
+            "tx_hash": tx.get("transaction_id"),
+            "from_address": tx.get("from"),
+            "to_address": tx.get("to"),
+            "amount": float(tx.get("value", 0)) / pow(10, tx.get("token_info", {}).get("decimals", 6)),
+            "token": "USDT-TRC20",
+            "timestamp": datetime.fromtimestamp(tx.get("block_timestamp", 0) / 1000),
+            "block_number": block_number,
+            "confirmations": self._calculate_confirmations(block_number, head)
+        }
+    
+    def _calculate_confirmations(self, block_number: Optional[int], head: Optional[int]) -> int:
+        """Exact confirmations of a transaction mined in block_number"""
+        if not block_number or not head:
             return 0
-            
-        now = datetime.utcnow().timestamp() * 1000
-        time_diff = now - block_timestamp
+        return max(0, head - block_number + 1)
+    
+    async def get_latest_block_number(self) -> Optional[int]:
+        """Chain head, fetched at most once per HEAD_MAX_AGE and shared by concurrent callers"""
+        if self.head_block is not None and time.monotonic() - self.head_updated_at < HEAD_MAX_AGE:
+            return self.head_block
         
-        # Assume 3 second block time on TRON
-        confirmations = max(0, int(time_diff / 3000))
-        return min(confirmations, 200)  # Cap at 200 confirmations
+        async with self._head_lock:
+            if self.head_block is not None and time.monotonic() - self.head_updated_at < HEAD_MAX_AGE:
+                return self.head_block
+            try:
+                session = await self.get_session()
+                response = await self.pool.request(session, "POST", "/wallet/getnowblock", priority=PRIORITY_PAYMENT)
+                if response.status == 200:
+                    number = response.json().get("block_header", {}).get("raw_data", {}).get("number", 0)
+                    # A lagging node never moves the head backwards
+                    self.head_block = max(number, self.head_block or 0)
+                    self.head_updated_at = time.monotonic()
+                else:
+                    logger.warning(f"Failed to get latest block: {response.status}")
+            except Exception as e:
+                logger.error(f"Error getting latest block: {e}")
+            return self.head_block
+    
+    async def get_transaction_block(self, tx_id: Optional[str]) -> Optional[int]:
+        """Block a transaction was mined in; looked up once per transaction, None while unconfirmed"""
+        if not tx_id:
+            return None
+        block_number = self._tx_blocks.get(tx_id)
+        if block_number is not None:
+            return block_number
+        
+        try:
+            session = await self.get_session()
+            response = await self.pool.request(
+                session, "POST", "/wallet/gettransactioninfobyid", json_body={"value": tx_id}, priority=PRIORITY_PAYMENT
+            )
+            if response.status != 200:
+                return None
+            block_number = response.json().get("blockNumber")
+        except Exception as e:
+            logger.error(f"Error getting block of transaction {tx_id}: {e}")
+            return None
+        
+        if block_number:
+            self._tx_blocks[tx_id] = block_number
+            if len(self._tx_blocks) > TX_BLOCK_CACHE_SIZE:
+                self._tx_blocks.popitem(last=False)
+        return block_number
     
     async def validate_address(self, address: str) -> bool:
         """Validate TRON address format"""
@@ -188,21 +392,19 @@ class TronClient:
     async def get_network_status(self) -> Dict[str, Any]:
         """Get TRON network status"""
         try:
-            async with aiohttp.ClientSession() as session:
-                url = f"{self.node_url}/wallet/getnowblock"
+            session = await self.get_session()
+            response = await self.pool.request(session, "POST", "/wallet/getnowblock", priority=PRIORITY_BACKGROUND)
+            if response.status == 200:
+                block_height = response.json().get("block_header", {}).get("raw_data", {}).get("number", 0)
                 
-                async with session.post(url) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        block_height = data.get("block_header", {}).get("raw_data", {}).get("number", 0)
-                        
-                        return {
-                            "status": "online",
-                            "block_height": block_height,
-                            "node_url": self.node_url,
-                            "last_updated": datetime.utcnow()
-                        }
-                        
+                return {
+                    "status": "online",
+                    "block_height": block_height,
+                    "node_url": response.node,
+                    "nodes": self.pool.stats(),
+                    "last_updated": datetime.utcnow()
+                }
+                    
         except Exception as e:
             logger.error(f"Error getting network status: {e}")
             
@@ -210,6 +412,7 @@ class TronClient:
             "status": "offline",
             "block_height": 0,
             "node_url": self.node_url,
+            "nodes": self.pool.stats(),
             "last_updated": datetime.utcnow(),
             "error": str(e) if 'e' in locals() else "Unknown error"
         }
@@ -222,6 +425,13 @@ class PaymentMonitor:
         self.api_base_url = api_base_url
         self.is_running = False
         self.monitor_interval = 30  # seconds
+    
+    @staticmethod
+    def _headers() -> Dict[str, str]:
+        return {
+            "Content-Type": "application/json",
+            "X-Internal-Token": os.getenv("INTERNAL_API_TOKEN") or os.getenv("DEV_INTERNAL_TOKEN")
+        }
         
     async def start_monitoring(self):
         """Start payment monitoring loop"""
@@ -248,55 +458,69 @@ class PaymentMonitor:
             if not self.tron_client.payment_address:
                 return
                 
-            # Get recent transactions
-            transactions = await self.tron_client.get_recent_transactions(
-                self.tron_client.payment_address,
-                limit=20
-            )
+            # Only transfers newer than the history cursor are fetched
+            transactions = await self.tron_client.get_new_transactions(self.tron_client.payment_address)
             
-            # Process each transaction
+            # Transfers that were skipped or failed hold the cursor so they are fetched again
+            unhandled = set()
             for tx in transactions:
-                await self.process_transaction(tx)
+                if not await self.process_transaction(tx):
+                    unhandled.add(tx["tx_hash"])
+            
+            await self.tron_client.commit_new_transactions(self.tron_client.payment_address, unhandled)
                 
         except Exception as e:
             logger.error(f"Error checking payments: {e}")
     
-    async def process_transaction(self, transaction: Dict[str, Any]):
-        """Process a single transaction"""
+    async def process_transaction(self, transaction: Dict[str, Any]) -> bool:
+        """Process a single transaction; False if it has to be looked at again"""
         try:
-            # Skip if insufficient confirmations
+            # Not confirmed yet, wait for a later poll
             if transaction["confirmations"] < 1:
-                return
+                return False
                 
             # Skip if not USDT (we only accept USDT payments)
             if transaction["token"] != "USDT-TRC20":
-                return
+                return True
                 
             # Send notification to backend API
-            async with aiohttp.ClientSession() as session:
-                url = f"{self.api_base_url}/internal/payments/notify"
-                
-                payload = {
-                    "tx_hash": transaction["tx_hash"],
-                    "from_address": transaction["from_address"],
-                    "to_address": transaction["to_address"],
-                    "amount": str(transaction["amount"]),
-                    "token": transaction["token"],
-                    "confirmations": transaction["confirmations"],
-                    "timestamp": transaction["timestamp"].isoformat()
-                }
-                
-                headers = {
-                    "Content-Type": "application/json",
-                    "X-Internal-Token": os.getenv("INTERNAL_API_TOKEN") or os.getenv("DEV_INTERNAL_TOKEN")
-                }
-                
-                async with session.post(url, json=payload, headers=headers) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        logger.info(f"Payment notification sent: {transaction['tx_hash']} -> {result}")
-                    else:
-                        logger.warning(f"Failed to send payment notification: {response.status}")
-                        
+            return await self.send_notifications([self.notification_payload(transaction)]) is not None
+                    
         except Exception as e:
-            logger.error(f"Error processing transaction {transaction.get('tx_hash', 'unknown')}: {e}")
\ No newline at end of file
+            logger.error(f"Error processing transaction {transaction.get('tx_hash', 'unknown')}: {e}")
+            return False
+    
+    @staticmethod
+    def notification_payload(transaction: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "tx_hash": transaction["tx_hash"],
+            "from_address": transaction["from_address"],
+            "to_address": transaction["to_address"],
+            "amount": str(transaction["amount"]),
+            "token": transaction["token"],
+            "confirmations": transaction["confirmations"],
+            "timestamp": transaction["timestamp"].isoformat()
+        }
+    
+    async def send_notifications(self, payloads: List[Dict[str, Any]]) -> Optional[List[str]]:
+        """Post notifications to the backend, one at a time or as a batch
+        
+        Returns the tx hashes whose orders were marked paid once the backend
+        accepted the notifications; raises aiohttp.ClientResponseError if it did not.
+        """
+        session = await self.tron_client.get_session()
+        if len(payloads) == 1:
+            url, body = f"{self.api_base_url}/internal/payments/notify", payloads[0]
+        else:
+            url, body = f"{self.api_base_url}/internal/payments/notify-batch", payloads
+        
+        async with session.post(url, json=body, headers=self._headers()) as response:
+            if response.status != 200:
+                logger.warning(f"Failed to send payment notification: {response.status}")
+                # The outbox tells a rejected payload (4xx) from a backend that is down
+                response.raise_for_status()
+            result = await response.json()
+            logger.info(f"Payment notification sent: {', '.join(p['tx_hash'] for p in payloads)} -> {result}")
+            if len(payloads) == 1:
+                return [payloads[0]["tx_hash"]] if result.get("status") == "success" else []
+            return [item["tx_hash"] for item in result.get("results", []) if item.get("status") == "success"]
\ No newline at end of file
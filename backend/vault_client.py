@@ -4,19 +4,75 @@ HashiCorp Vault client for secure secrets management
 
 import asyncio
 import logging
+import os
+import time
 import aiohttp
 import json
-from typing import Optional, Dict, Any
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, Tuple
+
+from prometheus_client import Counter, Histogram
 
 logger = logging.getLogger(__name__)
 
+# Seconds a secret is served from cache before it is refreshed, by path prefix (longest match wins)
+DEFAULT_SECRET_TTLS = {
+    "": 300,
+    "api/": 60,
+    "payment/": 300,
+    "bot/": 3600,
+    "encryption/": 3600
+}
+# Past its TTL a secret is still served for this long while a background refresh runs
+DEFAULT_STALE_SECONDS = 600
+
+SECRET_LOOKUPS = Counter(
+    "vault_secret_cache_lookups_total",
+    "Secret lookups by cache result",
+    ["result"]  # hit, stale, miss
+)
+SECRET_FETCH_DURATION = Histogram(
+    "vault_secret_fetch_duration_seconds",
+    "Vault round trips made by the secret cache",
+    ["kind"],  # miss, refresh
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+SECRET_REFRESH_FAILURES = Counter(
+    "vault_secret_refresh_failures_total",
+    "Secret fetches that failed and fell back to a cached or development value"
+)
+
+@dataclass
+class CachedSecret:
+    """A secret value and the KV v2 version it was read at"""
+    value: Optional[str]
+    version: Optional[int]
+    fresh_until: float
+    stale_until: float
+
 class VaultClient:
-    """HashiCorp Vault client for secrets management"""
+    """HashiCorp Vault client for secrets management
+    
+    Secrets are cached per path: within their TTL they are served from
+    memory, for a while after it they are served stale while one
+    background request refreshes them, and concurrent misses for the same
+    path share a single Vault request.
+    """
     
-    def __init__(self, vault_addr: str, vault_token: str):
+    def __init__(
+        self,
+        vault_addr: str,
+        vault_token: str,
+        secret_ttls: Optional[Dict[str, float]] = None,
+        stale_seconds: float = DEFAULT_STALE_SECONDS
+    ):
         self.vault_addr = vault_addr.rstrip("/")
         self.vault_token = vault_token
         self.session = None
+        self.secret_ttls = secret_ttls or DEFAULT_SECRET_TTLS
+        self.stale_seconds = stale_seconds
+        self._cache: Dict[str, CachedSecret] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
         
     async def _get_session(self):
         """Get or create aiohttp session"""
@@ -97,28 +153,100 @@ class VaultClient:
             logger.error(f"Error enabling KV engine: {e}")
     
     async def get_secret(self, path: str) -> Optional[str]:
-        """Get a secret from Vault"""
+        """Get a secret, from cache when possible"""
+        entry = self._cache.get(path)
+        now = time.monotonic()
+        
+        if entry is not None and now < entry.fresh_until:
+            SECRET_LOOKUPS.labels(result="hit").inc()
+            return entry.value
+        
+        if entry is not None and now < entry.stale_until:
+            SECRET_LOOKUPS.labels(result="stale").inc()
+            self._load(path, "refresh")
+            return entry.value
+        
+        SECRET_LOOKUPS.labels(result="miss").inc()
+        # Shielded so a cancelled caller does not cancel the fetch other callers wait on
+        return await asyncio.shield(self._load(path, "miss"))
+    
+    def invalidate(self, path: Optional[str] = None):
+        """Drop one cached secret, or all of them"""
+        if path is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(path, None)
+    
+    def _load(self, path: str, kind: str) -> asyncio.Task:
+        """Fetch a secret into the cache; concurrent callers share one request"""
+        task = self._inflight.get(path)
+        if task is None:
+            task = asyncio.create_task(self._refresh(path, kind))
+            self._inflight[path] = task
+            task.add_done_callback(lambda _: self._inflight.pop(path, None))
+        return task
+    
+    async def _refresh(self, path: str, kind: str) -> Optional[str]:
+        start = time.perf_counter()
         try:
-            session = await self._get_session()
-            
-            # Use KV v2 API format
-            url = f"{self.vault_addr}/v1/secret/data/{path}"
-            
-            async with session.get(url) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    return data["data"]["data"]["value"]
-                elif response.status == 404:
-                    logger.warning(f"Secret not found: {path}")
-                    return None
-                else:
-                    logger.error(f"Failed to get secret {path}: {response.status}")
-                    return None
-                    
+            value, version, lease_duration = await self._fetch_secret(path)
         except Exception as e:
+            SECRET_REFRESH_FAILURES.inc()
+            entry = self._cache.get(path)
+            if entry is not None:
+                # Vault is unreachable: keep serving the last known value
+                logger.warning(f"Error refreshing secret {path}, serving cached value: {e}")
+                return entry.value
             logger.error(f"Error getting secret {path}: {e}")
             # Return development fallback values
             return self._get_dev_fallback(path)
+        finally:
+            SECRET_FETCH_DURATION.labels(kind=kind).observe(time.perf_counter() - start)
+        
+        previous = self._cache.get(path)
+        if previous is not None and version is not None and previous.version != version:
+            logger.info(f"Secret {path} changed to version {version}")
+        
+        ttl = self._ttl_for(path)
+        if lease_duration:
+            ttl = min(ttl, lease_duration)
+        now = time.monotonic()
+        self._cache[path] = CachedSecret(
+            value=value,
+            version=version,
+            fresh_until=now + ttl,
+            stale_until=now + ttl + self.stale_seconds
+        )
+        return value
+    
+    def _ttl_for(self, path: str) -> float:
+        prefix = max((p for p in self.secret_ttls if path.startswith(p)), key=len, default=None)
+        return self.secret_ttls[prefix] if prefix is not None else DEFAULT_SECRET_TTLS[""]
+    
+    async def _fetch_secret(self, path: str) -> Tuple[Optional[str], Optional[int], int]:
+        """Read a secret from Vault: (value, KV v2 version, lease duration in seconds)
+
+        Raises on any status other than 200 or 404, e.g. a 5xx or an expired token's 403.
+        """
+        session = await self._get_session()
+        
+        # Use KV v2 API format
+        url = f"{self.vault_addr}/v1/secret/data/{path}"
+        
+        async with session.get(url) as response:
+            if response.status == 200:
+                data = await response.json()
+                metadata = data["data"].get("metadata") or {}
+                if metadata.get("deletion_time") or metadata.get("destroyed"):
+                    logger.warning(f"Secret deleted: {path}")
+                    return None, metadata.get("version"), 0
+                return data["data"]["data"]["value"], metadata.get("version"), data.get("lease_duration") or 0
+            elif response.status == 404:
+                logger.warning(f"Secret not found: {path}")
+                return None, None, 0
+            else:
+                # Not an answer about the secret; _refresh keeps serving the last good value
+                raise RuntimeError(f"Vault returned {response.status}")
     
     async def set_secret(self, path: str, value: str) -> bool:
         """Set a secret in Vault"""
@@ -135,6 +263,7 @@ class VaultClient:
             
             async with session.post(url, json=payload) as response:
                 if response.status in [200, 204]:
+                    self.invalidate(path)
                     logger.debug(f"Secret set successfully: {path}")
                     return True
                 else:
@@ -154,6 +283,7 @@ class VaultClient:
             
             async with session.delete(url) as response:
                 if response.status in [200, 204]:
+                    self.invalidate(path)
                     logger.info(f"Secret deleted: {path}")
                     return True
                 else:
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Benchmark: backfill throughput, sequential scan vs concurrent chunks
+
+Writes synthetic blocks in the fixture format of block_scanner.py record
+and serves them with --latency-ms added to every node read, as a remote
+node would. The same range is then scanned two ways:
+
+- sequential: BlockScanner.scan over the range, one read at a time, as
+  the monitor's regular tick does
+- backfill: backfill.py's chunked scan, --concurrency chunks at a time
+  with at most --requests reads in flight, decoding in --decode-workers
+  processes
+
+Reported are blocks per second and the transfers found.
+
+Usage:
+    python benchmarks/bench_backfill.py
+    python benchmarks/bench_backfill.py --blocks 2000 --latency-ms 80 --decode-workers 4
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "payment-monitor"))
+
+import structlog
+from tronpy.keys import to_base58check_address
+
+from backfill import TOKENS, Backfill, BackfillState, BoundedSource, Progress, _init_decoder
+from bench_block_scanner import START_BLOCK, build_fixture, random_address
+from block_scanner import BlockScanner, FixtureBlockSource
+
+structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+
+
+class RemoteSource(FixtureBlockSource):
+    """Fixture blocks with a network round trip added to every read"""
+
+    def __init__(self, path: str, latency: float):
+        super().__init__(path)
+        self.latency = latency
+
+    async def get_blocks(self, start, end):
+        await asyncio.sleep(self.latency)
+        return await super().get_blocks(start, end)
+
+    async def get_transaction_infos(self, number):
+        await asyncio.sleep(self.latency)
+        return await super().get_transaction_infos(number)
+
+
+async def run_sequential(source, watched: list, blocks: int) -> tuple:
+    scanner = BlockScanner(source, TOKENS, watched)
+    start = time.perf_counter()
+    scanned = await scanner.scan(START_BLOCK, START_BLOCK + blocks)
+    return time.perf_counter() - start, sum(len(block.transfers) for block in scanned)
+
+
+async def run_backfill(source, watched: list, args, state_path: str) -> tuple:
+    state = BackfillState(state_path, {"chunk_blocks": args.chunk_blocks, "watched": sorted(watched)})
+    state.resolve(START_BLOCK, START_BLOCK + args.blocks)
+    decoder = None
+    if args.decode_workers > 0:
+        decoder = ProcessPoolExecutor(args.decode_workers, initializer=_init_decoder, initargs=(TOKENS, watched))
+    else:
+        _init_decoder(TOKENS, watched)
+    scanner = BlockScanner(BoundedSource(source, args.requests), TOKENS, watched)
+    progress = Progress(args.blocks, 0, 0)
+    start = time.perf_counter()
+    await Backfill(scanner, state, decoder, args.concurrency, args.requests).run(progress)
+    elapsed = time.perf_counter() - start
+    if decoder is not None:
+        decoder.shutdown()
+    return elapsed, progress.transfers
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--blocks", type=int, default=1000)
+    parser.add_argument("--transfers", type=int, default=20, help="USDT transfers per block")
+    parser.add_argument("--latency-ms", type=float, default=50, help="node round trip per read")
+    parser.add_argument("--chunk-blocks", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=16)
+    parser.add_argument("--decode-workers", type=int, default=max((os.cpu_count() or 1) - 1, 0))
+    args = parser.parse_args()
+
+    random.seed(1)
+    watched = random_address()
+    with tempfile.TemporaryDirectory() as tmp:
+        fixture_path = os.path.join(tmp, "blocks.json")
+        with open(fixture_path, "w") as f:
+            json.dump(build_fixture(args.blocks, args.transfers, [watched, random_address()]), f)
+        source = RemoteSource(fixture_path, args.latency_ms / 1000)
+        addresses = [to_base58check_address(watched)]
+
+        print(f"{args.blocks} blocks, {args.transfers} transfers each, {args.latency_ms:.0f}ms per node read\n")
+        print(f"{'variant':<11} {'seconds':>8} {'blocks/s':>9} {'transfers':>10}")
+        for name, (elapsed, transfers) in (
+            ("sequential", await run_sequential(source, addresses, args.blocks)),
+            ("backfill", await run_backfill(source, addresses, args, os.path.join(tmp, "state.json"))),
+        ):
+            print(f"{name:<11} {elapsed:>8.2f} {args.blocks / elapsed:>9.0f} {transfers:>10}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Benchmark: TRX and USDT balances of many addresses, one by one vs batched
+
+Starts a local stand-in for a TRON node. It answers getaccount,
+getcontract and triggerconstantcontract after --latency-ms, decoding the
+balanceOf call data it is sent. The balances of --addresses addresses
+are then read two ways:
+
+- sequential: per address a getaccount, then the contract ABI lookup and
+  the balanceOf call that tronpy's get_contract(...).functions.balanceOf
+  makes, one address after another as TronWalletManager.get_balance did
+- batched: BalanceReader, with getaccount and triggerconstantcontract
+  fanned out --concurrency at a time, and a second read served from its
+  cache
+
+Reported are the wall time, the node requests made and whether every
+balance came back right.
+
+Usage:
+    python benchmarks/bench_balance_reader.py
+    python benchmarks/bench_balance_reader.py --addresses 500 --latency-ms 80 --concurrency 64
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+from decimal import Decimal
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "payment-monitor"))
+
+import aiohttp
+import structlog
+from aiohttp import web
+from tronpy.keys import to_base58check_address
+
+from balance_reader import BALANCE_OF_SELECTOR, USDT_CONTRACT, BalanceReader, balance_of_data
+from provider_pool import ProviderPool, TronNode
+
+structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+
+
+class StandInNode:
+    def __init__(self, latency: float, balances: dict):
+        self.latency = latency
+        self.balances = balances  # address -> (sun, usdt raw)
+        self.requests = 0
+
+    async def _answer(self, body):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        return web.json_response(body)
+
+    async def get_account(self, request):
+        address = (await request.json())["address"]
+        return await self._answer({"balance": self.balances[address][0]})
+
+    async def get_contract(self, request):
+        return await self._answer({"abi": {"entrys": []}})
+
+    async def trigger_constant_contract(self, request):
+        data = (await request.json())["data"]
+        assert data.startswith(BALANCE_OF_SELECTOR)
+        address = to_base58check_address("41" + data[-40:])
+        return await self._answer({"result": {"result": True}, "constant_result": [f"{self.balances[address][1]:064x}"]})
+
+
+async def serve(node: StandInNode):
+    app = web.Application()
+    app.router.add_post("/wallet/getaccount", node.get_account)
+    app.router.add_post("/wallet/getcontract", node.get_contract)
+    app.router.add_post("/wallet/triggerconstantcontract", node.trigger_constant_contract)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+
+async def read_sequential(session, url, addresses) -> dict:
+    """getaccount, then the ABI lookup and balanceOf tronpy makes, one address at a time"""
+    results = {}
+    for address in addresses:
+        async with session.post(f"{url}/wallet/getaccount", json={"address": address, "visible": True}) as response:
+            trx = (await response.json()).get("balance", 0)
+        async with session.post(f"{url}/wallet/getcontract", json={"value": USDT_CONTRACT, "visible": True}) as response:
+            await response.json()
+        async with session.post(f"{url}/wallet/triggerconstantcontract", json={
+            "owner_address": address, "contract_address": USDT_CONTRACT, "visible": True,
+            "data": balance_of_data(address)
+        }) as response:
+            usdt = int((await response.json())["constant_result"][0], 16)
+        results[address] = {"TRX": Decimal(trx).scaleb(-6), "USDT": Decimal(usdt).scaleb(-6)}
+    return results
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--addresses", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=50, help="node response time")
+    parser.add_argument("--concurrency", type=int, default=32, help="BalanceReader requests in flight")
+    args = parser.parse_args()
+
+    random.seed(1)
+    addresses = [to_base58check_address("41" + os.urandom(20).hex()) for _ in range(args.addresses)]
+    balances = {address: (random.randint(0, 10 ** 9), random.randint(0, 10 ** 12)) for address in addresses}
+    expected = {address: {"TRX": Decimal(trx).scaleb(-6), "USDT": Decimal(usdt).scaleb(-6)}
+                for address, (trx, usdt) in balances.items()}
+
+    node = StandInNode(args.latency_ms / 1000, balances)
+    runner, url = await serve(node)
+    print(f"{args.addresses} addresses, {args.latency_ms:.0f}ms node\n")
+    print(f"{'variant':<16} {'seconds':>8} {'requests':>9} {'correct':>8}")
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit_per_host=args.concurrency * 2)) as session:
+        async def get_session():
+            return session
+
+        start = time.perf_counter()
+        result = await read_sequential(session, url, addresses)
+        print(f"{'sequential':<16} {time.perf_counter() - start:>8.2f} {node.requests:>9} {str(result == expected):>8}")
+
+        reader = BalanceReader(ProviderPool([TronNode(url)]), get_session, concurrency=args.concurrency)
+        for name in ("batched", "batched, cached"):
+            node.requests = 0
+            start = time.perf_counter()
+            trx, usdt = await asyncio.gather(reader.trx_balances(addresses), reader.trc20_balances(addresses))
+            elapsed = time.perf_counter() - start
+            result = {address: {"TRX": trx[address], "USDT": usdt[address]} for address in addresses}
+            print(f"{name:<16} {elapsed:>8.2f} {node.requests:>9} {str(result == expected):>8}")
+
+    await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
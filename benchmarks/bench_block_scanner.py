@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Benchmark: block scanner cost vs number of watched addresses
+
+Writes synthetic blocks in the fixture format of block_scanner.py record
+(getblockbylimitnext blocks plus gettransactioninfobyblocknum results)
+and scans them offline with increasing watched address sets. Per-address
+history polling needs one request per watched address per poll, while
+the scanner makes one block read per block whatever the number of
+watched addresses; decoding time should stay flat too. What the decoder
+returns is checked by payment-monitor/tests/test_block_scanner.py against
+blocks in the full node response format.
+
+Usage:
+    python benchmarks/bench_block_scanner.py
+    python benchmarks/bench_block_scanner.py --blocks 500 --transfers 200
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "payment-monitor"))
+
+from block_scanner import TRANSFER_TOPIC, USDT_CONTRACT, BlockScanner, FixtureBlockSource, Token
+from tronpy.keys import to_hex_address
+
+START_BLOCK = 60000000
+USDT_HEX = to_hex_address(USDT_CONTRACT)
+
+
+def random_address() -> str:
+    return "41" + os.urandom(20).hex()
+
+
+def build_fixture(blocks: int, transfers: int, recipients: list) -> dict:
+    """Blocks with `transfers` USDT Transfer logs each, sent to random picks from recipients"""
+    fixture = {"blocks": [], "transaction_infos": {}}
+    for number in range(START_BLOCK, START_BLOCK + blocks):
+        txs, infos = [], []
+        for i in range(transfers):
+            tx_id = f"{number:016x}{i:048x}"
+            txs.append({
+                "txID": tx_id,
+                "raw_data": {"contract": [{
+                    "type": "TriggerSmartContract",
+                    "parameter": {"value": {"contract_address": USDT_HEX}}
+                }]}
+            })
+            infos.append({
+                "id": tx_id,
+                "blockNumber": number,
+                "blockTimeStamp": 1700000000000 + number * 3000,
+                "receipt": {"result": "SUCCESS"},
+                "log": [{
+                    "address": USDT_HEX[2:],
+                    "topics": [TRANSFER_TOPIC, "0" * 24 + random_address()[2:], "0" * 24 + random.choice(recipients)[2:]],
+                    "data": f"{random.randint(1, 10 ** 9):064x}"
+                }]
+            })
+        fixture["blocks"].append({
+            "blockID": f"{number:064x}",
+            "block_header": {"raw_data": {"number": number, "timestamp": 1700000000000 + number * 3000,
+                                          "parentHash": f"{number - 1:064x}"}},
+            "transactions": txs
+        })
+        fixture["transaction_infos"][str(number)] = infos
+    return fixture
+
+
+class CountingSource(FixtureBlockSource):
+    """Counts the chain reads the scanner makes"""
+
+    reads = 0
+
+    async def get_blocks(self, start, end):
+        self.reads += 1
+        return await super().get_blocks(start, end)
+
+    async def get_transaction_infos(self, number):
+        self.reads += 1
+        return await super().get_transaction_infos(number)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--blocks", type=int, default=200, help="blocks to scan")
+    parser.add_argument("--transfers", type=int, default=100, help="USDT transfers per block")
+    parser.add_argument("--watched", type=int, nargs="+", default=[1, 1000, 100000], help="watched set sizes")
+    args = parser.parse_args()
+
+    watched = [random_address() for _ in range(max(args.watched))]
+    # Half of the transfers go to watched addresses, half to strangers
+    recipients = watched[:min(args.watched)] + [random_address() for _ in range(min(args.watched))]
+
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump(build_fixture(args.blocks, args.transfers, recipients), f)
+        path = f.name
+
+    print(f"{args.blocks} blocks, {args.transfers} USDT transfers per block\n")
+    print(f"{'watched':>8} {'blocks/s':>9} {'reads/block':>12} {'matches':>8} {'history requests/poll':>22}")
+    try:
+        for size in args.watched:
+            source = CountingSource(path)
+            scanner = BlockScanner(source, [Token(USDT_CONTRACT, "USDT", 6)], watched[:size])
+            start = time.perf_counter()
+            scanned = await scanner.scan(START_BLOCK, START_BLOCK + args.blocks)
+            elapsed = time.perf_counter() - start
+            matches = sum(len(block.transfers) for block in scanned)
+            print(f"{size:>8} {len(scanned) / elapsed:>9.0f} {source.reads / len(scanned):>12.2f} {matches:>8} {size:>22}")
+    finally:
+        os.unlink(path)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Benchmark: replica coordination, address spread and failover time
+
+Starts --replicas MonitorCoordinator instances against one Redis, as if
+that many payment-monitor containers were running:
+
+- shard: --addresses watched addresses are split by rendezvous hashing.
+  Reported are the addresses per replica, the TronGrid history listings
+  polled per tick (each replica polling every address, as before, against
+  one poll per address), and how many addresses move when a replica stops.
+- leader: one replica is active. It is then stopped cleanly, and the next
+  one is killed without releasing its lease. Reported is the time until a
+  standby holds the lease in each case, against the polling interval.
+
+Needs a Redis server; the coordination keys in the given database are
+deleted.
+
+Usage:
+    python benchmarks/bench_coordination.py
+    python benchmarks/bench_coordination.py --replicas 5 --addresses 2000 --ttl 1
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "payment-monitor"))
+
+import redis.asyncio as redis
+import structlog
+
+from coordination import LEASE_KEY_PREFIX, REPLICAS_KEY, MonitorCoordinator, shard_owner
+
+# Every lease change is logged, which would swamp the results
+structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.ERROR))
+
+
+async def reset(redis_client):
+    keys = [key async for key in redis_client.scan_iter(f"{LEASE_KEY_PREFIX}:*")]
+    await redis_client.delete(REPLICAS_KEY, *keys)
+
+
+async def settle(replicas: list, addresses: list, ttl: float, timeout: float = 60.0):
+    """Wait until every replica holds exactly the addresses hashed to it"""
+    members = [replica.replica_id for replica in replicas]
+    expected = {member: set() for member in members}
+    for address in addresses:
+        expected[shard_owner(address, members)].add(address)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if all(replica.owned == expected[replica.replica_id] for replica in replicas):
+            return
+        await asyncio.sleep(ttl / 10)
+    raise RuntimeError("replicas did not settle on one owner per address")
+
+
+async def run_shard(args, redis_client):
+    addresses = [f"TBenchAddress{i:021d}" for i in range(args.addresses)]
+    replicas = [MonitorCoordinator(redis_client, "shard", addresses, ttl=args.ttl, replica_id=f"replica-{i}")
+                for i in range(args.replicas)]
+    for replica in replicas:
+        await replica.start()
+    await settle(replicas, addresses, args.ttl)
+
+    counts = [len(replica.owned) for replica in replicas]
+    print(f"shard: {args.addresses} addresses over {args.replicas} replicas")
+    print(f"  addresses per replica   min {min(counts)}  max {max(counts)}  ideal {args.addresses / args.replicas:.0f}")
+    print(f"  listings polled / tick  uncoordinated {args.addresses * args.replicas}  sharded {sum(counts)}")
+
+    before = [set(replica.owned) for replica in replicas]
+    leaving = replicas.pop()
+    start = time.monotonic()
+    await leaving.stop()
+    await settle(replicas, addresses, args.ttl)
+    moved = sum(len(replica.owned - owned) for replica, owned in zip(replicas, before))
+    print(f"  one replica stopped     {moved} addresses moved ({len(before[-1])} were its own), "
+          f"rebalanced in {time.monotonic() - start:.2f}s\n")
+
+    for replica in replicas:
+        await replica.stop()
+
+
+async def failover(replicas: list, stop, ttl: float) -> float:
+    """Stop the active replica and time until another one holds the lease"""
+    active = next(replica for replica in replicas if replica.owned)
+    replicas.remove(active)
+    start = time.monotonic()
+    await stop(active)
+    while not any(replica.owned for replica in replicas):
+        await asyncio.sleep(ttl / 100)
+    return time.monotonic() - start
+
+
+async def crash(replica: MonitorCoordinator):
+    """Stop renewing without releasing anything, as a killed process would"""
+    replica._task.cancel()
+    await asyncio.gather(replica._task, return_exceptions=True)
+
+
+async def run_leader(args, redis_client):
+    replicas = [MonitorCoordinator(redis_client, "leader", ["TBenchAddress"], ttl=args.ttl, replica_id=f"replica-{i}")
+                for i in range(max(args.replicas, 3))]
+    for replica in replicas:
+        await replica.start()
+
+    print(f"leader: {len(replicas)} replicas, lease ttl {args.ttl:.1f}s, active polling interval {args.poll_interval:.1f}s")
+    graceful = await failover(replicas, lambda replica: replica.stop(), args.ttl)
+    print(f"  clean stop  standby active after {graceful:.2f}s")
+    crashed = await failover(replicas, crash, args.ttl)
+    print(f"  crash       standby active after {crashed:.2f}s (bound: ttl + ttl/4 = {args.ttl * 5 / 4:.2f}s)")
+
+    for replica in replicas:
+        await replica.stop()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--replicas", type=int, default=4)
+    parser.add_argument("--addresses", type=int, default=1000)
+    parser.add_argument("--ttl", type=float, default=2.0, help="lease ttl, MONITOR_LEASE_TTL")
+    parser.add_argument("--poll-interval", type=float, default=3.0,
+                        help="active polling interval (POLL_ACTIVE_INTERVAL), for reference")
+    parser.add_argument("--redis-url", default="redis://localhost:6379/15")
+    args = parser.parse_args()
+
+    redis_client = redis.from_url(args.redis_url)
+    await reset(redis_client)
+    await run_shard(args, redis_client)
+    await run_leader(args, redis_client)
+    await reset(redis_client)
+    await redis_client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
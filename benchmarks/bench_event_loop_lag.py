@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Benchmark: event loop lag with blocking tronpy calls inline vs offloaded
+
+Issues a burst of concurrent chain calls against a stand-in for the
+synchronous tronpy client (each call blocks its thread for --latency
+seconds, like tronpy waiting on a node round trip) while LoopLagProbe
+measures how late the event loop wakes up. Inline is the previous
+behaviour: the sync client called straight from a coroutine. Offloaded
+goes through AsyncChain's bounded thread pool.
+
+Usage:
+    python benchmarks/bench_event_loop_lag.py
+    python benchmarks/bench_event_loop_lag.py --calls 500 --latency 0.05 --workers 16
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from chain_executor import AsyncChain
+from loop_lag import LoopLagProbe
+
+
+class BlockingTron:
+    """Stand-in for tronpy.Tron: every call blocks for `latency` seconds"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def get_latest_block(self):
+        time.sleep(self.latency)
+        return {"block_header": {"raw_data": {"number": 60000000}}}
+
+
+async def run(get_block_number, calls: int, concurrency: int):
+    """Make `calls` head lookups from `concurrency` tasks while probing the loop"""
+    probe = LoopLagProbe(interval=0.01, window=100000, warn_threshold=float("inf"))
+    probe.start()
+    await asyncio.sleep(0.05)
+
+    per_task = calls // concurrency
+
+    async def task():
+        for _ in range(per_task):
+            assert await get_block_number() == 60000000
+
+    start = time.perf_counter()
+    await asyncio.gather(*(task() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    # Let the probe record the wakeup that was delayed by the burst
+    await asyncio.sleep(probe.interval * 2)
+    await probe.stop()
+    return per_task * concurrency / elapsed, probe.snapshot()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200, help="chain calls per variant")
+    parser.add_argument("--concurrency", type=int, default=20, help="concurrent callers")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds each blocking call takes")
+    parser.add_argument("--workers", type=int, default=8, help="chain executor threads")
+    args = parser.parse_args()
+
+    tron = BlockingTron(args.latency)
+
+    async def inline():
+        block = tron.get_latest_block()
+        return block["block_header"]["raw_data"]["number"]
+
+    chain = AsyncChain(tron, max_workers=args.workers)
+
+    async def offloaded():
+        block = await chain.call(tron.get_latest_block)
+        return block["block_header"]["raw_data"]["number"]
+
+    before = await run(inline, args.calls, args.concurrency)
+    after = await run(offloaded, args.calls, args.concurrency)
+    chain.close()
+
+    print(f"{args.calls} calls, {args.concurrency} concurrent callers, {args.latency * 1000:.0f}ms per call, "
+          f"{args.workers} executor threads\n")
+    print(f"{'variant':<10} {'calls/s':>8} {'lag p50 ms':>11} {'lag p99 ms':>11} {'lag max ms':>11}")
+    for name, (rate, lag) in (("inline", before), ("offloaded", after)):
+        print(f"{name:<10} {rate:>8.0f} {lag['p50'] * 1000:>11.1f} {lag['p99'] * 1000:>11.1f} {lag['max'] * 1000:>11.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Benchmark: monitor tick time, one transaction at a time vs the staged pipeline
+
+Runs TronPaymentMonitor ticks over a burst of new USDT transfers with
+simulated latencies for the block lookup of each transfer and for each
+backend notification. The sequential variant handles every transfer the
+way check_for_payments used to: filter, look up its block, then notify,
+before moving on to the next one. The pipelined variant is the monitor
+as it is, with PIPELINE_CONFIRM_WORKERS and PIPELINE_NOTIFY_WORKERS
+workers. Per-stage counts and the Prometheus stage timings show where the
+time goes.
+
+Usage:
+    python benchmarks/bench_monitor_pipeline.py
+    python benchmarks/bench_monitor_pipeline.py --transfers 500 --lookup-ms 80 --notify-ms 40
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "payment-monitor"))
+
+import structlog
+from prometheus_client import REGISTRY
+from tron_monitor import TronPaymentMonitor
+
+# One log line per payment would dominate the timings
+structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+
+HEAD = 60000000
+
+
+class SimulatedMonitor(TronPaymentMonitor):
+    """History mode monitor whose chain and backend calls only sleep"""
+
+    def __init__(self, transfers: int, lookup: float, notify: float):
+        super().__init__()
+        self.lookup = lookup
+        self.notify = notify
+        self.burst = [{
+            "transaction_id": f"{i:064x}",
+            "from": "TXYZopYRdj2D9XRtbG411XZZ3kM5VkAeBf",
+            "to": self.payment_address,
+            "value": str(1000000 + i),
+            "block_timestamp": 1700000000000
+        } for i in range(transfers)]
+        self.notified = 0
+
+    async def get_latest_block_number(self) -> int:
+        return HEAD
+
+    async def get_new_transactions(self, addresses):
+        burst, self.burst = self.burst, []
+        return burst
+
+    async def get_transaction_block(self, tx_hash):
+        await asyncio.sleep(self.lookup)
+        return HEAD - 5
+
+    async def handle_payment_event(self, payment):
+        await asyncio.sleep(self.notify)
+        self.notified += 1
+
+
+class SequentialMonitor(SimulatedMonitor):
+    """Every transfer filtered, confirmed and notified before the next one, as before the pipeline"""
+
+    async def check_for_payments(self):
+        head = await self.chain_head.refresh()
+        for tx in await self.get_new_transactions(self.payment_addresses):
+            if await self.filter_transaction(tx):
+                for event in await self.confirm_transaction(tx):
+                    await self.notify_payment(event)
+        for tx_data, confirmations in self.pending_confirmations.ready(head):
+            await self.notify_payment(self.payment_event(tx_data, confirmations, head))
+
+
+def stage_seconds(stage: str) -> float:
+    return REGISTRY.get_sample_value("monitor_pipeline_stage_duration_seconds_sum", {"stage": stage}) or 0.0
+
+
+async def run(monitor: SimulatedMonitor) -> float:
+    await monitor.chain_head.refresh()
+    monitor.last_processed_block = HEAD - 1
+    start = time.perf_counter()
+    await monitor.check_for_payments()
+    elapsed = time.perf_counter() - start
+    await monitor.pipeline.close()
+    return elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transfers", type=int, default=200, help="new transfers in the tick")
+    parser.add_argument("--lookup-ms", type=float, default=50, help="block lookup latency per transfer")
+    parser.add_argument("--notify-ms", type=float, default=30, help="backend notification latency")
+    args = parser.parse_args()
+    lookup, notify = args.lookup_ms / 1000, args.notify_ms / 1000
+
+    print(f"{args.transfers} transfers, {args.lookup_ms:.0f}ms lookups, {args.notify_ms:.0f}ms notifications\n")
+    print(f"{'variant':<12} {'tick s':>8} {'notified':>9} {'transfers/s':>12}")
+
+    sequential = SequentialMonitor(args.transfers, lookup, notify)
+    elapsed = await run(sequential)
+    print(f"{'sequential':<12} {elapsed:>8.2f} {sequential.notified:>9} {sequential.notified / elapsed:>12.0f}")
+
+    pipelined = SimulatedMonitor(args.transfers, lookup, notify)
+    before = {stage: stage_seconds(stage) for stage in ("fetch", "filter", "confirm", "notify")}
+    elapsed = await run(pipelined)
+    print(f"{'pipelined':<12} {elapsed:>8.2f} {pipelined.notified:>9} {pipelined.notified / elapsed:>12.0f}")
+
+    print(f"\n{'stage':<10} {'workers':>8} {'passed':>7} {'dropped':>8} {'busy s':>8}")
+    stats = pipelined.pipeline.stats()
+    for stage, spent in before.items():
+        info = stats.get(stage, {})
+        print(f"{stage:<10} {info.get('workers', 1):>8} {info.get('passed', '-'):>7} {info.get('dropped', '-'):>8} "
+              f"{stage_seconds(stage) - spent:>8.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Benchmark: payment notifications through a slow, briefly failing backend
+
+Starts a local stand-in for the backend's notify endpoints. It answers
+after --latency-ms and returns 503 for the first --outage seconds. The
+same burst of payments is then notified two ways:
+
+- direct: one POST per payment, awaited by the detection loop; a non-200
+  is logged and the payment is gone, as before the outbox
+- outbox: payments are appended to NotificationOutbox, whose workers
+  deliver them with backoff and jitter until the backend accepts them
+
+Reported are the time the detection side spends per payment, how many
+payments reached the backend, and how long the last one took to arrive.
+
+Usage:
+    python benchmarks/bench_notification_outbox.py
+    python benchmarks/bench_notification_outbox.py --payments 500 --outage 3 --redis-url redis://localhost:6379/15
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "payment-monitor"))
+
+import aiohttp
+import structlog
+from aiohttp import web
+
+import notification_outbox
+from notification_outbox import NotificationOutbox
+
+# Every retry is logged as a warning, which would swamp the results
+structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.ERROR))
+
+
+class StandInBackend:
+    def __init__(self, latency: float, outage: float):
+        self.latency = latency
+        self.outage = outage
+        self.started = time.monotonic()
+        self.received = set()
+        self.last_received = 0.0
+
+    async def notify(self, request):
+        return await self._accept(request, [await request.json()])
+
+    async def notify_batch(self, request):
+        return await self._accept(request, await request.json())
+
+    async def _accept(self, request, payloads):
+        await asyncio.sleep(self.latency)
+        if time.monotonic() - self.started < self.outage:
+            return web.json_response({"detail": "unavailable"}, status=503)
+        self.received.update(payload["tx_hash"] for payload in payloads)
+        self.last_received = time.monotonic()
+        return web.json_response({"status": "success", "results": [], "matched": len(payloads)})
+
+
+async def serve(backend: StandInBackend):
+    app = web.Application()
+    app.router.add_post("/internal/payments/notify", backend.notify)
+    app.router.add_post("/internal/payments/notify-batch", backend.notify_batch)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+
+def payments(count: int, prefix: str) -> list:
+    return [{"tx_hash": f"{prefix}{i:060x}", "amount": "10.000001", "token": "USDT-TRC20"} for i in range(count)]
+
+
+async def run_direct(args, session) -> dict:
+    backend = StandInBackend(args.latency_ms / 1000, args.outage)
+    runner, url = await serve(backend)
+    start = time.monotonic()
+    for payment in payments(args.payments, "dir"):
+        async with session.post(f"{url}/internal/payments/notify", json=payment) as response:
+            await response.read()
+    detect = time.monotonic() - start
+    await runner.cleanup()
+    return {"detect": detect, "received": len(backend.received), "arrival": backend.last_received - start}
+
+
+async def run_outbox(args, session, redis_client) -> dict:
+    backend = StandInBackend(args.latency_ms / 1000, args.outage)
+    runner, url = await serve(backend)
+
+    async def send(batch):
+        if len(batch) == 1:
+            target, body = f"{url}/internal/payments/notify", batch[0]
+        else:
+            target, body = f"{url}/internal/payments/notify-batch", batch
+        async with session.post(target, json=body) as response:
+            # The stand-in backend pays every order it hears about
+            return [payment["tx_hash"] for payment in batch] if response.status == 200 else None
+
+    outbox = NotificationOutbox(redis_client, send, concurrency=args.workers, batch_size=args.batch_size,
+                                backoff_base=0.25, backoff_max=2.0)
+    await outbox.start()
+    start = time.monotonic()
+    for payment in payments(args.payments, "box"):
+        await outbox.append(payment)
+    detect = time.monotonic() - start
+    deadline = start + args.outage + 60
+    while len(backend.received) < args.payments and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    await outbox.stop()
+    await runner.cleanup()
+    return {"detect": detect, "received": len(backend.received), "arrival": backend.last_received - start}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--payments", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=20, help="backend response time")
+    parser.add_argument("--outage", type=float, default=2.0, help="seconds the backend answers 503 at first")
+    parser.add_argument("--workers", type=int, default=4, help="outbox delivery workers")
+    parser.add_argument("--batch-size", type=int, default=1, help="outbox entries per backend call")
+    parser.add_argument("--redis-url", help="keep the outbox in this Redis (its outbox keys are deleted)")
+    args = parser.parse_args()
+
+    redis_client = None
+    if args.redis_url:
+        import redis.asyncio as redis
+        redis_client = redis.from_url(args.redis_url)
+        await redis_client.delete(notification_outbox.STREAM_KEY, notification_outbox.RETRY_KEY,
+                                  notification_outbox.INDEX_KEY)
+
+    print(f"{args.payments} payments, {args.latency_ms:.0f}ms backend, {args.outage:.1f}s outage at start\n")
+    print(f"{'variant':<8} {'detect ms/payment':>18} {'delivered':>10} {'last arrival s':>15}")
+    async with aiohttp.ClientSession() as session:
+        for name, result in (
+            ("direct", await run_direct(args, session)),
+            ("outbox", await run_outbox(args, session, redis_client)),
+        ):
+            print(f"{name:<8} {result['detect'] * 1000 / args.payments:>18.2f} "
+                  f"{result['received']:>10} {result['arrival']:>15.2f}")
+
+    if redis_client is not None:
+        await redis_client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Benchmark: payment amount suffix allocation at high occupancy
+
+Compares the bitmap allocator in backend/payment_allocator.py against the
+previous random-probe strategy (draw a random suffix, check for a clash,
+give up after 100 attempts) while the suffix space is 90%+ occupied.
+
+Usage:
+    python benchmarks/bench_payment_allocator.py
+    python benchmarks/bench_payment_allocator.py --redis-url redis://localhost:6379/15
+"""
+
+import argparse
+import asyncio
+import os
+import secrets
+import sys
+import time
+from decimal import Decimal
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from payment_allocator import PaymentSuffixAllocator, SUFFIX_CAPACITY
+
+ADDRESS = "TBenchPaymentAddress00000000000000"
+BASE_AMOUNT = Decimal("15.99")
+OCCUPANCY_LEVELS = [0.90, 0.95, 0.99]
+LEASE_SECONDS = 1200
+
+
+def bench_random_probe(occupancy: float, operations: int) -> dict:
+    """Old strategy: random suffix + existence probe, 100 attempts max"""
+    taken = set(range(1, int(SUFFIX_CAPACITY * occupancy)))
+    probes = 0
+    collisions = 0
+    start = time.perf_counter()
+
+    for _ in range(operations):
+        for _attempt in range(100):
+            probes += 1
+            suffix = secrets.randbelow(SUFFIX_CAPACITY)
+            if suffix not in taken:
+                break
+        else:
+            # Fallback suffix was not checked for uniqueness at all
+            collisions += 1
+
+    elapsed = time.perf_counter() - start
+    return {
+        "ops_per_sec": operations / elapsed,
+        "probes_per_op": probes / operations,
+        "collisions": collisions
+    }
+
+
+async def bench_bitmap(allocator: PaymentSuffixAllocator, occupancy: float, operations: int) -> dict:
+    """Bitmap allocator: allocate + release cycles on top of a pre-filled space"""
+    address = f"{ADDRESS}-{int(occupancy * 100)}"
+    held = []  # (suffix, lease token)
+    for i in range(int(SUFFIX_CAPACITY * occupancy)):
+        suffix = await allocator.allocate(address, BASE_AMOUNT, LEASE_SECONDS, f"fill-{i}")
+        if suffix is None:
+            break
+        held.append((suffix, f"fill-{i}"))
+
+    failures = 0
+    start = time.perf_counter()
+    for i in range(operations):
+        suffix = await allocator.allocate(address, BASE_AMOUNT, LEASE_SECONDS, f"op-{i}")
+        if suffix is None:
+            failures += 1
+            continue
+        # Release a random held suffix to keep occupancy steady and the bitmap fragmented
+        victim = secrets.randbelow(len(held))
+        await allocator.release(address, BASE_AMOUNT, *held[victim])
+        held[victim] = (suffix, f"op-{i}")
+    elapsed = time.perf_counter() - start
+
+    for suffix, token in held:
+        await allocator.release(address, BASE_AMOUNT, suffix, token)
+
+    return {
+        "ops_per_sec": operations / elapsed,
+        "failures": failures
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--operations", type=int, default=50000)
+    parser.add_argument("--redis-url", default=None, help="Also benchmark the Redis-backed bitmap")
+    args = parser.parse_args()
+
+    backends = [("in-process bitmap", PaymentSuffixAllocator())]
+    redis_client = None
+    if args.redis_url:
+        import redis.asyncio as redis
+        redis_client = redis.from_url(args.redis_url)
+        backends.append(("redis bitmap", PaymentSuffixAllocator(redis_client)))
+
+    print(f"Suffix capacity: {SUFFIX_CAPACITY}, operations per level: {args.operations}\n")
+    print(f"{'strategy':<20} {'occupancy':>9} {'ops/sec':>12} {'probes/op':>10} {'failed':>8}")
+
+    for occupancy in OCCUPANCY_LEVELS:
+        result = bench_random_probe(occupancy, args.operations)
+        print(f"{'random probe':<20} {occupancy:>9.0%} {result['ops_per_sec']:>12,.0f} "
+              f"{result['probes_per_op']:>10.1f} {result['collisions']:>8}")
+
+        for name, allocator in backends:
+            operations = args.operations if redis_client is None else min(args.operations, 10000)
+            result = await bench_bitmap(allocator, occupancy, operations)
+            print(f"{name:<20} {occupancy:>9.0%} {result['ops_per_sec']:>12,.0f} "
+                  f"{1.0:>10.1f} {result['failures']:>8}")
+
+    if redis_client is not None:
+        await redis_client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
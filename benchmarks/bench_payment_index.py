@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Benchmark: replay payment notifications against the pending order match index
+
+Replays 100k notifications (a configurable share of which match a pending
+order, the rest being unrelated transfers, stale amounts and other
+recipients) against backend/payment_index.py and, for reference, against the
+previous per-notification SQL lookup run on an in-memory SQLite copy of the
+orders table. SQLite has no network hop, so it is a lower bound for the
+Postgres round trip the endpoint used to pay.
+
+Usage:
+    python benchmarks/bench_payment_index.py
+    python benchmarks/bench_payment_index.py --redis-url redis://localhost:6379/15
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from payment_allocator import suffix_to_amount
+from payment_index import PendingOrderIndex, normalize_amount
+
+PAYMENT_ADDRESS = "TBenchPaymentAddress00000000000000"
+BASE_AMOUNTS = [Decimal(p) for p in ("12.99", "15.99", "18.99", "25.99", "39.99")]
+
+
+def build_orders(count: int):
+    expires_at = datetime.utcnow() + timedelta(minutes=15)
+    orders = []
+    for order_id in range(1, count + 1):
+        base = BASE_AMOUNTS[order_id % len(BASE_AMOUNTS)]
+        suffix = order_id // len(BASE_AMOUNTS) + 1
+        orders.append((order_id, PAYMENT_ADDRESS, suffix_to_amount(base, suffix), expires_at))
+    return orders
+
+
+def build_notifications(orders, count: int, match_ratio: float):
+    notifications = []
+    for _ in range(count):
+        roll = random.random()
+        if roll < match_ratio:
+            _, address, amount, _ = random.choice(orders)
+        elif roll < match_ratio + (1 - match_ratio) / 2:
+            # Right address, amount nobody is waiting for (wrong suffix, round amounts)
+            address = PAYMENT_ADDRESS
+            amount = suffix_to_amount(random.choice(BASE_AMOUNTS), random.randint(9000, 9999))
+        else:
+            # Transfers to other watched addresses
+            address = f"TOther{random.randint(0, 999):028d}"
+            amount = Decimal(random.randint(1, 50000)) / 100
+        notifications.append((address, amount))
+    return notifications
+
+
+def summarize(name: str, latencies: list, matches: int):
+    latencies.sort()
+    total = sum(latencies)
+    p99 = latencies[int(len(latencies) * 0.99)]
+    print(f"{name:<28} {len(latencies) / total:>12,.0f} {statistics.median(latencies) * 1e6:>9.1f} "
+          f"{p99 * 1e6:>9.1f} {matches:>8}")
+
+
+async def replay_index(index: PendingOrderIndex, notifications) -> tuple:
+    latencies = []
+    matches = 0
+    for address, amount in notifications:
+        start = time.perf_counter()
+        order_id = await index.lookup(address, amount)
+        latencies.append(time.perf_counter() - start)
+        if order_id is not None:
+            matches += 1
+    return latencies, matches
+
+
+def replay_sql(orders, notifications) -> tuple:
+    conn = sqlite3.connect(":memory:")
+    conn.execute(
+        "CREATE TABLE orders (id INTEGER PRIMARY KEY, payment_address TEXT, total_amount TEXT, "
+        "status TEXT, expires_at TEXT)"
+    )
+    conn.execute("CREATE INDEX idx_orders_total_amount ON orders(total_amount)")
+    conn.executemany(
+        "INSERT INTO orders VALUES (?, ?, ?, 'pending_payment', ?)",
+        [(oid, addr, normalize_amount(amount), exp.isoformat()) for oid, addr, amount, exp in orders]
+    )
+
+    latencies = []
+    matches = 0
+    for address, amount in notifications:
+        start = time.perf_counter()
+        row = conn.execute(
+            "SELECT id FROM orders WHERE total_amount = ? AND payment_address = ? AND status = 'pending_payment'",
+            (normalize_amount(amount), address)
+        ).fetchone()
+        latencies.append(time.perf_counter() - start)
+        if row is not None:
+            matches += 1
+    conn.close()
+    return latencies, matches
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notifications", type=int, default=100000)
+    parser.add_argument("--pending-orders", type=int, default=20000)
+    parser.add_argument("--match-ratio", type=float, default=0.2)
+    parser.add_argument("--redis-url", default=None, help="Also replay against a Redis-backed index")
+    args = parser.parse_args()
+
+    random.seed(42)
+    orders = build_orders(args.pending_orders)
+    notifications = build_notifications(orders, args.notifications, args.match_ratio)
+
+    print(f"{args.notifications} notifications, {args.pending_orders} pending orders, "
+          f"{args.match_ratio:.0%} expected matches\n")
+    print(f"{'lookup path':<28} {'lookups/sec':>12} {'p50 us':>9} {'p99 us':>9} {'matched':>8}")
+
+    index = PendingOrderIndex()
+    for order_id, address, amount, expires_at in orders:
+        await index.add(address, amount, order_id, expires_at)
+    summarize("index (in-process)", *await replay_index(index, notifications))
+
+    if args.redis_url:
+        import redis.asyncio as redis
+        redis_client = redis.from_url(args.redis_url)
+        writer = PendingOrderIndex(redis_client)
+        for order_id, address, amount, expires_at in orders:
+            await writer.add(address, amount, order_id, expires_at)
+
+        # Redis is authoritative, so every lookup is one HGET
+        summarize("index (redis)", *await replay_index(PendingOrderIndex(redis_client), notifications))
+
+        for order_id, address, amount, _ in orders:
+            await writer.remove(address, amount, order_id)
+        await redis_client.close()
+
+    summarize("sql per notification", *replay_sql(orders, notifications))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Benchmark: transfer-to-paid time and poll count, fixed vs adaptive polling
+
+Simulates a day of orders on a virtual clock. Orders follow a daily
+curve with nothing between 01:00 and 07:00. Most customers pay within a
+few minutes of creating their order; some never pay. A transfer is seen
+by the first poll after its block (one block every 3s), and the order is
+paid --notify-ms later. Two schedules are run over the same orders:
+
+- fixed: a poll every --fixed-interval seconds, as before
+- adaptive: PollScheduler, fed the created/paid events the backend
+  publishes, with a created event waking the monitor at once
+
+Reported are the median and p95 transfer-to-paid times, and the number
+of polls over the whole day and during the idle night hours.
+
+Usage:
+    python benchmarks/bench_poll_scheduler.py
+    python benchmarks/bench_poll_scheduler.py --orders 2000 --seed 7
+"""
+
+import argparse
+import heapq
+import math
+import os
+import random
+import statistics
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "payment-monitor"))
+
+from poll_scheduler import PollScheduler
+
+DAY = 86400
+BLOCK_TIME = 3.0
+ORDER_WINDOW = 15 * 60 + 300  # order timeout plus payment grace
+
+
+def order_times(count: int) -> list:
+    """Creation times over a day, busiest in the evening, none from 01:00 to 07:00"""
+    times = []
+    while len(times) < count:
+        t = random.uniform(0, DAY)
+        hour = t / 3600
+        if 1 <= hour < 7:
+            continue
+        if random.random() < 0.5 + 0.5 * math.sin((hour - 13) / 24 * 2 * math.pi):
+            times.append(t)
+    return sorted(times)
+
+
+def build_orders(count: int, pay_share: float) -> list:
+    orders = []
+    for order_id, created in enumerate(order_times(count)):
+        paid_after = random.lognormvariate(math.log(60), 0.8) if random.random() < pay_share else None
+        if paid_after is not None and paid_after > ORDER_WINDOW:
+            paid_after = None
+        orders.append({"id": order_id, "created": created,
+                       "transfer": created + paid_after if paid_after is not None else None})
+    return orders
+
+
+def simulate(orders: list, schedule, notify: float) -> dict:
+    """Run polls on a virtual clock; schedule(now) returns the next wait or None for the fixed variant"""
+    events = []
+    for order in orders:
+        heapq.heappush(events, (order["created"], 0, "created", order))
+    waiting = []  # (block time of the transfer, order) not yet seen by a poll
+    for order in orders:
+        if order["transfer"] is not None:
+            block_at = math.ceil(order["transfer"] / BLOCK_TIME) * BLOCK_TIME
+            waiting.append((block_at, order))
+    waiting.sort(key=lambda item: item[0])
+
+    latencies, polls, night_polls = [], 0, 0
+    now, next_poll = 0.0, 0.0
+    while now < DAY:
+        # Order events before the next poll; a created event may pull the poll forward
+        while events and events[0][0] <= next_poll:
+            at, _, kind, order = heapq.heappop(events)
+            if schedule.on_created(order, at):
+                next_poll = at
+                break
+        now = next_poll
+        polls += 1
+        if 1 <= now / 3600 < 7:
+            night_polls += 1
+        while waiting and waiting[0][0] <= now:
+            block_at, order = waiting.pop(0)
+            latencies.append(now + notify - order["transfer"])
+            schedule.on_paid(order)
+        next_poll = now + schedule.next_interval(now)
+
+    latencies.sort()
+    return {
+        "median": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95)],
+        "paid": len(latencies),
+        "polls": polls,
+        "night_polls": night_polls
+    }
+
+
+class FixedSchedule:
+    def __init__(self, interval: float):
+        self.interval = interval
+
+    def on_created(self, order, at) -> bool:
+        return False
+
+    def on_paid(self, order):
+        pass
+
+    def next_interval(self, now: float) -> float:
+        return self.interval
+
+
+class AdaptiveSchedule:
+    def __init__(self):
+        # Any Redis client makes the scheduler adaptive; events are fed in directly here
+        self.scheduler = PollScheduler(object(), [])
+
+    def on_created(self, order, at) -> bool:
+        self.scheduler.order_created(order["id"], at + ORDER_WINDOW, now=at)
+        return True
+
+    def on_paid(self, order):
+        self.scheduler.order_closed(order["id"])
+
+    def next_interval(self, now: float) -> float:
+        return self.scheduler.next_interval(now)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=300, help="orders created over the day")
+    parser.add_argument("--pay-share", type=float, default=0.8, help="share of orders that get paid")
+    parser.add_argument("--fixed-interval", type=float, default=30.0)
+    parser.add_argument("--notify-ms", type=float, default=100, help="notification to paid")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    orders = build_orders(args.orders, args.pay_share)
+
+    print(f"{args.orders} orders over a day, {args.pay_share:.0%} paid\n")
+    print(f"{'schedule':<10} {'median s':>9} {'p95 s':>7} {'paid':>6} {'polls/day':>10} {'polls 01-07h':>13}")
+    for name, schedule in (("fixed", FixedSchedule(args.fixed_interval)), ("adaptive", AdaptiveSchedule())):
+        result = simulate(orders, schedule, args.notify_ms / 1000)
+        print(f"{name:<10} {result['median']:>9.1f} {result['p95']:>7.1f} {result['paid']:>6} "
+              f"{result['polls']:>10} {result['night_polls']:>13}")
+
+
+if __name__ == "__main__":
+    main()
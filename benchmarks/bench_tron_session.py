@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Benchmark: session-per-call vs shared pooled session in TronClient
+
+Starts a local stand-in for TronGrid serving the endpoints used by
+get_recent_transactions, then polls it with the previous behaviour (a new
+aiohttp.ClientSession, hence a new connection, per call) and with
+TronClient's shared keepalive session.
+
+The stand-in is plain HTTP on loopback, so the numbers only include TCP
+setup and session construction; against TronGrid the per-call variant
+also pays DNS and a TLS handshake on every poll.
+
+Usage:
+    python benchmarks/bench_tron_session.py
+    python benchmarks/bench_tron_session.py --calls 5000 --concurrency 20
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from tron_client import TronClient
+
+ADDRESS = "TJRabPrwbZy45sbavfcjinPJC18kjpRTv8"
+BLOCK_TIMESTAMP = int(time.time() * 1000) - 60000
+
+
+def trc20_transfer(i: int) -> dict:
+    return {
+        "transaction_id": f"{i:064x}",
+        "from": "TXYZopYRdj2D9XRtbG411XZZ3kM5VkAeBf",
+        "to": ADDRESS,
+        "value": str(15990000 + i),
+        "block_timestamp": BLOCK_TIMESTAMP,
+        "token_info": {"symbol": "USDT", "decimals": 6}
+    }
+
+
+def build_app() -> web.Application:
+    trc20 = {"data": [trc20_transfer(i) for i in range(20)], "success": True}
+    trx = {"data": [], "success": True}
+
+    async def transactions(request):
+        return web.json_response(trx)
+
+    async def transactions_trc20(request):
+        return web.json_response(trc20)
+
+    async def now_block(request):
+        return web.json_response({"block_header": {"raw_data": {"number": 60000000}}})
+
+    async def transaction_info(request):
+        return web.json_response({"blockNumber": 59999990})
+
+    app = web.Application()
+    app.router.add_get("/v1/accounts/{address}/transactions", transactions)
+    app.router.add_get("/v1/accounts/{address}/transactions/trc20", transactions_trc20)
+    app.router.add_post("/wallet/getnowblock", now_block)
+    app.router.add_post("/wallet/gettransactioninfobyid", transaction_info)
+    return app
+
+
+class SessionPerCallClient(TronClient):
+    """The previous behaviour: a fresh ClientSession for every call"""
+
+    async def get_recent_transactions(self, *args, **kwargs):
+        self.session = aiohttp.ClientSession()
+        try:
+            return await super().get_recent_transactions(*args, **kwargs)
+        finally:
+            await self.close()
+
+
+async def run(clients, calls: int) -> float:
+    """Spread `calls` polls over the clients (one worker each), returning polls per second"""
+    per_worker = calls // len(clients)
+
+    async def worker(client):
+        for _ in range(per_worker):
+            transactions = await client.get_recent_transactions(ADDRESS, limit=20)
+            assert len(transactions) == 20 and transactions[0]["confirmations"] == 11
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(client) for client in clients))
+    return per_worker * len(clients) / (time.perf_counter() - start)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=2000, help="get_recent_transactions calls per variant")
+    parser.add_argument("--concurrency", type=int, default=10, help="concurrent pollers")
+    args = parser.parse_args()
+
+    runner = web.AppRunner(build_app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    node_url = f"http://127.0.0.1:{port}"
+
+    try:
+        # Each call makes two HTTP requests (TRX and TRC20 transfers); the head and block lookups are cached
+        per_call = [SessionPerCallClient(None, node_url) for _ in range(args.concurrency)]
+        before = await run(per_call, args.calls)
+
+        shared = TronClient(None, node_url)
+        after = await run([shared] * args.concurrency, args.calls)
+        await shared.close()
+    finally:
+        await runner.cleanup()
+
+    print(f"{args.calls} get_recent_transactions calls, {args.concurrency} concurrent pollers, 2 HTTP requests per call\n")
+    print(f"{'variant':<22} {'calls/s':>9} {'requests/s':>11}")
+    print(f"{'session per call':<22} {before:>9.0f} {before * 2:>11.0f}")
+    print(f"{'shared pooled session':<22} {after:>9.0f} {after * 2:>11.0f}")
+    print(f"\nspeedup: {after / before:.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
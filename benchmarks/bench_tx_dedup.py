@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Benchmark: processed-transaction dedup, unbounded set vs SeenTransactions
+
+Inserts N transaction hashes into the old in-process set and into the
+recent-window store of tx_dedup.py, and reports memory held after the
+inserts (tracemalloc) and lookup/insert throughput. It also shows what
+the old cleanup did: `set(list(s)[5000:])` keeps an arbitrary part of a
+set, so some of the most recently handled hashes are forgotten and can be
+notified again.
+
+By default the store runs without Redis, with its local LRU capped at
+--local-capacity. With --redis-url the Redis sorted set is used too and
+the LRU only holds the hot end.
+
+Usage:
+    python benchmarks/bench_tx_dedup.py
+    python benchmarks/bench_tx_dedup.py --hashes 1000000 --redis-url redis://localhost:6379/15
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "payment-monitor"))
+
+from tx_dedup import SeenTransactions
+
+
+def tx_hashes(count: int) -> list:
+    return [os.urandom(32).hex() for _ in range(count)]
+
+
+def measure_set(hashes: list, lookups: list) -> dict:
+    tracemalloc.start()
+    start = time.perf_counter()
+    seen = set()
+    for tx_hash in hashes:
+        seen.add(tx_hash)
+    add_time = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for tx_hash in lookups:
+        _ = tx_hash in seen
+    lookup_time = time.perf_counter() - start
+    return {"memory": memory, "adds": len(hashes) / add_time, "lookups": len(lookups) / lookup_time, "held": len(seen)}
+
+
+async def measure_store(hashes: list, lookups: list, redis_client, local_capacity: int) -> dict:
+    tracemalloc.start()
+    store = SeenTransactions(redis_client, key="bench:seen-tx", local_capacity=local_capacity)
+    start = time.perf_counter()
+    if redis_client is not None:
+        # One Redis round trip per add; insert concurrently the way several polls would
+        for batch_start in range(0, len(hashes), 500):
+            await asyncio.gather(*(store.add(h) for h in hashes[batch_start:batch_start + 500]))
+    else:
+        for tx_hash in hashes:
+            await store.add(tx_hash)
+    add_time = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for batch_start in range(0, len(lookups), 200):
+        await store.filter_new(lookups[batch_start:batch_start + 200])
+    lookup_time = time.perf_counter() - start
+
+    # The most recent hashes must all still be known
+    recent = hashes[-min(len(hashes), local_capacity):]
+    missing = len(await store.filter_new(recent[-10000:]))
+    return {"memory": memory, "adds": len(hashes) / add_time, "lookups": len(lookups) / lookup_time,
+            "held": len(store), "recent_missing": missing}
+
+
+def old_cleanup_losses(hashes: list, recent: int) -> int:
+    """How many of the last `recent` hashes the old `set(list(s)[5000:])` cleanup forgets"""
+    seen = set(hashes[:10001])
+    kept = set(list(seen)[5000:])
+    return sum(1 for h in hashes[10001 - recent:10001] if h not in kept)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hashes", type=int, default=1000000, help="transaction hashes to insert")
+    parser.add_argument("--lookups", type=int, default=200000, help="lookups to time (half known, half new)")
+    parser.add_argument("--local-capacity", type=int, default=100000, help="SeenTransactions LRU size")
+    parser.add_argument("--redis-url", help="also back the store with this Redis (its bench key is deleted)")
+    args = parser.parse_args()
+
+    hashes = tx_hashes(args.hashes)
+    lookups = hashes[-args.lookups // 2:] + tx_hashes(args.lookups // 2)
+
+    redis_client = None
+    if args.redis_url:
+        import redis.asyncio as redis
+        redis_client = redis.from_url(args.redis_url)
+        await redis_client.delete("bench:seen-tx")
+
+    print(f"{args.hashes} hashes, {len(lookups)} lookups\n")
+    print(f"{'store':<28} {'memory MB':>10} {'held':>9} {'adds/s':>10} {'lookups/s':>10}")
+    result = measure_set(hashes, lookups)
+    print(f"{'set()':<28} {result['memory'] / 2 ** 20:>10.1f} {result['held']:>9} {result['adds']:>10.0f} {result['lookups']:>10.0f}")
+
+    label = "SeenTransactions+redis" if redis_client is not None else "SeenTransactions (local)"
+    try:
+        result = await measure_store(hashes, lookups, redis_client, args.local_capacity)
+        print(f"{label:<28} {result['memory'] / 2 ** 20:>10.1f} {result['held']:>9} {result['adds']:>10.0f} {result['lookups']:>10.0f}")
+        print(f"\nmost recent 10000 hashes not recognised by SeenTransactions: {result['recent_missing']}")
+        if redis_client is not None:
+            print(f"redis sorted set size: {await redis_client.zcard('bench:seen-tx')}")
+    finally:
+        if redis_client is not None:
+            await redis_client.delete("bench:seen-tx")
+            await redis_client.close()
+
+    print(f"most recent 1000 hashes forgotten by the old set(list(s)[5000:]) cleanup: {old_cleanup_losses(hashes, 1000)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
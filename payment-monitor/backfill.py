@@ -0,0 +1,457 @@
+"""
+Historical payment backfill and reconciliation
+
+The monitors only look at recent transfers, so payments made while they
+were down can be missed. This tool scans a past block or time range for
+USDT transfers to the payment addresses and checks them against the
+orders and payments tables:
+
+- recorded: the transfer is in payments
+- missed payments: not recorded, but it matches an unpaid order by
+  address and exact amount within the order's payment window
+- unmatched transfers: neither recorded nor matching any order
+- unpaid orders: orders whose payment window lies inside the range and
+  that are still unpaid, with no transfer found for them
+
+The range is split into chunks of --chunk-blocks blocks, and up to
+--concurrency chunks are scanned at a time. Node reads go through the
+provider pool in the background rate limit lane, at most --requests at
+a time across all chunks, so a running monitor keeps its quota.
+Decoding the Transfer logs is CPU bound and runs in a process pool of
+--decode-workers processes. Every finished chunk is recorded in the
+--state file, together with the block range the first run resolved.
+Running the same command again reuses that range, even though the head
+has moved on, and skips finished chunks, so an interrupted or partly
+failed backfill resumes where it stopped.
+
+Usage (in the payment-monitor container, with DATABASE_URL set):
+
+    python backfill.py --since 2026-10-16T22:00 --until 2026-10-17T06:00
+    python backfill.py --from-block 60000000 --to-block 60010000 --watch TQn9Y2khEsLJW1ChVWFMSMeRDow5KcbLSE
+    python backfill.py --fixtures blocks.json --report report.json   # blocks recorded with block_scanner.py
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+import structlog
+
+from block_scanner import USDT_CONTRACT, BlockScanner, FixtureBlockSource, NodeBlockSource, Token, block_number
+from provider_pool import ProviderPool, nodes_from_env
+from rate_limiter import PRIORITY_BACKGROUND, limiter_from_env
+
+logger = structlog.get_logger()
+
+BLOCK_INTERVAL_MS = 3000
+TOKENS = [Token(USDT_CONTRACT, "USDT", 6)]
+# Order statuses that mean the order was never paid
+UNPAID_STATUSES = ("pending_payment", "expired", "cancelled")
+
+_decoder: Optional[BlockScanner] = None
+
+
+def _init_decoder(tokens: List[Token], watched: List[str]):
+    global _decoder
+    _decoder = BlockScanner(None, tokens, watched)
+
+
+def _decode_chunk(fetched: List[Tuple[Dict[str, Any], List[Dict[str, Any]]]]) -> dict:
+    """Runs in a decode worker: the transfers in a chunk of blocks, as JSON-ready records"""
+    transfers = []
+    for block, infos in fetched:
+        for transfer in _decoder.decode(block, infos).transfers:
+            transfers.append({
+                "tx_hash": transfer.tx_hash,
+                "log_index": transfer.log_index,
+                "block_number": transfer.block_number,
+                "block_timestamp": transfer.block_timestamp,
+                "token": transfer.token.symbol,
+                "from_address": transfer.from_address,
+                "to_address": transfer.to_address,
+                "amount": str(Decimal(transfer.value).scaleb(-transfer.token.decimals))
+            })
+    timestamps = [block["block_header"]["raw_data"].get("timestamp", 0) for block, _ in fetched]
+    return {"first_timestamp": min(timestamps), "last_timestamp": max(timestamps), "transfers": transfers}
+
+
+class BoundedSource:
+    """A block source whose reads are limited to a number in flight, shared by all chunks"""
+
+    def __init__(self, source, requests: int):
+        self.source = source
+        self._slots = asyncio.Semaphore(requests)
+
+    async def get_blocks(self, start: int, end: int) -> List[Dict[str, Any]]:
+        async with self._slots:
+            return await self.source.get_blocks(start, end)
+
+    async def get_transaction_infos(self, number: int) -> List[Dict[str, Any]]:
+        async with self._slots:
+            return await self.source.get_transaction_infos(number)
+
+
+class BackfillState:
+    """Finished chunks of one backfill, kept in a JSON file so a rerun resumes
+
+    `request` holds the arguments as given. The block range they resolve to
+    depends on the head at the time, so the first run stores it and a rerun
+    with the same arguments takes it from the file instead of resolving again.
+    """
+
+    def __init__(self, path: str, request: Dict[str, Any]):
+        self.path = path
+        self.request = request
+        self.params = dict(request)
+        self.chunks: Dict[int, dict] = {}
+
+    def load(self) -> bool:
+        """Read the state of an earlier run; False if there is none"""
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path) as f:
+            data = json.load(f)
+        params = data.get("params", {})
+        if {key: params.get(key) for key in self.request} != self.request:
+            raise SystemExit(f"{self.path} belongs to a different backfill; remove it or pass another --state")
+        self.params = params
+        self.chunks = {int(start): chunk for start, chunk in data["chunks"].items()}
+        return True
+
+    def resolve(self, start: int, end: int):
+        self.params.update(start=start, end=end)
+
+    @property
+    def start(self) -> int:
+        return self.params["start"]
+
+    @property
+    def end(self) -> int:
+        return self.params["end"]
+
+    def save(self):
+        """Write to a temporary file first, so an interruption never leaves a truncated state"""
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"params": self.params, "chunks": self.chunks}, f)
+        os.replace(tmp, self.path)
+
+    def transfers(self) -> List[dict]:
+        return [transfer for start in sorted(self.chunks) for transfer in self.chunks[start]["transfers"]]
+
+
+class Progress:
+    """Blocks done, throughput and ETA, printed to stderr while the backfill runs"""
+
+    def __init__(self, total: int, done: int, transfers: int):
+        self.total = total
+        self.resumed = done
+        self.done = done
+        self.transfers = transfers
+        self.failed = 0
+        self.started = time.monotonic()
+
+    def line(self) -> str:
+        elapsed = time.monotonic() - self.started
+        rate = (self.done - self.resumed) / elapsed if elapsed > 0 else 0.0
+        eta = f"{(self.total - self.done) / rate:.0f}s" if rate > 0 else "-"
+        return (f"blocks {self.done}/{self.total} ({self.done / max(self.total, 1):.1%}), "
+                f"{rate:.0f} blocks/s, transfers {self.transfers}, failed chunks {self.failed}, eta {eta}")
+
+    async def report(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            print(self.line(), file=sys.stderr)
+
+
+class Backfill:
+    """Scans chunks concurrently, decodes them in a process pool and records them in the state"""
+
+    def __init__(self, scanner: BlockScanner, state: BackfillState, decoder: Optional[Executor],
+                 concurrency: int, requests: int, retries: int = 3):
+        self.scanner = scanner
+        self.state = state
+        self.decoder = decoder
+        self.concurrency = concurrency
+        self.requests = requests
+        self.retries = retries
+
+    async def run(self, progress: Progress) -> List[int]:
+        """Scan every unfinished chunk; returns the starts of chunks that still failed"""
+        params = self.state.params
+        pending = asyncio.Queue()
+        for start in range(params["start"], params["end"], params["chunk_blocks"]):
+            if start not in self.state.chunks:
+                pending.put_nowait((start, min(start + params["chunk_blocks"], params["end"])))
+        failed = []
+
+        async def worker():
+            while not pending.empty():
+                start, end = pending.get_nowait()
+                chunk = await self.scan_chunk(start, end)
+                if chunk is None:
+                    failed.append(start)
+                    progress.failed += 1
+                    continue
+                self.state.chunks[start] = chunk
+                self.state.save()
+                progress.done += end - start
+                progress.transfers += len(chunk["transfers"])
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        return sorted(failed)
+
+    async def scan_chunk(self, start: int, end: int) -> Optional[dict]:
+        for attempt in range(1, self.retries + 1):
+            try:
+                fetched = await self.scanner.fetch(start, end, self.requests)
+                if len(fetched) < end - start:
+                    raise RuntimeError(f"node returned {len(fetched)} of {end - start} blocks")
+                if self.decoder is None:
+                    return _decode_chunk(fetched)
+                return await asyncio.get_running_loop().run_in_executor(self.decoder, _decode_chunk, fetched)
+            except Exception as e:
+                logger.warning("Backfill chunk failed", start=start, end=end, attempt=attempt, error=str(e))
+                await asyncio.sleep(2 ** attempt)
+        return None
+
+
+async def block_at(source, timestamp_ms: int) -> int:
+    """First block at or after a time, found from the head with a few 3 second block estimates"""
+    head = await source.get_head()
+    number = block_number(head)
+    block_time = head["block_header"]["raw_data"]["timestamp"]
+    for _ in range(8):
+        step = -((block_time - timestamp_ms) // BLOCK_INTERVAL_MS)  # rounds towards later blocks
+        if step == 0:
+            break
+        number = min(number + step, block_number(head))
+        blocks = await source.get_blocks(number, number + 1)
+        if not blocks:
+            break
+        block_time = blocks[0]["block_header"]["raw_data"]["timestamp"]
+    return number
+
+
+def _naive_utc(timestamp_ms: int) -> datetime:
+    """orders and payments store naive UTC datetimes"""
+    return datetime.fromtimestamp(timestamp_ms / 1000, tz=timezone.utc).replace(tzinfo=None)
+
+
+async def reconcile(database_url: str, transfers: List[dict], watched: List[str],
+                    first_ms: int, last_ms: int, grace: int) -> dict:
+    """Sort the transfers into recorded, missed and unmatched, and find unpaid orders in the range"""
+    import asyncpg
+
+    since, until = _naive_utc(first_ms), _naive_utc(last_ms)
+    connection = await asyncpg.connect(database_url.replace("+asyncpg", ""))
+    try:
+        recorded = {
+            row["tx_hash"]: row["order_id"] for row in await connection.fetch(
+                "SELECT tx_hash, order_id FROM payments WHERE tx_hash = ANY($1::text[])",
+                list({transfer["tx_hash"] for transfer in transfers})
+            )
+        }
+        orders = await connection.fetch(
+            "SELECT id, status, total_amount, payment_address, created_at, expires_at FROM orders "
+            "WHERE payment_address = ANY($1::text[]) AND created_at <= $3 AND expires_at >= $2 "
+            "ORDER BY created_at",
+            watched, since - timedelta(seconds=grace), until
+        )
+    finally:
+        await connection.close()
+
+    by_amount = defaultdict(list)
+    for order in orders:
+        by_amount[(order["payment_address"], Decimal(order["total_amount"]).normalize())].append(order)
+
+    missed, unmatched, paid_for = [], [], set()
+    for transfer in transfers:
+        if transfer["tx_hash"] in recorded:
+            continue
+        block_time = _naive_utc(transfer["block_timestamp"])
+        order = next((
+            order for order in by_amount[(transfer["to_address"], Decimal(transfer["amount"]).normalize())]
+            if order["created_at"] <= block_time <= order["expires_at"] + timedelta(seconds=grace)
+        ), None)
+        if order is None:
+            unmatched.append(transfer)
+        else:
+            paid_for.add(order["id"])
+            missed.append({**transfer, "order_id": order["id"], "order_status": order["status"]})
+
+    unpaid = [{
+        "order_id": order["id"],
+        "status": order["status"],
+        "payment_address": order["payment_address"],
+        "amount": str(order["total_amount"]),
+        "created_at": order["created_at"].isoformat(),
+        "expires_at": order["expires_at"].isoformat()
+    } for order in orders
+        # Only orders whose whole payment window was scanned
+        if order["status"] in UNPAID_STATUSES and order["id"] not in paid_for
+        and order["created_at"] >= since and order["expires_at"] + timedelta(seconds=grace) <= until]
+
+    return {
+        "recorded": len(transfers) - len(missed) - len(unmatched),
+        "missed_payments": missed,
+        "unmatched_transfers": unmatched,
+        "unpaid_orders": unpaid
+    }
+
+
+def parse_time(value: str) -> int:
+    """ISO time, UTC unless it says otherwise, as ms"""
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp() * 1000)
+
+
+async def resolve_range(args, source) -> Tuple[int, int]:
+    """Block range start..end-1 from the block or time arguments"""
+    head = block_number(await source.get_head())
+    start = args.from_block if args.from_block is not None else (
+        await block_at(source, parse_time(args.since)) if args.since else None
+    )
+    if start is None and isinstance(source, FixtureBlockSource):
+        start = min(source.blocks)
+    if start is None:
+        raise SystemExit("Give --from-block or --since")
+    if args.to_block is not None:
+        end = args.to_block + 1
+    elif args.until:
+        end = await block_at(source, parse_time(args.until))
+    else:
+        end = head + 1
+    return start, min(end, head + 1)
+
+
+async def backfill(args):
+    watched = args.watch or [
+        address.strip() for address in os.getenv("PAYMENT_ADDRESSES", "").split(",") if address.strip()
+    ] or [os.getenv("PAYMENT_ADDRESS", "TQn9Y2khEsLJW1ChVWFMSMeRDow5KcbLSE")]
+
+    session = None
+    if args.fixtures:
+        source = FixtureBlockSource(args.fixtures)
+    else:
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit_per_host=args.requests))
+        redis_client = None
+        if os.getenv("REDIS_URL"):
+            import redis.asyncio as redis
+            redis_client = redis.from_url(os.getenv("REDIS_URL"))  # shares the TronGrid quota with the monitors
+
+        async def get_session():
+            return session
+        source = NodeBlockSource(ProviderPool(nodes_from_env(), limiter=limiter_from_env(redis_client)),
+                                 get_session, priority=PRIORITY_BACKGROUND)
+
+    decoder = None
+    try:
+        state = BackfillState(args.state, {
+            "from_block": args.from_block,
+            "to_block": args.to_block,
+            "since": args.since,
+            "until": args.until,
+            "chunk_blocks": args.chunk_blocks,
+            "watched": sorted(watched)
+        })
+        if not state.load():
+            state.resolve(*await resolve_range(args, source))
+        start, end = state.start, state.end
+        progress = Progress(
+            end - start,
+            sum(min(chunk_start + args.chunk_blocks, end) - chunk_start for chunk_start in state.chunks),
+            len(state.transfers())
+        )
+        print(f"Backfilling blocks {start}..{end - 1} for {len(watched)} addresses, "
+              f"{len(state.chunks)} chunks already done", file=sys.stderr)
+
+        if args.decode_workers > 0:
+            decoder = ProcessPoolExecutor(args.decode_workers, initializer=_init_decoder, initargs=(TOKENS, watched))
+        else:
+            _init_decoder(TOKENS, watched)
+        scanner = BlockScanner(BoundedSource(source, args.requests), TOKENS, watched)
+        reporter = asyncio.create_task(progress.report(args.progress_interval))
+        try:
+            failed = await Backfill(scanner, state, decoder, args.concurrency, args.requests).run(progress)
+        finally:
+            reporter.cancel()
+        print(progress.line(), file=sys.stderr)
+    finally:
+        if decoder is not None:
+            decoder.shutdown()
+        if session is not None:
+            await session.close()
+
+    transfers = state.transfers()
+    report = {
+        "start_block": start,
+        "end_block": end - 1,
+        "watched": watched,
+        "failed_chunks": failed,
+        "transfers": len(transfers)
+    }
+    if state.chunks:
+        first_ms = min(chunk["first_timestamp"] for chunk in state.chunks.values())
+        last_ms = max(chunk["last_timestamp"] for chunk in state.chunks.values())
+        report["since"] = _naive_utc(first_ms).isoformat()
+        report["until"] = _naive_utc(last_ms).isoformat()
+        if args.database_url:
+            report.update(await reconcile(args.database_url, transfers, watched, first_ms, last_ms, args.grace))
+        else:
+            report["transfer_list"] = transfers
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{len(transfers)} transfers in blocks {start}..{end - 1}", end="")
+    if "missed_payments" in report:
+        print(f": {report['recorded']} recorded, {len(report['missed_payments'])} missed payments, "
+              f"{len(report['unmatched_transfers'])} unmatched; {len(report['unpaid_orders'])} unpaid orders", end="")
+    print(f". Report written to {args.report}")
+    if failed:
+        print(f"{len(failed)} chunks failed; run the same command again to retry them", file=sys.stderr)
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--from-block", type=int)
+    parser.add_argument("--to-block", type=int, help="inclusive; defaults to the head")
+    parser.add_argument("--since", help="ISO time (UTC unless given), instead of --from-block")
+    parser.add_argument("--until", help="ISO time (UTC unless given), instead of --to-block")
+    parser.add_argument("--watch", action="append", default=[],
+                        help="payment address (repeatable); defaults to PAYMENT_ADDRESSES / PAYMENT_ADDRESS")
+    parser.add_argument("--fixtures", help="scan blocks recorded with block_scanner.py instead of the nodes")
+    parser.add_argument("--chunk-blocks", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=4, help="chunks scanned at a time")
+    parser.add_argument("--requests", type=int, default=16, help="node reads in flight across all chunks")
+    # One core is left to the event loop; on a single core decoding stays in the loop
+    parser.add_argument("--decode-workers", type=int, default=max((os.cpu_count() or 1) - 1, 0),
+                        help="decoding processes; 0 decodes in the event loop")
+    parser.add_argument("--state", default="backfill-state.json", help="finished chunks, for resuming")
+    parser.add_argument("--report", default="backfill-report.json")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"),
+                        help="orders database to reconcile against; without it the report lists the transfers")
+    parser.add_argument("--grace", type=int, default=int(os.getenv("PAYMENT_GRACE_SECONDS", "300")),
+                        help="seconds after expiry a payment still counts, as in the backend")
+    parser.add_argument("--progress-interval", type=float, default=5.0, help="seconds between progress lines")
+    try:
+        asyncio.run(backfill(parser.parse_args()))
+    except KeyboardInterrupt:
+        print("Interrupted; run the same command again to resume", file=sys.stderr)
+        sys.exit(130)
+
+
+if __name__ == "__main__":
+    main()
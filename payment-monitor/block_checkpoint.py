@@ -0,0 +1,81 @@
+"""
+Persistent block scanner checkpoint
+
+The last fully processed block (number, hash and timestamp) is stored as
+a single Redis value, so number and hash always change together. It is
+written after each processed range. On startup the scanner resumes from
+it instead of a fixed distance behind the head, and checks the stored
+hash against the chain to catch a reorganisation while it was down.
+With several replicas, `fence(key, value)` writes it only while this
+replica still holds the scanner lease (see coordination.py).
+"""
+
+import json
+import time
+from dataclasses import asdict, dataclass
+from typing import Awaitable, Callable, Optional
+
+import structlog
+from prometheus_client import Gauge
+
+logger = structlog.get_logger()
+
+CHECKPOINT_KEY_PREFIX = "monitor:block-checkpoint"
+
+SCANNER_LAG_BLOCKS = Gauge(
+    "block_scanner_lag_blocks",
+    "Blocks between the chain head and the scanner checkpoint"
+)
+SCANNER_LAG_SECONDS = Gauge(
+    "block_scanner_lag_seconds",
+    "Age of the block at the scanner checkpoint"
+)
+
+
+@dataclass
+class BlockCheckpoint:
+    number: int
+    hash: str
+    timestamp: int = 0  # block time, ms
+
+
+class CheckpointStore:
+    """Load and save one scanner's checkpoint; in memory only without Redis"""
+
+    def __init__(self, name: str, redis_client=None, fence: Optional[Callable[[str, str], Awaitable[bool]]] = None):
+        self.key = f"{CHECKPOINT_KEY_PREFIX}:{name}"
+        self.redis = redis_client
+        self.fence = fence
+        self.checkpoint: Optional[BlockCheckpoint] = None
+
+    async def load(self) -> Optional[BlockCheckpoint]:
+        if self.redis is not None:
+            try:
+                raw = await self.redis.get(self.key)
+                if raw:
+                    self.checkpoint = BlockCheckpoint(**json.loads(raw))
+            except Exception as e:
+                logger.warning("Failed to load block checkpoint", key=self.key, error=str(e))
+        return self.checkpoint
+
+    async def save(self, checkpoint: BlockCheckpoint):
+        self.checkpoint = checkpoint
+        if self.redis is not None:
+            try:
+                value = json.dumps(asdict(checkpoint))
+                if self.fence is None:
+                    await self.redis.set(self.key, value)
+                elif not await self.fence(self.key, value):
+                    logger.warning("Block checkpoint write refused, lease lost", key=self.key)
+            except Exception as e:
+                logger.warning("Failed to persist block checkpoint", key=self.key, error=str(e))
+
+    def report_lag(self, head: int) -> dict:
+        """Update the lag gauges against the chain head"""
+        if self.checkpoint is None:
+            return {}
+        blocks = max(0, head - self.checkpoint.number)
+        seconds = max(0.0, time.time() - self.checkpoint.timestamp / 1000) if self.checkpoint.timestamp else 0.0
+        SCANNER_LAG_BLOCKS.set(blocks)
+        SCANNER_LAG_SECONDS.set(seconds)
+        return {"lag_blocks": blocks, "lag_seconds": round(seconds, 1)}
@@ -0,0 +1,303 @@
+"""
+Block-scanning payment engine
+
+Walks blocks in order instead of polling every watched address's
+history. A range of blocks is read with one getblockbylimitnext call.
+Each block that contains a smart contract call gets one
+gettransactioninfobyblocknum call, and the TRC20 Transfer logs of the
+configured token contracts in it are decoded. Logs are used rather than
+call data, so transfers made from inside other contracts are found too.
+Recipients are compared in hex against a set of watched addresses, so
+the chain reads per block stay the same however many addresses are
+watched, and nothing depends on TronGrid's indexer.
+
+Blocks come from NodeBlockSource for the live chain, or from
+FixtureBlockSource for blocks recorded to a JSON file. Recording and
+offline scanning are available from the command line:
+
+    python block_scanner.py record --start 60000000 --count 20 --out blocks.json
+    python block_scanner.py scan --fixtures blocks.json --watch TQn9Y2khEsLJW1ChVWFMSMeRDow5KcbLSE
+
+backfill.py scans past ranges with the same decoding and reconciles them
+against the orders database.
+"""
+
+import argparse
+import asyncio
+import json
+from dataclasses import asdict, dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Tuple
+
+import aiohttp
+import structlog
+from prometheus_client import Counter
+from tronpy.keys import to_base58check_address, to_hex_address
+
+from provider_pool import ProviderPool, nodes_from_env
+from rate_limiter import PRIORITY_PAYMENT
+
+logger = structlog.get_logger()
+
+# keccak256("Transfer(address,address,uint256)")
+TRANSFER_TOPIC = "ddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+# getblockbylimitnext returns at most this many blocks per call
+MAX_BLOCKS_PER_CALL = 100
+
+USDT_CONTRACT = "TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t"
+
+BLOCKS_SCANNED = Counter(
+    "block_scanner_blocks_total",
+    "Blocks walked by the block scanner"
+)
+TRANSFERS_MATCHED = Counter(
+    "block_scanner_transfers_total",
+    "Token transfers to watched addresses found by the block scanner",
+    ["token"]
+)
+
+
+@dataclass
+class Token:
+    """A TRC20 contract whose transfers are decoded"""
+    contract: str  # base58
+    symbol: str
+    decimals: int
+
+
+@dataclass
+class TokenTransfer:
+    """A decoded TRC20 Transfer event to a watched address"""
+    tx_hash: str
+    block_number: int
+    block_timestamp: int  # ms
+    token: Token
+    from_address: str
+    to_address: str
+    value: int  # raw, in the token's smallest unit
+    log_index: int
+
+
+@dataclass
+class ScannedBlock:
+    number: int
+    hash: str
+    parent_hash: str
+    timestamp: int  # ms
+    transfers: List[TokenTransfer] = field(default_factory=list)
+
+
+class NodeBlockSource:
+    """Blocks and transaction infos from TRON nodes through the provider pool"""
+
+    def __init__(
+        self,
+        pool: ProviderPool,
+        get_session: Callable[[], Awaitable[aiohttp.ClientSession]],
+        priority: int = PRIORITY_PAYMENT
+    ):
+        self.pool = pool
+        self.get_session = get_session
+        self.priority = priority
+
+    async def get_head(self) -> Dict[str, Any]:
+        response = await self.pool.request(
+            await self.get_session(), "POST", "/wallet/getnowblock", priority=self.priority
+        )
+        if response.status != 200:
+            raise RuntimeError(f"getnowblock returned {response.status}")
+        return response.json()
+
+    async def get_blocks(self, start: int, end: int) -> List[Dict[str, Any]]:
+        """Blocks start..end-1 (end - start <= MAX_BLOCKS_PER_CALL)"""
+        response = await self.pool.request(
+            await self.get_session(), "POST", "/wallet/getblockbylimitnext",
+            json_body={"startNum": start, "endNum": end}, priority=self.priority
+        )
+        if response.status != 200:
+            raise RuntimeError(f"getblockbylimitnext returned {response.status}")
+        return response.json().get("block", [])
+
+    async def get_transaction_infos(self, number: int) -> List[Dict[str, Any]]:
+        response = await self.pool.request(
+            await self.get_session(), "POST", "/wallet/gettransactioninfobyblocknum",
+            json_body={"num": number}, priority=self.priority
+        )
+        if response.status != 200:
+            raise RuntimeError(f"gettransactioninfobyblocknum returned {response.status}")
+        infos = response.json()
+        # An empty block comes back as {}
+        return infos if isinstance(infos, list) else []
+
+
+class FixtureBlockSource:
+    """Blocks recorded with `block_scanner.py record`, for scanning offline"""
+
+    def __init__(self, path: str):
+        with open(path) as f:
+            data = json.load(f)
+        self.blocks = {block_number(block): block for block in data["blocks"]}
+        self.infos = {int(number): infos for number, infos in data["transaction_infos"].items()}
+
+    async def get_head(self) -> Dict[str, Any]:
+        return self.blocks[max(self.blocks)]
+
+    async def get_blocks(self, start: int, end: int) -> List[Dict[str, Any]]:
+        return [self.blocks[n] for n in range(start, end) if n in self.blocks]
+
+    async def get_transaction_infos(self, number: int) -> List[Dict[str, Any]]:
+        return self.infos.get(number, [])
+
+
+def block_number(block: Dict[str, Any]) -> int:
+    return block["block_header"]["raw_data"]["number"]
+
+
+class BlockScanner:
+    """Decodes TRC20 transfers to watched addresses block by block"""
+
+    def __init__(self, source, tokens: Iterable[Token], watched: Iterable[str] = ()):
+        self.source = source
+        self.tokens = {to_hex_address(token.contract).lower(): token for token in tokens}
+        self._watched = set()
+        for address in watched:
+            self.watch(address)
+
+    def watch(self, address: str):
+        self._watched.add(to_hex_address(address).lower())
+
+    def unwatch(self, address: str):
+        self._watched.discard(to_hex_address(address).lower())
+
+    def is_watched(self, address: str) -> bool:
+        return to_hex_address(address).lower() in self._watched
+
+    async def scan(self, start: int, end: int, concurrency: int = 1) -> List[ScannedBlock]:
+        """Blocks start..end-1 in order; stops early at the first block the node does not have yet
+
+        Transaction infos within a chunk of blocks are fetched up to
+        `concurrency` at a time, which is what makes catching up fast.
+        """
+        return [self.decode(block, infos) for block, infos in await self.fetch(start, end, concurrency)]
+
+    async def fetch(self, start: int, end: int, concurrency: int = 1) -> List[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+        """Raw blocks start..end-1 with their transaction infos, as scan reads them, left for decode"""
+        slots = asyncio.Semaphore(concurrency)
+
+        async def fetch_one(block):
+            async with slots:
+                return block, await self.transaction_infos(block)
+
+        fetched = []
+        for chunk_start in range(start, end, MAX_BLOCKS_PER_CALL):
+            chunk_end = min(chunk_start + MAX_BLOCKS_PER_CALL, end)
+            blocks = []
+            for expected, block in zip(range(chunk_start, chunk_end), sorted(
+                await self.source.get_blocks(chunk_start, chunk_end), key=block_number
+            )):
+                if block_number(block) != expected:
+                    break
+                blocks.append(block)
+            fetched.extend(await asyncio.gather(*(fetch_one(block) for block in blocks)))
+            if len(blocks) < chunk_end - chunk_start:
+                break
+        return fetched
+
+    async def scan_block(self, block: Dict[str, Any]) -> ScannedBlock:
+        return self.decode(block, await self.transaction_infos(block))
+
+    async def transaction_infos(self, block: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Blocks without contract calls cannot hold token transfers and cost no extra read"""
+        return await self.source.get_transaction_infos(block_number(block)) if self._has_contract_calls(block) else []
+
+    def decode(self, block: Dict[str, Any], infos: List[Dict[str, Any]]) -> ScannedBlock:
+        raw = block["block_header"]["raw_data"]
+        scanned = ScannedBlock(
+            number=raw["number"],
+            hash=block.get("blockID", ""),
+            parent_hash=raw.get("parentHash", ""),
+            timestamp=raw.get("timestamp", 0)
+        )
+        BLOCKS_SCANNED.inc()
+
+        for info in infos:
+            if info.get("result") == "FAILED" or info.get("receipt", {}).get("result", "SUCCESS") != "SUCCESS":
+                continue
+            for index, log in enumerate(info.get("log", [])):
+                token = self.tokens.get("41" + log.get("address", "").lower())
+                topics = log.get("topics", [])
+                if token is None or len(topics) != 3 or topics[0].lower() != TRANSFER_TOPIC:
+                    continue
+                to_hex = "41" + topics[2][-40:].lower()
+                if to_hex not in self._watched:
+                    continue
+                scanned.transfers.append(TokenTransfer(
+                    tx_hash=info["id"],
+                    block_number=scanned.number,
+                    block_timestamp=info.get("blockTimeStamp", scanned.timestamp),
+                    token=token,
+                    from_address=to_base58check_address("41" + topics[1][-40:]),
+                    to_address=to_base58check_address(to_hex),
+                    value=int(log.get("data") or "0", 16),
+                    log_index=index
+                ))
+                TRANSFERS_MATCHED.labels(token=token.symbol).inc()
+        return scanned
+
+    def _has_contract_calls(self, block: Dict[str, Any]) -> bool:
+        return any(
+            contract.get("type") == "TriggerSmartContract"
+            for tx in block.get("transactions", [])
+            for contract in tx.get("raw_data", {}).get("contract", [])
+        )
+
+
+async def record(args):
+    """Save blocks and their transaction infos from the configured nodes to a fixture file"""
+    pool = ProviderPool(nodes_from_env())
+    async with aiohttp.ClientSession() as session:
+        async def get_session():
+            return session
+        source = NodeBlockSource(pool, get_session)
+        blocks = []
+        for start in range(args.start, args.start + args.count, MAX_BLOCKS_PER_CALL):
+            blocks.extend(await source.get_blocks(start, min(start + MAX_BLOCKS_PER_CALL, args.start + args.count)))
+        infos = {}
+        for block in blocks:
+            infos[str(block_number(block))] = await source.get_transaction_infos(block_number(block))
+    with open(args.out, "w") as f:
+        json.dump({"blocks": blocks, "transaction_infos": infos}, f)
+    print(f"Recorded {len(blocks)} blocks to {args.out}")
+
+
+async def scan(args):
+    """Scan a fixture file and print the transfers to the watched addresses"""
+    source = FixtureBlockSource(args.fixtures)
+    scanner = BlockScanner(source, [Token(USDT_CONTRACT, "USDT", 6)], args.watch)
+    start = args.start or min(source.blocks)
+    end = args.end or max(source.blocks) + 1
+    for block in await scanner.scan(start, end):
+        for transfer in block.transfers:
+            print(json.dumps({**asdict(transfer), "token": transfer.token.symbol}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = commands.add_parser("record", help="record blocks from TRON_NODE_URLS to a fixture file")
+    record_parser.add_argument("--start", type=int, required=True)
+    record_parser.add_argument("--count", type=int, default=20)
+    record_parser.add_argument("--out", required=True)
+
+    scan_parser = commands.add_parser("scan", help="scan a fixture file for USDT transfers")
+    scan_parser.add_argument("--fixtures", required=True)
+    scan_parser.add_argument("--watch", action="append", default=[], help="address to watch (repeatable)")
+    scan_parser.add_argument("--start", type=int)
+    scan_parser.add_argument("--end", type=int, help="exclusive")
+
+    args = parser.parse_args()
+    asyncio.run(record(args) if args.command == "record" else scan(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Chain head tracking and pending confirmations
+
+The latest block number is fetched once per tick by ChainHeadTracker and
+read by everyone else from memory. Transactions waiting for confirmations
+sit in PendingConfirmations ordered by the head height at which they
+become confirmed, so each new head releases exactly the transactions that
+just reached their threshold: confirmations are exact and computing them
+is O(1), with no per-transaction node requests.
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+import structlog
+
+logger = structlog.get_logger()
+
+
+class ChainHeadTracker:
+    """Latest block number, refreshed at most once per max_age seconds"""
+
+    def __init__(self, fetch_head: Callable[[], Awaitable[int]], max_age: float = 3.0):
+        self.fetch_head = fetch_head
+        self.max_age = max_age
+        self.head: Optional[int] = None
+        self.updated_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def refresh(self) -> int:
+        """Fetch the head now"""
+        async with self._lock:
+            return await self._fetch()
+
+    async def get(self) -> int:
+        """Cached head, refreshed once it is older than max_age; concurrent callers share one fetch"""
+        if self._fresh():
+            return self.head
+        async with self._lock:
+            # Another caller may have refreshed it while we waited for the lock
+            if self._fresh():
+                return self.head
+            return await self._fetch()
+
+    def _fresh(self) -> bool:
+        return self.head is not None and time.monotonic() - self.updated_at < self.max_age
+
+    async def _fetch(self) -> int:
+        number = await self.fetch_head()
+        # A node that lags behind never moves the head backwards
+        if self.head is None or number > self.head:
+            self.head = number
+        self.updated_at = time.monotonic()
+        return self.head
+
+    def confirmations(self, block_number: int) -> int:
+        """Confirmations of a transaction in block_number against the cached head"""
+        if self.head is None or not block_number:
+            return 0
+        return max(0, self.head - block_number + 1)
+
+
+class PendingConfirmations:
+    """Transactions waiting for `required` confirmations, released as the head advances"""
+
+    def __init__(self, required: int):
+        self.required = max(required, 1)
+        self._heap: List[Tuple[int, int, str]] = []
+        self._items: Dict[str, Tuple[int, Any]] = {}
+        self._sequence = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, tx_hash: str) -> bool:
+        return tx_hash in self._items
+
+    def __iter__(self) -> Iterator[str]:
+        """Tx hashes still waiting"""
+        return iter(self._items)
+
+    def add(self, tx_hash: str, block_number: int, item: Any) -> bool:
+        """Track a transaction mined in block_number; False if it is already tracked"""
+        if tx_hash in self._items:
+            return False
+        self._items[tx_hash] = (block_number, item)
+        confirmed_at = block_number + self.required - 1
+        heapq.heappush(self._heap, (confirmed_at, next(self._sequence), tx_hash))
+        return True
+
+    def confirmations(self, tx_hash: str, head: int) -> int:
+        entry = self._items.get(tx_hash)
+        if entry is None:
+            return 0
+        return max(0, head - entry[0] + 1)
+
+    def discard(self, tx_hash: str):
+        """Stop tracking a transaction; its heap entry is skipped when it comes up"""
+        self._items.pop(tx_hash, None)
+
+    def items(self) -> List[Tuple[str, Any]]:
+        """(tx_hash, item) of every transaction still waiting"""
+        return [(tx_hash, item) for tx_hash, (_, item) in self._items.items()]
+
+    def ready(self, head: int) -> List[Tuple[Any, int]]:
+        """Pop every transaction confirmed at this head, with its confirmation count"""
+        released = []
+        while self._heap and self._heap[0][0] <= head:
+            _, _, tx_hash = heapq.heappop(self._heap)
+            entry = self._items.pop(tx_hash, None)
+            if entry is None:
+                continue  # discarded
+            block_number, item = entry
+            released.append((item, head - block_number + 1))
+        return released
@@ -0,0 +1,283 @@
+"""
+Coordination between payment monitor replicas
+
+Several monitor replicas can share one Redis. Each decides from Redis
+leases which watched addresses it handles, so no address is polled or
+notified twice. MONITOR_COORDINATION selects how work is split:
+
+- leader: one lease covers every address. The replica holding it does all
+  the work; the others stay on hot standby and take over once it is gone.
+- shard: each address has its own lease. Addresses are split among the
+  live replicas by rendezvous hashing, so adding or losing a replica moves
+  only its share. This scales history polling with the number of
+  addresses. Block scanning reads every block whatever it watches, so in
+  blocks mode shard behaves like leader.
+- none: every replica handles every address (a single replica, no Redis).
+
+A lease is a Redis key with a TTL, renewed every ttl/4 by a background
+loop. Each acquisition takes a new, strictly increasing fencing token.
+State written while holding a lease (scanner checkpoints, history
+cursors) goes through Lease.fenced_set. It only writes if the lease
+still holds this replica's token, so a replica that stalled past its TTL
+cannot overwrite what its successor wrote. A stopped replica releases its
+leases, and a standby takes over on its next renewal pass. After a crash
+the leases lapse and a standby takes over within ttl plus ttl/4: 2.5s
+with the default 2s TTL, inside one 3s active poll interval.
+
+Work in progress moves through Redis too. The history cursors are only
+committed past transfers that were notified, so the new owner fetches
+the transfers still waiting for confirmations again. A replica drops
+the in-memory state of addresses it lost (take_lost), so it does not
+notify them after its successor has.
+"""
+
+import asyncio
+import hashlib
+import os
+import socket
+import time
+from typing import Callable, Dict, Iterable, Optional, Set
+
+import structlog
+from prometheus_client import Counter, Gauge
+
+logger = structlog.get_logger()
+
+LEASE_KEY_PREFIX = "monitor:lease"
+REPLICAS_KEY = "monitor:replicas"
+
+OWNED_ADDRESSES = Gauge(
+    "monitor_owned_addresses",
+    "Watched addresses this monitor replica currently handles"
+)
+LEASE_CHANGES = Counter(
+    "monitor_lease_changes_total",
+    "Leases this replica acquired or lost",
+    ["change"]  # acquired, lost
+)
+
+# Take the lease if it is free, or extend it if this owner holds it; returns the lease value or nil
+ACQUIRE_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if not current then
+    local token = redis.call('INCR', KEYS[2])
+    current = ARGV[1] .. ':' .. token
+    redis.call('SET', KEYS[1], current, 'PX', ARGV[2])
+    return current
+end
+if string.sub(current, 1, string.len(ARGV[1]) + 1) == ARGV[1] .. ':' then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return current
+end
+return false
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Write KEYS[2] only while KEYS[1] still holds this holder's lease value (owner and fencing token)
+FENCED_SET_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[2], ARGV[2])
+return 1
+"""
+
+
+class Lease:
+    """A named lease in Redis, held by at most one replica at a time"""
+
+    def __init__(self, redis_client, name: str, owner: str, ttl: float):
+        self.redis = redis_client
+        self.name = name
+        self.owner = owner
+        self.ttl = ttl
+        self.key = f"{LEASE_KEY_PREFIX}:{name}"
+        self.token: Optional[int] = None
+        self._value: Optional[str] = None
+        self._valid_until = 0.0
+        self._acquire = redis_client.register_script(ACQUIRE_SCRIPT)
+        self._release = redis_client.register_script(RELEASE_SCRIPT)
+        self._fenced_set = redis_client.register_script(FENCED_SET_SCRIPT)
+
+    @property
+    def held(self) -> bool:
+        """Held according to the last renewal, with a margin for clock drift"""
+        return self._value is not None and time.monotonic() < self._valid_until
+
+    async def acquire(self) -> bool:
+        """Take or renew the lease; False if another replica holds it"""
+        started = time.monotonic()
+        value = await self._acquire(keys=[self.key, f"{self.key}:fence"], args=[self.owner, int(self.ttl * 1000)])
+        if not value:
+            self._value = self.token = None
+            return False
+        self._value = value.decode() if isinstance(value, bytes) else value
+        self.token = int(self._value.rsplit(":", 1)[1])
+        self._valid_until = started + self.ttl * 0.8
+        return True
+
+    async def release(self):
+        if self._value is not None:
+            try:
+                await self._release(keys=[self.key], args=[self._value])
+            except Exception as e:
+                logger.warning("Failed to release lease", lease=self.name, error=str(e))
+        self._value = self.token = None
+
+    async def fenced_set(self, key: str, value: str) -> bool:
+        """SET key only while this lease (and fencing token) is still current"""
+        if self._value is None:
+            return False
+        return bool(await self._fenced_set(keys=[self.key, key], args=[self._value, value]))
+
+
+def shard_owner(address: str, replicas: Iterable[str]) -> Optional[str]:
+    """Rendezvous hashing: the replica with the highest hash for this address"""
+    return max(replicas, key=lambda replica: hashlib.sha1(f"{replica}:{address}".encode()).digest(), default=None)
+
+
+class MonitorCoordinator:
+    """Tracks which watched addresses this replica handles and keeps its leases alive"""
+
+    def __init__(
+        self,
+        redis_client,
+        mode: str,
+        addresses: Iterable[str],
+        ttl: float = 2.0,
+        replica_id: Optional[str] = None,
+        on_change: Optional[Callable[[], None]] = None
+    ):
+        if redis_client is None:
+            mode = "none"
+        if mode not in ("none", "leader", "shard"):
+            raise ValueError(f"Unknown MONITOR_COORDINATION mode {mode}")
+        self.redis = redis_client
+        self.mode = mode
+        self.addresses = list(addresses)
+        self.ttl = ttl
+        self.replica_id = replica_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.on_change = on_change
+        self.owned: Set[str] = set(self.addresses) if mode == "none" else set()
+        # Addresses gained since the monitor last asked; their persisted state must be reloaded
+        self.gained: Set[str] = set(self.owned)
+        # Addresses lost since the monitor last asked; their in-memory state belongs to the new owner
+        self.lost: Set[str] = set()
+        self._leases: Dict[str, Lease] = {}
+        self._task: Optional[asyncio.Task] = None
+        OWNED_ADDRESSES.set(len(self.owned))
+
+    def lease_for(self, address: str) -> Optional[Lease]:
+        """The lease guarding an address's state, None without coordination"""
+        if self.mode == "leader":
+            return self._leases.get("leader")
+        return self._leases.get(address)
+
+    def owns(self, address: str) -> bool:
+        if address not in self.owned:
+            return False
+        lease = self.lease_for(address)
+        return lease is None or lease.held
+
+    def take_gained(self) -> Set[str]:
+        gained, self.gained = self.gained, set()
+        return gained
+
+    def take_lost(self) -> Set[str]:
+        lost, self.lost = self.lost, set()
+        return lost
+
+    async def fenced_set(self, address: Optional[str], key: str, value: str) -> bool:
+        """Persist state belonging to an address; refused unless this replica still holds its lease"""
+        if self.mode == "none":
+            await self.redis.set(key, value)
+            return True
+        lease = self.lease_for(address)
+        return lease is not None and await lease.fenced_set(key, value)
+
+    async def start(self):
+        if self.mode == "none":
+            return
+        await self.refresh()
+        self._task = asyncio.create_task(self._renew_loop())
+        logger.info("Monitor coordination started", mode=self.mode, replica=self.replica_id,
+                    owned=len(self.owned), addresses=len(self.addresses))
+
+    async def stop(self):
+        """Stop renewing and hand the leases over at once"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for lease in self._leases.values():
+            await lease.release()
+        if self.redis is not None and self.mode == "shard":
+            try:
+                await self.redis.zrem(REPLICAS_KEY, self.replica_id)
+            except Exception as e:
+                logger.warning("Failed to leave the replica set", error=str(e))
+        self._leases = {}
+        self.lost |= self.owned
+        self.owned = set()
+
+    async def refresh(self):
+        """Renew or acquire the leases this replica should hold and drop the rest"""
+        if self.mode == "leader":
+            wanted = {"leader"}
+        else:
+            replicas = await self._live_replicas()
+            wanted = {address for address in self.addresses if shard_owner(address, replicas) == self.replica_id}
+
+        for name in list(self._leases):
+            if name not in wanted:
+                await self._leases.pop(name).release()
+        for name in wanted:
+            lease = self._leases.get(name)
+            if lease is None:
+                lease = self._leases[name] = Lease(self.redis, name, self.replica_id, self.ttl)
+            was_held = lease.held
+            try:
+                await lease.acquire()
+            except Exception as e:
+                logger.warning("Failed to renew lease", lease=name, error=str(e))
+            if lease.held and not was_held:
+                LEASE_CHANGES.labels(change="acquired").inc()
+                logger.info("Lease acquired", lease=name, token=lease.token)
+            elif was_held and not lease.held:
+                LEASE_CHANGES.labels(change="lost").inc()
+                logger.warning("Lease lost", lease=name)
+
+        held = {name for name, lease in self._leases.items() if lease.held}
+        owned = set(self.addresses) if "leader" in held else held & set(self.addresses)
+        gained = owned - self.owned
+        self.gained |= gained
+        self.lost |= self.owned - owned
+        self.owned = owned
+        OWNED_ADDRESSES.set(len(owned))
+        if gained and self.on_change:
+            self.on_change()
+
+    async def _live_replicas(self) -> Set[str]:
+        now = time.time()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zadd(REPLICAS_KEY, {self.replica_id: now + self.ttl})
+            pipe.zremrangebyscore(REPLICAS_KEY, "-inf", now)
+            pipe.zrange(REPLICAS_KEY, 0, -1)
+            _, _, members = await pipe.execute()
+        return {member.decode() for member in members}
+
+    async def _renew_loop(self):
+        while True:
+            await asyncio.sleep(self.ttl / 4)
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Monitor coordination error", error=str(e))
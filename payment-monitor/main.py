@@ -8,14 +8,22 @@ import logging
 import os
 import sys
 from datetime import datetime, timedelta
-from typing import Set, Dict, Any
+from typing import Dict, Any, List, Optional
 import json
+import redis.asyncio as redis
 
-# Add parent directory to path for imports
+# Add parent directory to path for imports; the backend modules import each other by plain name
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
 
 from backend.tron_client import TronClient, PaymentMonitor
-from backend.vault_client import VaultClient
+# The module tron_client uses: importing it a second time as backend.vault_client registers its metrics twice
+from vault_client import VaultClient
+from tx_dedup import SeenTransactions
+from pipeline import Pipeline
+from notification_outbox import NotificationOutbox
+from poll_scheduler import PollScheduler
+from coordination import MonitorCoordinator
 
 # Configure logging
 logging.basicConfig(
@@ -28,20 +36,48 @@ logger = logging.getLogger(__name__)
 API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8000")
 VAULT_ADDR = os.getenv("VAULT_ADDR", "http://localhost:8200")
 VAULT_TOKEN = os.getenv("VAULT_TOKEN", "dev-root-token")
-TRON_NODE_URL = os.getenv("TRON_NODE_URL", "https://api.trongrid.io")
+# TRON_NODE_URL, or TRON_NODE_URLS / TRON_FULL_NODE_URLS for a pool of nodes, is read by TronClient
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
-MONITOR_INTERVAL = int(os.getenv("MONITOR_INTERVAL", "30"))  # seconds
+MONITOR_INTERVAL = int(os.getenv("MONITOR_INTERVAL", "30"))  # seconds, without Redis order events
+POLL_ACTIVE_INTERVAL = float(os.getenv("POLL_ACTIVE_INTERVAL", "3"))  # while orders await payment
+POLL_BURST_INTERVAL = float(os.getenv("POLL_BURST_INTERVAL", "1"))  # right after an order is created
+POLL_BURST_SECONDS = float(os.getenv("POLL_BURST_SECONDS", "60"))
+POLL_IDLE_MAX = float(os.getenv("POLL_IDLE_MAX", "300"))  # idle polls back off up to this
+NOTIFY_BATCH_SIZE = int(os.getenv("NOTIFY_BATCH_SIZE", "1"))  # > 1 sends waiting notifications in batches
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))  # concurrent deliveries to the backend
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "300"))  # seconds between retries, at most
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "20"))  # then the entry is dead-lettered
+DEDUP_WINDOW_SECONDS = float(os.getenv("DEDUP_WINDOW_SECONDS", "172800"))  # handled transactions are remembered this long
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "100"))  # per stage
+PIPELINE_FILTER_WORKERS = int(os.getenv("PIPELINE_FILTER_WORKERS", "2"))
+PIPELINE_CONFIRM_WORKERS = int(os.getenv("PIPELINE_CONFIRM_WORKERS", "8"))  # concurrent block lookups
+PIPELINE_NOTIFY_WORKERS = int(os.getenv("PIPELINE_NOTIFY_WORKERS", "4"))  # concurrent backend notifications
+MONITOR_COORDINATION = os.getenv("MONITOR_COORDINATION", "leader")  # one active replica; "none" lets every replica poll
+MONITOR_LEASE_TTL = float(os.getenv("MONITOR_LEASE_TTL", "2"))  # seconds until a crashed replica's work moves
 
 class PaymentMonitorService:
     """Main payment monitoring service"""
     
     def __init__(self):
         self.vault_client = None
+        self.redis_client = None
         self.tron_client = None
         self.payment_monitor = None
-        self.processed_transactions: Set[str] = set()
+        self.outbox = None
+        self.scheduler = None
+        self.coordinator = None
+        self.processed_transactions = None
+        self.unconfirmed = set()  # transfers of the current poll held back for confirmations
         self.is_running = False
         
+        # Fetched transactions are filtered, checked for confirmations and notified by concurrent stages
+        self.pipeline = (
+            Pipeline()
+            .add_stage("filter", self.filter_transaction, PIPELINE_FILTER_WORKERS, PIPELINE_QUEUE_SIZE)
+            .add_stage("confirm", self.confirm_transaction, PIPELINE_CONFIRM_WORKERS, PIPELINE_QUEUE_SIZE)
+            .add_stage("notify", self.notify_transaction, PIPELINE_NOTIFY_WORKERS, PIPELINE_QUEUE_SIZE)
+        )
+        
     async def initialize(self):
         """Initialize all clients and services"""
         try:
@@ -51,13 +87,52 @@ class PaymentMonitorService:
             self.vault_client = VaultClient(VAULT_ADDR, VAULT_TOKEN)
             await self.vault_client.initialize_secrets()
             
+            # Redis keeps the incremental history cursors across restarts and replicas
+            self.redis_client = redis.from_url(REDIS_URL)
+            
+            # Handled transactions, shared with other monitor replicas
+            self.processed_transactions = SeenTransactions(self.redis_client, window=DEDUP_WINDOW_SECONDS)
+            
             # Initialize TRON client
-            self.tron_client = TronClient(self.vault_client, TRON_NODE_URL)
+            self.tron_client = TronClient(self.vault_client, redis_client=self.redis_client)
             await self.tron_client.initialize()
             
             # Initialize payment monitor
             self.payment_monitor = PaymentMonitor(self.tron_client, API_BASE_URL)
             
+            # Payments are stored before the backend is notified and retried until it accepts them
+            self.outbox = NotificationOutbox(
+                self.redis_client,
+                self.payment_monitor.send_notifications,
+                concurrency=OUTBOX_WORKERS,
+                batch_size=NOTIFY_BATCH_SIZE,
+                backoff_max=OUTBOX_BACKOFF_MAX,
+                max_attempts=OUTBOX_MAX_ATTEMPTS
+            )
+            
+            # Poll every block while orders await payment, back off while none do
+            self.scheduler = PollScheduler(
+                self.redis_client,
+                [self.tron_client.payment_address],
+                active_interval=POLL_ACTIVE_INTERVAL,
+                burst_interval=POLL_BURST_INTERVAL,
+                burst_seconds=POLL_BURST_SECONDS,
+                idle_max=POLL_IDLE_MAX,
+                fallback_interval=MONITOR_INTERVAL
+            )
+            
+            # Only the replica holding the address lease polls it; the others stand by
+            self.coordinator = MonitorCoordinator(
+                self.redis_client,
+                MONITOR_COORDINATION,
+                [self.tron_client.payment_address],
+                ttl=MONITOR_LEASE_TTL,
+                replica_id=os.getenv("REPLICA_ID"),
+                on_change=self.scheduler.wake
+            )
+            # History cursors are written only while this replica holds the address's lease
+            self.tron_client.history_fence = self.coordinator.fenced_set
+            
             logger.info("Payment Monitor Service initialized successfully")
             
         except Exception as e:
@@ -68,6 +143,9 @@ class PaymentMonitorService:
         """Start the payment monitoring loop"""
         self.is_running = True
         logger.info("Starting payment monitoring...")
+        await self.outbox.start()
+        self.scheduler.start()
+        await self.coordinator.start()
         
         # Start background tasks
         tasks = [
@@ -89,7 +167,7 @@ class PaymentMonitorService:
         while self.is_running:
             try:
                 await self.check_for_payments()
-                await asyncio.sleep(MONITOR_INTERVAL)
+                await self.scheduler.wait()
                 
             except Exception as e:
                 logger.error(f"Error in payment monitoring: {e}")
@@ -102,65 +180,75 @@ class PaymentMonitorService:
                 logger.warning("Payment address not configured")
                 return
             
-            # Get recent transactions
-            transactions = await self.tron_client.get_recent_transactions(
-                self.tron_client.payment_address,
-                limit=50,
-                only_to=True
-            )
+            address = self.tron_client.payment_address
+            if not self.coordinator.owns(address):
+                logger.debug("Standing by, another replica monitors the payment address")
+                return
+            if self.coordinator.take_gained():
+                # The previous owner may have moved the cursors since this replica last read them
+                await self.tron_client.load_history(address)
+            
+            # Transfers after the history cursors; block lookups are left to the confirm stage
+            self.unconfirmed.clear()
+            with self.pipeline.timed("fetch"):
+                transactions = await self.tron_client.get_new_transactions(address, resolve_blocks=False)
             
             # Process new transactions
-            new_transactions = 0
+            notified_before = self.pipeline.stats()["notify"]["passed"]
+            unseen = set(await self.processed_transactions.filter_new(tx["tx_hash"] for tx in transactions))
             for tx in transactions:
-                if tx["tx_hash"] not in self.processed_transactions:
-                    await self.process_transaction(tx)
-                    self.processed_transactions.add(tx["tx_hash"])
-                    new_transactions += 1
+                if tx["tx_hash"] in unseen:
+                    await self.pipeline.put(tx)
+            failed = {tx["tx_hash"] for _, tx in await self.pipeline.join()}
             
+            # The cursors stop in front of transfers that were not notified; they are fetched again
+            await self.tron_client.commit_new_transactions(address, failed | self.unconfirmed)
+            
+            new_transactions = self.pipeline.stats()["notify"]["passed"] - notified_before
             if new_transactions > 0:
                 logger.info(f"Processed {new_transactions} new transactions")
             
         except Exception as e:
             logger.error(f"Error checking for payments: {e}")
     
-    async def process_transaction(self, transaction: Dict[str, Any]):
-        """Process a single transaction"""
-        try:
-            # Only process USDT transactions with sufficient confirmations
-            if transaction["token"] != "USDT-TRC20":
-                logger.debug(f"Skipping non-USDT transaction: {transaction['tx_hash']}")
-                return
-            
-            if transaction["confirmations"] < 1:
-                logger.debug(f"Skipping unconfirmed transaction: {transaction['tx_hash']}")
-                return
-            
-            # Send to payment monitor for backend notification
-            await self.payment_monitor.process_transaction(transaction)
-            
-            logger.info(
-                f"Processed payment: {transaction['tx_hash']} - "
-                f"{transaction['amount']} {transaction['token']} - "
-                f"{transaction['confirmations']} confirmations"
-            )
-            
-        except Exception as e:
-            logger.error(f"Error processing transaction {transaction.get('tx_hash', 'unknown')}: {e}")
+    async def filter_transaction(self, transaction: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+        """Pipeline stage: only USDT transactions are processed, others are marked handled"""
+        if transaction["token"] != "USDT-TRC20":
+            logger.debug(f"Skipping non-USDT transaction: {transaction['tx_hash']}")
+            await self.processed_transactions.add(transaction["tx_hash"])
+            return None
+        return [transaction]
+    
+    async def confirm_transaction(self, transaction: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+        """Pipeline stage: hold back unconfirmed transactions; they are looked at again on a later poll"""
+        if await self.tron_client.resolve_confirmations(transaction) < 1:
+            logger.debug(f"Skipping unconfirmed transaction: {transaction['tx_hash']}")
+            self.unconfirmed.add(transaction["tx_hash"])
+            return None
+        return [transaction]
+    
+    async def notify_transaction(self, transaction: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Pipeline stage: store in the outbox for backend notification"""
+        await self.outbox.append(PaymentMonitor.notification_payload(transaction))
+        await self.processed_transactions.add(transaction["tx_hash"])
+        
+        logger.info(
+            f"Processed payment: {transaction['tx_hash']} - "
+            f"{transaction['amount']} {transaction['token']} - "
+            f"{transaction['confirmations']} confirmations"
+        )
+        return [transaction]
     
     async def cleanup_old_transactions(self):
-        """Clean up old processed transactions to prevent memory growth"""
+        """Drop handled transactions that fell out of the dedup window"""
         while self.is_running:
             try:
                 # Clean up every hour
                 await asyncio.sleep(3600)
                 
-                # Keep only recent transactions (last 24 hours worth)
-                # This is a simple implementation - in production you'd use a more sophisticated approach
-                if len(self.processed_transactions) > 10000:
-                    # Remove oldest half of transactions
-                    transactions_list = list(self.processed_transactions)
-                    self.processed_transactions = set(transactions_list[5000:])
-                    logger.info("Cleaned up old processed transactions")
+                # Oldest entries go first; everything inside the window is kept
+                await self.processed_transactions.trim()
+                logger.info("Cleaned up old processed transactions")
                     
             except Exception as e:
                 logger.error(f"Error in transaction cleanup: {e}")
@@ -179,6 +267,10 @@ class PaymentMonitorService:
                 else:
                     logger.debug(f"TRON network healthy - Block: {network_status['block_height']}")
                 
+                median = self.outbox.median_transfer_to_paid()
+                if median is not None:
+                    logger.info(f"Median transfer-to-paid time: {median:.1f}s")
+                
                 # Check Vault health
                 vault_health = await self.vault_client.get_health()
                 if vault_health["status"] != "healthy":
@@ -192,6 +284,22 @@ class PaymentMonitorService:
         logger.info("Shutting down Payment Monitor Service...")
         
         self.is_running = False
+        await self.pipeline.close()
+        
+        if self.coordinator:
+            await self.coordinator.stop()
+        
+        if self.scheduler:
+            await self.scheduler.stop()
+        
+        if self.outbox:
+            await self.outbox.stop()
+        
+        if self.tron_client:
+            await self.tron_client.close()
+        
+        if self.redis_client:
+            await self.redis_client.close()
         
         if self.vault_client:
             await self.vault_client.close()
@@ -0,0 +1,420 @@
+"""
+Durable payment notification outbox
+
+A detected payment is appended to a Redis Stream before the backend hears
+about it. Delivery workers in a consumer group post it. An entry is
+acknowledged only once the backend has answered 200. A failed post goes
+to a delayed set and comes back after an exponential backoff with jitter.
+Entries a crashed monitor left unacknowledged are claimed by the next one.
+Retries are capped at backoff_max apart. The backend skips transfers it
+has already recorded, so delivering an entry twice is harmless.
+
+An entry the backend rejects with a 4xx is not retried: its payload will
+not get any better. A rejected batch is split in halves and sent again,
+so one bad payload cannot hold back the entries it was batched with.
+Entries that were rejected, or still not accepted after max_attempts,
+move to a dead-letter stream. Nothing is dropped: a dead entry can be put
+back on the outbox once the cause is fixed.
+
+Detection only appends, so a slow or unavailable backend no longer holds
+back the monitor. The outbox depth and the age of its oldest entry show
+how far behind the backend is.
+
+Without Redis the outbox is kept in memory. Retries still happen, but
+entries do not survive a restart.
+
+The backend marks a matching order paid while it handles the
+notification. So for the notifications that paid an order, the time from
+the transfer's block to the backend accepting the notification is the
+customer's transfer-to-paid time. Transfers that matched no order, were
+already recorded or still await confirmations are not counted. The median
+over recent payments is the monitors' headline latency figure.
+"""
+
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Collection, Dict, List, Optional, Tuple
+
+import aiohttp
+import structlog
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = structlog.get_logger()
+
+STREAM_KEY = "monitor:outbox"
+GROUP_NAME = "monitor-outbox"
+RETRY_KEY = "monitor:outbox:retry"
+# tx_hash -> append time of every entry not yet delivered, for depth and age
+INDEX_KEY = "monitor:outbox:index"
+DEAD_LETTER_KEY = "monitor:outbox:dead"
+
+# 4xx answers that say nothing about the payload: a wrong token or URL, a timeout, throttling
+TRANSIENT_CLIENT_ERRORS = {401, 403, 404, 408, 429}
+
+OUTBOX_DEPTH = Gauge(
+    "notification_outbox_depth",
+    "Payment notifications not yet accepted by the backend"
+)
+OUTBOX_OLDEST_AGE = Gauge(
+    "notification_outbox_oldest_age_seconds",
+    "Age of the oldest payment notification not yet accepted by the backend"
+)
+OUTBOX_DELIVERIES = Counter(
+    "notification_outbox_deliveries_total",
+    "Payment notification delivery attempts",
+    ["result"]  # success, retry, rejected, dead
+)
+OUTBOX_DEAD_LETTERS = Gauge(
+    "notification_outbox_dead_letters",
+    "Payment notifications moved to the dead-letter stream"
+)
+OUTBOX_DELIVERY_DELAY = Histogram(
+    "notification_outbox_delivery_delay_seconds",
+    "Time from appending a payment notification to the backend accepting it",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 15, 60, 300, 900, 3600)
+)
+PAYMENT_TRANSFER_TO_PAID = Histogram(
+    "payment_transfer_to_paid_seconds",
+    "Time from a payment's block to the backend marking its order paid",
+    buckets=(1, 2, 3, 5, 7.5, 10, 15, 20, 30, 45, 60, 120, 300, 900)
+)
+PAYMENT_TRANSFER_TO_PAID_MEDIAN = Gauge(
+    "payment_transfer_to_paid_median_seconds",
+    "Median transfer-to-paid time over the most recent payments"
+)
+
+# Move due retries back onto the stream in one step, so a crash cannot lose them in between
+PROMOTE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, entry in ipairs(due) do
+    redis.call('ZREM', KEYS[1], entry)
+    redis.call('XADD', KEYS[2], '*', 'entry', entry)
+end
+return #due
+"""
+
+Sender = Callable[[List[Dict[str, Any]]], Awaitable[Optional[Collection[str]]]]
+
+
+def is_rejection(error: Optional[BaseException]) -> bool:
+    """True if the backend refused the payloads themselves, so sending them again cannot help"""
+    return (
+        isinstance(error, aiohttp.ClientResponseError)
+        and 400 <= error.status < 500
+        and error.status not in TRANSIENT_CLIENT_ERRORS
+    )
+
+
+class NotificationOutbox:
+    """Append-then-deliver queue of payment notifications, kept in Redis Streams when available
+
+    `send` posts one or more notifications. Once the backend has accepted
+    them it returns the tx hashes whose orders the backend marked paid.
+    It returns None or raises when they were not accepted; an
+    aiohttp.ClientResponseError with a 4xx status marks them rejected.
+    Up to batch_size waiting entries are sent together.
+    """
+
+    def __init__(
+        self,
+        redis_client,
+        send: Sender,
+        concurrency: int = 4,
+        batch_size: int = 1,
+        backoff_base: float = 1.0,
+        backoff_max: float = 300.0,
+        claim_idle_seconds: float = 60.0,
+        max_attempts: int = 20
+    ):
+        self.redis = redis_client
+        self.send = send
+        self.concurrency = concurrency
+        self.batch_size = max(batch_size, 1)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.claim_idle_seconds = claim_idle_seconds
+        self.max_attempts = max(max_attempts, 1)
+        self.consumer_prefix = f"{socket.gethostname()}-{os.getpid()}"
+        self._promote = redis_client.register_script(PROMOTE_SCRIPT) if redis_client else None
+        # Entries kept in memory: without Redis, or when appending to it failed
+        self._local_entries: asyncio.Queue = asyncio.Queue()
+        self._local_index: Dict[str, float] = {}
+        self._local_dead: List[dict] = []
+        self._transfer_to_paid: deque = deque(maxlen=1000)
+        self._tasks: List[asyncio.Task] = []
+        self._running = False
+
+    async def start(self):
+        """Create the consumer group and start the delivery workers and the retry scheduler"""
+        if self.redis is not None:
+            try:
+                await self.redis.xgroup_create(STREAM_KEY, GROUP_NAME, id="0", mkstream=True)
+            except Exception as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+        else:
+            logger.warning("No Redis configured, payment notification outbox is kept in memory only")
+
+        self._running = True
+        self._tasks = [
+            asyncio.create_task(self._worker(f"{self.consumer_prefix}-{i}"))
+            for i in range(self.concurrency)
+        ]
+        self._tasks.append(asyncio.create_task(self._scheduler()))
+        logger.info("Notification outbox started", workers=self.concurrency, durable=self.redis is not None)
+
+    async def stop(self):
+        """Stop delivering; undelivered entries stay in Redis for the next start"""
+        self._running = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if not self._local_entries.empty():
+            logger.warning("Notification outbox stopped with undelivered in-memory entries",
+                           count=self._local_entries.qsize())
+
+    async def append(self, payload: Dict[str, Any]):
+        """Record a payment notification for delivery; returns once it is stored"""
+        entry = {"payload": payload, "attempt": 1, "appended_at": time.time()}
+        if self.redis is not None:
+            try:
+                async with self.redis.pipeline(transaction=True) as pipe:
+                    pipe.xadd(STREAM_KEY, {"entry": json.dumps(entry)})
+                    pipe.zadd(INDEX_KEY, {payload["tx_hash"]: entry["appended_at"]}, nx=True)
+                    await pipe.execute()
+                return
+            except Exception as e:
+                logger.warning("Failed to append to the Redis outbox, keeping notification in memory",
+                               tx_hash=payload["tx_hash"], error=str(e))
+        self._local_index.setdefault(payload["tx_hash"], entry["appended_at"])
+        await self._local_entries.put(entry)
+
+    async def _worker(self, consumer: str):
+        while self._running:
+            try:
+                if self.redis is None or not self._local_entries.empty():
+                    entries = [(None, await self._local_entries.get())]
+                    while len(entries) < self.batch_size and not self._local_entries.empty():
+                        entries.append((None, self._local_entries.get_nowait()))
+                    await self._deliver(entries)
+                    continue
+
+                response = await self.redis.xreadgroup(
+                    GROUP_NAME, consumer, {STREAM_KEY: ">"}, count=self.batch_size, block=1000
+                )
+                for _, stream_entries in response or []:
+                    await self._deliver([(entry_id, self._decode(fields)) for entry_id, fields in stream_entries])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Notification outbox worker error", consumer=consumer, error=str(e))
+                await asyncio.sleep(1)
+
+    async def _deliver(self, entries: List[Tuple[Optional[bytes], dict]]):
+        payloads = [entry["payload"] for _, entry in entries]
+        error: Optional[BaseException] = None
+        try:
+            paid = await self.send(payloads)
+        except Exception as e:
+            logger.warning("Error sending payment notifications", size=len(payloads), error=str(e))
+            paid, error = None, e
+
+        if paid is not None:
+            OUTBOX_DELIVERIES.labels(result="success").inc(len(entries))
+            now = time.time()
+            for _, entry in entries:
+                OUTBOX_DELIVERY_DELAY.observe(max(now - entry["appended_at"], 0))
+                if entry["payload"]["tx_hash"] in paid:
+                    self._observe_transfer_to_paid(entry["payload"], now)
+            await self._ack(entries)
+            return
+
+        if is_rejection(error):
+            if len(entries) > 1:
+                # Find the bad payloads by halves instead of holding the whole batch back
+                middle = len(entries) // 2
+                await self._deliver(entries[:middle])
+                await self._deliver(entries[middle:])
+                return
+            OUTBOX_DELIVERIES.labels(result="rejected").inc()
+            await self._dead_letter(*entries[0], error=str(error))
+            return
+
+        OUTBOX_DELIVERIES.labels(result="retry").inc(len(entries))
+        for entry_id, entry in entries:
+            if entry["attempt"] >= self.max_attempts:
+                await self._dead_letter(entry_id, entry, error=str(error) if error else "not accepted")
+            else:
+                await self._retry(entry_id, entry)
+
+    def median_transfer_to_paid(self) -> Optional[float]:
+        """Median transfer-to-paid seconds of the last 1000 payments this process delivered"""
+        return statistics.median(self._transfer_to_paid) if self._transfer_to_paid else None
+
+    def _observe_transfer_to_paid(self, payload: Dict[str, Any], now: float):
+        try:
+            # Block time, written by the monitors with datetime.fromtimestamp(...).isoformat()
+            transferred_at = datetime.fromisoformat(payload["timestamp"]).timestamp()
+        except (KeyError, TypeError, ValueError):
+            return
+        seconds = max(now - transferred_at, 0)
+        PAYMENT_TRANSFER_TO_PAID.observe(seconds)
+        self._transfer_to_paid.append(seconds)
+
+    async def _ack(self, entries: List[Tuple[Optional[bytes], dict]]):
+        tx_hashes = [entry["payload"]["tx_hash"] for _, entry in entries]
+        stream_ids = [entry_id for entry_id, _ in entries if entry_id is not None]
+        for tx_hash in tx_hashes:
+            self._local_index.pop(tx_hash, None)
+        if self.redis is None:
+            return
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                if stream_ids:
+                    pipe.xack(STREAM_KEY, GROUP_NAME, *stream_ids)
+                    pipe.xdel(STREAM_KEY, *stream_ids)
+                pipe.zrem(INDEX_KEY, *tx_hashes)
+                await pipe.execute()
+        except Exception as e:
+            # The entries stay pending and are delivered again; the backend skips them as duplicates
+            logger.warning("Failed to acknowledge delivered notifications", size=len(entries), error=str(e))
+
+    async def _retry(self, entry_id: Optional[bytes], entry: dict):
+        attempt = entry["attempt"]
+        # Exponential backoff with jitter, so replicas retrying after a backend outage spread out
+        delay = min(self.backoff_base * 2 ** (attempt - 1), self.backoff_max) * random.uniform(0.5, 1.0)
+        retry = {**entry, "attempt": attempt + 1}
+        logger.warning("Payment notification not accepted, retrying",
+                       tx_hash=entry["payload"]["tx_hash"], attempt=attempt, retry_in=round(delay, 1))
+
+        if entry_id is not None:
+            try:
+                async with self.redis.pipeline(transaction=True) as pipe:
+                    pipe.zadd(RETRY_KEY, {json.dumps(retry): time.time() + delay})
+                    pipe.xack(STREAM_KEY, GROUP_NAME, entry_id)
+                    pipe.xdel(STREAM_KEY, entry_id)
+                    await pipe.execute()
+                return
+            except Exception as e:
+                # Left pending in the stream, the entry is claimed again after claim_idle_seconds
+                logger.warning("Failed to schedule notification retry", error=str(e))
+                return
+
+        asyncio.get_running_loop().call_later(delay, self._local_entries.put_nowait, retry)
+
+    async def _dead_letter(self, entry_id: Optional[bytes], entry: dict, error: str):
+        tx_hash = entry["payload"]["tx_hash"]
+        OUTBOX_DELIVERIES.labels(result="dead").inc()
+        logger.error("Payment notification moved to the dead-letter stream",
+                     tx_hash=tx_hash, attempts=entry["attempt"], error=error[:500])
+        dead = {
+            "entry": json.dumps(entry),
+            "attempts": entry["attempt"],
+            "error": error[:500],
+            "failed_at": time.time()
+        }
+        self._local_index.pop(tx_hash, None)
+
+        if self.redis is not None:
+            try:
+                async with self.redis.pipeline(transaction=True) as pipe:
+                    pipe.xadd(DEAD_LETTER_KEY, dead)
+                    if entry_id is not None:
+                        pipe.xack(STREAM_KEY, GROUP_NAME, entry_id)
+                        pipe.xdel(STREAM_KEY, entry_id)
+                    pipe.zrem(INDEX_KEY, tx_hash)
+                    await pipe.execute()
+                return
+            except Exception as e:
+                logger.warning("Failed to dead-letter notification, keeping it in memory", error=str(e))
+                if entry_id is not None:
+                    # Left pending in the stream, the entry is claimed and tried again
+                    return
+        self._local_dead.append(dead)
+
+    async def dead_letters(self, count: int = 100) -> List[Dict[str, Any]]:
+        """Newest dead-lettered notifications, with the error that stopped them"""
+        letters = [{"id": None, **dead} for dead in reversed(self._local_dead[-count:])]
+        if self.redis is not None:
+            for entry_id, fields in await self.redis.xrevrange(DEAD_LETTER_KEY, count=count):
+                letters.append({
+                    "id": entry_id.decode(),
+                    **{key.decode(): value.decode() for key, value in fields.items()}
+                })
+        for letter in letters:
+            letter["entry"] = json.loads(letter["entry"])
+        return letters[:count]
+
+    async def requeue_dead(self, entry_id: str) -> bool:
+        """Put a dead-lettered notification back on the outbox with a fresh attempt count"""
+        if self.redis is None:
+            return False
+        entries = await self.redis.xrange(DEAD_LETTER_KEY, min=entry_id, max=entry_id)
+        if not entries:
+            return False
+        _, fields = entries[0]
+        entry = {**self._decode(fields), "attempt": 1}
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.xadd(STREAM_KEY, {"entry": json.dumps(entry)})
+            pipe.zadd(INDEX_KEY, {entry["payload"]["tx_hash"]: entry["appended_at"]}, nx=True)
+            pipe.xdel(DEAD_LETTER_KEY, entry_id)
+            await pipe.execute()
+        logger.info("Dead-lettered payment notification requeued",
+                    tx_hash=entry["payload"]["tx_hash"], entry_id=entry_id)
+        return True
+
+    async def _scheduler(self):
+        """Put due retries back on the stream, claim entries abandoned by dead consumers, update metrics"""
+        consumer = f"{self.consumer_prefix}-scheduler"
+        while self._running:
+            try:
+                if self.redis is not None:
+                    await self._promote(keys=[RETRY_KEY, STREAM_KEY], args=[time.time(), 100])
+
+                    _, claimed, *_ = await self.redis.xautoclaim(
+                        STREAM_KEY, GROUP_NAME, consumer,
+                        min_idle_time=int(self.claim_idle_seconds * 1000), start_id="0-0", count=self.batch_size
+                    )
+                    # Entries deleted meanwhile come back without fields on older Redis versions
+                    claimed = [(entry_id, fields) for entry_id, fields in claimed if fields]
+                    if claimed:
+                        logger.warning("Claimed abandoned payment notifications", count=len(claimed))
+                        await self._deliver([(entry_id, self._decode(fields)) for entry_id, fields in claimed])
+
+                await self._update_metrics()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Notification outbox scheduler error", error=str(e))
+            await asyncio.sleep(1)
+
+    async def _update_metrics(self):
+        depth, appended = len(self._local_index), list(self._local_index.values())
+        dead = len(self._local_dead)
+        if self.redis is not None:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.zcard(INDEX_KEY)
+                pipe.zrange(INDEX_KEY, 0, 0, withscores=True)
+                pipe.xlen(DEAD_LETTER_KEY)
+                stored, oldest, stored_dead = await pipe.execute()
+            depth += stored
+            appended += [score for _, score in oldest]
+            dead += stored_dead
+        OUTBOX_DEPTH.set(depth)
+        OUTBOX_DEAD_LETTERS.set(dead)
+        median = self.median_transfer_to_paid()
+        if median is not None:
+            PAYMENT_TRANSFER_TO_PAID_MEDIAN.set(median)
+        OUTBOX_OLDEST_AGE.set(max(time.time() - min(appended), 0) if appended else 0)
+
+    @staticmethod
+    def _decode(fields: dict) -> dict:
+        return json.loads(fields[b"entry"])
@@ -0,0 +1,168 @@
+"""
+Staged processing pipeline for the payment monitors
+
+A monitor tick used to handle its transactions one at a time: each
+confirmation lookup and each backend notification was awaited before the
+next transaction was looked at. The work now flows through named stages
+connected by bounded asyncio queues, and every stage runs its own number
+of workers. A worker passing an item to a full downstream queue waits for
+room. A slow stage, usually node lookups or the backend, therefore holds
+back the stages before it instead of letting queues grow.
+
+A stage handler returns the items to hand to the next stage, or None to
+drop the item. Items can also be put straight into a later stage, as the
+monitors do with transfers released by a new chain head.
+
+An item whose handler raises is not passed on. join() returns the items
+that failed since the previous join, so a monitor can keep its history
+cursor in front of them and fetch them again instead of treating them as
+handled.
+
+Per stage, the queue depth, the time items wait in the queue and the time
+the handler takes are exported, to show where detection time goes. Work
+done outside the workers, such as the fetch at the start of a tick, can
+be timed under its own stage name with timed().
+"""
+
+import asyncio
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import structlog
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = structlog.get_logger()
+
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 15, 60)
+
+PIPELINE_QUEUE_DEPTH = Gauge(
+    "monitor_pipeline_queue_depth",
+    "Items waiting in a monitor pipeline stage queue",
+    ["stage"]
+)
+PIPELINE_QUEUE_WAIT = Histogram(
+    "monitor_pipeline_queue_wait_seconds",
+    "Time items waited in a stage queue before a worker took them",
+    ["stage"],
+    buckets=STAGE_BUCKETS
+)
+PIPELINE_STAGE_DURATION = Histogram(
+    "monitor_pipeline_stage_duration_seconds",
+    "Time a stage spent on one item",
+    ["stage"],
+    buckets=STAGE_BUCKETS
+)
+PIPELINE_ITEMS = Counter(
+    "monitor_pipeline_items_total",
+    "Items handled by each stage",
+    ["stage", "result"]  # passed, dropped, error
+)
+
+Handler = Callable[[Any], Awaitable[Optional[Iterable[Any]]]]
+
+
+class Stage:
+    """One step of the pipeline: a bounded queue and the workers draining it"""
+
+    def __init__(self, name: str, handler: Handler, workers: int = 1, queue_size: int = 100):
+        self.name = name
+        self.handler = handler
+        self.workers = max(workers, 1)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.next: Optional["Stage"] = None
+        self.counts = {"passed": 0, "dropped": 0, "error": 0}
+
+
+class Pipeline:
+    """Stages run in the order they were added"""
+
+    def __init__(self):
+        self.stages: List[Stage] = []
+        self._tasks: List[asyncio.Task] = []
+        self._failed: List[Tuple[str, Any]] = []
+
+    def add_stage(self, name: str, handler: Handler, workers: int = 1, queue_size: int = 100) -> "Pipeline":
+        stage = Stage(name, handler, workers, queue_size)
+        if self.stages:
+            self.stages[-1].next = stage
+        self.stages.append(stage)
+        return self
+
+    def start(self):
+        """Start the stage workers; does nothing if they are running"""
+        if self._tasks:
+            return
+        for stage in self.stages:
+            for _ in range(stage.workers):
+                self._tasks.append(asyncio.create_task(self._work(stage)))
+
+    async def put(self, item: Any, stage: Optional[str] = None):
+        """Queue an item at the first stage, or at the named one; waits while that queue is full"""
+        self.start()
+        await self._enqueue(self._stage(stage) if stage else self.stages[0], item)
+
+    async def join(self) -> List[Tuple[str, Any]]:
+        """Wait until every queued item has gone through all stages
+        
+        Returns (stage name, item) for each item whose handler raised since
+        the previous join.
+        """
+        # A stage hands its outputs on before marking its item done, so joining in order is enough
+        for stage in self.stages:
+            await stage.queue.join()
+        failed, self._failed = self._failed, []
+        return failed
+
+    async def close(self):
+        """Stop the workers; items still queued are dropped"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    @contextmanager
+    def timed(self, stage: str):
+        """Record work done outside the workers, such as a fetch, under a stage name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            PIPELINE_STAGE_DURATION.labels(stage=stage).observe(time.perf_counter() - start)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            stage.name: {"depth": stage.queue.qsize(), "workers": stage.workers, **stage.counts}
+            for stage in self.stages
+        }
+
+    def _stage(self, name: str) -> Stage:
+        for stage in self.stages:
+            if stage.name == name:
+                return stage
+        raise KeyError(f"Unknown pipeline stage {name}")
+
+    async def _enqueue(self, stage: Stage, item: Any):
+        await stage.queue.put((time.monotonic(), item))
+        PIPELINE_QUEUE_DEPTH.labels(stage=stage.name).set(stage.queue.qsize())
+
+    async def _work(self, stage: Stage):
+        while True:
+            queued_at, item = await stage.queue.get()
+            PIPELINE_QUEUE_DEPTH.labels(stage=stage.name).set(stage.queue.qsize())
+            PIPELINE_QUEUE_WAIT.labels(stage=stage.name).observe(time.monotonic() - queued_at)
+            result = "error"
+            try:
+                with self.timed(stage.name):
+                    outputs = await stage.handler(item)
+                result = "passed" if outputs else "dropped"
+                if stage.next is not None:
+                    for output in outputs or ():
+                        await self._enqueue(stage.next, output)
+            except Exception as e:
+                logger.error("Pipeline stage failed", stage=stage.name, error=str(e))
+                self._failed.append((stage.name, item))
+            finally:
+                stage.queue.task_done()
+            stage.counts[result] += 1
+            PIPELINE_ITEMS.labels(stage=stage.name, result=result).inc()
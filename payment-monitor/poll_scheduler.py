@@ -0,0 +1,203 @@
+"""
+Adaptive polling schedule for the payment monitors
+
+The monitors used to poll every 30 seconds whatever the load. That is
+slow for a customer who has just created a 15 minute order, and wasted
+work at night with no orders open. The schedule now follows the orders
+waiting for payment, which the backend announces on the orders:events
+pub/sub channel:
+
+- burst: right after an order is created, every burst_interval seconds,
+  since customers usually pay within the first minute
+- active: every active_interval seconds (about one block) while any
+  order is still waiting for payment
+- idle: with nothing pending, the interval doubles from active_interval
+  after each empty poll, up to idle_max
+
+A created event also ends the current wait at once. Pub/sub is best
+effort, so pending orders are also read from the backend's payment index
+in Redis, at startup and after every reconnect. Each order is forgotten
+at its payment deadline even if its paid or expired event was missed.
+
+Without Redis there are no events, and the monitor polls every
+fallback_interval seconds as before.
+"""
+
+import asyncio
+import json
+import time
+from typing import Dict, Iterable, Optional
+
+import structlog
+from prometheus_client import Counter, Gauge
+
+logger = structlog.get_logger()
+
+# Published by backend/order_events.py
+ORDER_EVENTS_CHANNEL = "orders:events"
+# The backend's pending order match index (backend/payment_index.py): amount -> "order_id:deadline"
+PAYMENT_INDEX_KEY_PREFIX = "payidx"
+
+POLL_INTERVAL = Gauge(
+    "monitor_poll_interval_seconds",
+    "Current wait between payment monitor polls"
+)
+PENDING_ORDERS = Gauge(
+    "monitor_pending_orders",
+    "Orders waiting for payment, as seen by the payment monitor"
+)
+POLLS = Counter(
+    "monitor_polls_total",
+    "Payment monitor polls by schedule mode",
+    ["mode"]  # burst, active, idle, fixed
+)
+
+
+class PollScheduler:
+    """Chooses the wait before the next poll from the orders waiting for payment"""
+
+    def __init__(
+        self,
+        redis_client,
+        payment_addresses: Iterable[str],
+        active_interval: float = 3.0,
+        burst_interval: float = 1.0,
+        burst_seconds: float = 60.0,
+        idle_max: float = 300.0,
+        fallback_interval: float = 30.0,
+        order_ttl: float = 1200.0
+    ):
+        self.redis = redis_client
+        self.payment_addresses = {address for address in payment_addresses if address}
+        self.active_interval = active_interval
+        self.burst_interval = burst_interval
+        self.burst_seconds = burst_seconds
+        self.idle_max = idle_max
+        self.fallback_interval = fallback_interval
+        # Deadline assumed for orders whose event did not carry one
+        self.order_ttl = order_ttl
+        self.pending: Dict[int, float] = {}  # order id -> payment deadline
+        self.burst_until = 0.0
+        self.idle_interval = active_interval
+        self._wake = asyncio.Event()
+        self._listener: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Load pending orders and follow order events; without Redis the interval stays fixed"""
+        if self.redis is None:
+            logger.info("No Redis configured, polling at a fixed interval", interval=self.fallback_interval)
+            return
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+
+    def mode(self, now: Optional[float] = None) -> str:
+        now = now or time.time()
+        if self.redis is None:
+            return "fixed"
+        if now < self.burst_until:
+            return "burst"
+        self._forget_expired(now)
+        return "active" if self.pending else "idle"
+
+    def next_interval(self, now: Optional[float] = None) -> float:
+        """Wait before the next poll; called once per poll, since idle waits grow with each one"""
+        mode = self.mode(now)
+        POLLS.labels(mode=mode).inc()
+        if mode == "fixed":
+            interval = self.fallback_interval
+        elif mode == "burst":
+            interval = self.burst_interval
+        elif mode == "active":
+            interval = self.active_interval
+        else:
+            interval = self.idle_interval
+        self.idle_interval = min(self.idle_interval * 2, self.idle_max) if mode == "idle" else self.active_interval
+        POLL_INTERVAL.set(interval)
+        return interval
+
+    async def wait(self):
+        """Sleep until the next poll is due, or until an order is created"""
+        interval = self.next_interval()
+        self._wake.clear()
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+
+    def wake(self):
+        """End the current wait, e.g. when this replica takes over addresses"""
+        self._wake.set()
+
+    def order_created(self, order_id: int, deadline: Optional[float] = None, now: Optional[float] = None):
+        now = now or time.time()
+        self.pending[order_id] = deadline or now + self.order_ttl
+        self.burst_until = now + self.burst_seconds
+        self.idle_interval = self.active_interval
+        PENDING_ORDERS.set(len(self.pending))
+        self._wake.set()
+
+    def order_closed(self, order_id: int):
+        self.pending.pop(order_id, None)
+        PENDING_ORDERS.set(len(self.pending))
+
+    def handle_event(self, event: dict):
+        if self.payment_addresses and event.get("payment_address") not in self.payment_addresses:
+            return
+        if event.get("type") == "created":
+            self.order_created(int(event["order_id"]), event.get("deadline"))
+        elif event.get("type") in ("paid", "expired"):
+            self.order_closed(int(event["order_id"]))
+
+    async def resync(self):
+        """Replace the pending set with the orders in the backend's payment index"""
+        now = time.time()
+        pending = {}
+        for address in self.payment_addresses:
+            entries = await self.redis.hgetall(f"{PAYMENT_INDEX_KEY_PREFIX}:{address}")
+            for value in entries.values():
+                order_id, _, deadline = value.decode().partition(":")
+                if float(deadline) > now:
+                    pending[int(order_id)] = float(deadline)
+        self.pending = pending
+        PENDING_ORDERS.set(len(self.pending))
+        logger.info("Pending orders loaded", count=len(self.pending))
+
+    def _forget_expired(self, now: float):
+        expired = [order_id for order_id, deadline in self.pending.items() if deadline <= now]
+        for order_id in expired:
+            del self.pending[order_id]
+        if expired:
+            PENDING_ORDERS.set(len(self.pending))
+
+    async def _listen(self):
+        delay = 1.0
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(ORDER_EVENTS_CHANNEL)
+                # Subscribed before reading the index, so nothing created in between is missed
+                await self.resync()
+                delay = 1.0
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    try:
+                        self.handle_event(json.loads(message["data"]))
+                    except (ValueError, KeyError, TypeError) as e:
+                        logger.warning("Ignoring malformed order event", error=str(e))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Order event subscription lost, reconnecting", error=str(e), retry_in=delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60.0)
+            finally:
+                try:
+                    await pubsub.close()
+                except Exception:
+                    pass
@@ -0,0 +1,59 @@
+import argparse
+import asyncio
+import json
+import os
+
+import pytest
+
+from backfill import backfill
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "usdt_blocks.json")
+WATCHED = ["TQn9Y2khEsLJW1ChVWFMSMeRDow5KcbLSE", "TWbTaqskoFmsQdpaDmrfkDK4zQ9NXqetpd"]
+
+
+def write_fixture(path, numbers):
+    """The fixture cut down to some of its blocks, as a node would serve them at some moment"""
+    with open(FIXTURE) as f:
+        data = json.load(f)
+    blocks = [block for block in data["blocks"] if block["block_header"]["raw_data"]["number"] in numbers]
+    infos = {number: infos for number, infos in data["transaction_infos"].items() if int(number) in numbers}
+    with open(path, "w") as f:
+        json.dump({"blocks": blocks, "transaction_infos": infos}, f)
+
+
+def arguments(tmp_path, **overrides):
+    values = dict(
+        from_block=62913544, to_block=None, since=None, until=None, watch=list(WATCHED),
+        fixtures=str(tmp_path / "blocks.json"), chunk_blocks=1, concurrency=2, requests=4, decode_workers=0,
+        state=str(tmp_path / "state.json"), report=str(tmp_path / "report.json"), database_url=None,
+        grace=300, progress_interval=60.0
+    )
+    values.update(overrides)
+    return argparse.Namespace(**values)
+
+
+def test_rerun_resumes_the_range_of_the_first_run_after_the_head_moved(tmp_path):
+    write_fixture(tmp_path / "blocks.json", {62913544, 62913545})
+    asyncio.run(backfill(arguments(tmp_path)))
+    with open(tmp_path / "report.json") as f:
+        first = json.load(f)
+
+    # The head has moved on and the node no longer serves the scanned blocks: a resume must not need them
+    write_fixture(tmp_path / "blocks.json", {62913546})
+    asyncio.run(backfill(arguments(tmp_path)))
+    with open(tmp_path / "report.json") as f:
+        resumed = json.load(f)
+
+    assert (first["start_block"], first["end_block"]) == (62913544, 62913545)
+    assert (resumed["start_block"], resumed["end_block"]) == (62913544, 62913545)
+    assert resumed["failed_chunks"] == []
+    assert resumed["transfer_list"] == first["transfer_list"]
+    assert first["transfers"] > 0
+
+
+def test_a_state_file_of_other_arguments_is_refused(tmp_path):
+    write_fixture(tmp_path / "blocks.json", {62913544, 62913545})
+    asyncio.run(backfill(arguments(tmp_path)))
+
+    with pytest.raises(SystemExit, match="different backfill"):
+        asyncio.run(backfill(arguments(tmp_path, chunk_blocks=2)))
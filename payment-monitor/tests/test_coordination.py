@@ -0,0 +1,83 @@
+import asyncio
+import time
+
+from coordination import Lease, MonitorCoordinator
+
+ADDRESSES = ["TAddressOne", "TAddressTwo"]
+
+
+def test_stale_holder_cannot_write_after_its_lease_moved(redis_client):
+    async def run():
+        stalled = Lease(redis_client, "leader", "replica-a", ttl=0.2)
+        successor = Lease(redis_client, "leader", "replica-b", ttl=5)
+        assert await stalled.acquire()
+        assert await stalled.fenced_set("cursor", "from-a")
+        assert not await successor.acquire()
+
+        # replica-a stalls past its TTL and replica-b takes the lease with a newer token
+        await asyncio.sleep(0.3)
+        assert await successor.acquire()
+        assert successor.token > stalled.token
+        assert await successor.fenced_set("cursor", "from-b")
+
+        # replica-a still believes it holds the lease, but its write is refused
+        refused = await stalled.fenced_set("cursor", "late-from-a")
+        renewed = await stalled.acquire()
+        return refused, renewed, await redis_client.get("cursor")
+
+    refused, renewed, cursor = asyncio.run(run())
+    assert (refused, renewed, cursor) == (False, False, b"from-b")
+
+
+def test_released_lease_refuses_writes(redis_client):
+    async def run():
+        lease = Lease(redis_client, "leader", "replica-a", ttl=5)
+        await lease.acquire()
+        await lease.release()
+        return await lease.fenced_set("cursor", "after-release"), await redis_client.get("cursor")
+
+    assert asyncio.run(run()) == (False, None)
+
+
+def test_standby_takes_over_a_crashed_leader_within_ttl_and_a_renewal(redis_client):
+    ttl = 0.4
+
+    async def run():
+        leader = MonitorCoordinator(redis_client, "leader", ADDRESSES, ttl=ttl, replica_id="replica-a")
+        standby = MonitorCoordinator(redis_client, "leader", ADDRESSES, ttl=ttl, replica_id="replica-b")
+        await leader.start()
+        await standby.start()
+        assert leader.take_gained() == set(ADDRESSES) and not standby.owned
+
+        # Killed: the renewals stop and nothing is released
+        leader._task.cancel()
+        await asyncio.gather(leader._task, return_exceptions=True)
+        start = time.monotonic()
+        while not standby.owned:
+            await asyncio.sleep(ttl / 20)
+        elapsed = time.monotonic() - start
+
+        gained = standby.take_gained()
+        await leader.refresh()
+        lost = leader.take_lost()
+        await standby.stop()
+        return elapsed, gained, lost, leader.owned
+
+    elapsed, gained, lost, still_owned = asyncio.run(run())
+    assert elapsed < ttl * 5 / 4 + 0.2
+    assert gained == set(ADDRESSES) and lost == set(ADDRESSES) and not still_owned
+
+
+def test_clean_stop_hands_the_addresses_over(redis_client):
+    async def run():
+        leader = MonitorCoordinator(redis_client, "leader", ADDRESSES, ttl=0.4, replica_id="replica-a")
+        standby = MonitorCoordinator(redis_client, "leader", ADDRESSES, ttl=0.4, replica_id="replica-b")
+        await leader.start()
+        await standby.start()
+        await leader.stop()
+        await standby.refresh()
+        owned = set(standby.owned)
+        await standby.stop()
+        return leader.take_lost(), owned
+
+    assert asyncio.run(run()) == (set(ADDRESSES), set(ADDRESSES))
@@ -0,0 +1,104 @@
+import asyncio
+from datetime import datetime
+
+from main import PaymentMonitorService
+from tx_dedup import SeenTransactions
+
+ADDRESS = "TQn9Y2khEsLJW1ChVWFMSMeRDow5KcbLSE"
+
+
+def transfer(tx_hash, token="USDT-TRC20"):
+    return {"tx_hash": tx_hash, "from_address": "TSender", "to_address": ADDRESS, "amount": 1.0,
+            "token": token, "timestamp": datetime(2026, 1, 1), "block_number": None, "confirmations": 0}
+
+
+class StandInTronClient:
+    """Serves one batch of new transfers and records what is committed"""
+
+    def __init__(self, transfers, unconfirmed=()):
+        self.payment_address = ADDRESS
+        self.transfers = transfers
+        self.unconfirmed = set(unconfirmed)
+        self.loaded = []
+        self.commits = []
+
+    async def load_history(self, address):
+        self.loaded.append(address)
+
+    async def get_new_transactions(self, address, resolve_blocks=True):
+        assert not resolve_blocks  # the confirm stage looks the blocks up
+        return list(self.transfers)
+
+    async def commit_new_transactions(self, address, unhandled=()):
+        self.commits.append(set(unhandled))
+
+    async def resolve_confirmations(self, transaction):
+        transaction["confirmations"] = 0 if transaction["tx_hash"] in self.unconfirmed else 19
+        return transaction["confirmations"]
+
+
+class StandInCoordinator:
+    def __init__(self):
+        self.gained = {ADDRESS}
+
+    def owns(self, address):
+        return True
+
+    def take_gained(self):
+        gained, self.gained = self.gained, set()
+        return gained
+
+
+class StandInOutbox:
+    def __init__(self, refuse=()):
+        self.refuse = set(refuse)
+        self.appended = []
+
+    async def append(self, payload):
+        if payload["tx_hash"] in self.refuse:
+            raise ConnectionError("outbox unavailable")
+        self.appended.append(payload["tx_hash"])
+
+
+def service(tron_client, outbox):
+    monitor = PaymentMonitorService()
+    monitor.tron_client = tron_client
+    monitor.coordinator = StandInCoordinator()
+    monitor.outbox = outbox
+    monitor.processed_transactions = SeenTransactions()
+    return monitor
+
+
+def test_poll_commits_the_history_past_notified_transfers_only():
+    tron_client = StandInTronClient(
+        [transfer("trx", token="TRX"), transfer("paid"), transfer("waiting"), transfer("refused")],
+        unconfirmed={"waiting"}
+    )
+    outbox = StandInOutbox(refuse={"refused"})
+    monitor = service(tron_client, outbox)
+
+    async def run():
+        await monitor.check_for_payments()
+        await monitor.pipeline.close()
+
+    asyncio.run(run())
+    assert tron_client.loaded == [ADDRESS]
+    assert outbox.appended == ["paid"]
+    assert tron_client.commits == [{"waiting", "refused"}]
+
+
+def test_later_polls_skip_what_was_notified_and_do_not_reload_the_cursor():
+    tron_client = StandInTronClient([transfer("paid"), transfer("waiting")], unconfirmed={"waiting"})
+    outbox = StandInOutbox()
+    monitor = service(tron_client, outbox)
+
+    async def run():
+        await monitor.check_for_payments()
+        tron_client.unconfirmed.clear()
+        await monitor.check_for_payments()
+        await monitor.pipeline.close()
+
+    asyncio.run(run())
+    assert tron_client.loaded == [ADDRESS]
+    assert outbox.appended == ["paid", "waiting"]
+    assert tron_client.commits == [{"waiting"}, set()]
@@ -0,0 +1,152 @@
+import asyncio
+from datetime import datetime
+
+import aiohttp
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+from notification_outbox import DEAD_LETTER_KEY, INDEX_KEY, RETRY_KEY, STREAM_KEY, NotificationOutbox
+
+
+def payload(tx_hash):
+    return {"tx_hash": tx_hash, "amount": "1.0", "timestamp": datetime.now().isoformat()}
+
+
+class StandInBackend:
+    """Refuses the first `outage` deliveries, then pays the orders of the tx hashes in `pays`
+
+    A delivery holding any tx hash in `bad` is rejected with a 422, the way
+    the backend answers a payload that fails validation.
+    """
+
+    def __init__(self, outage=0, pays=None, bad=()):
+        self.outage = outage
+        self.pays = pays
+        self.bad = set(bad)
+        self.attempts = []
+        self.accepted = []
+
+    async def send(self, payloads):
+        self.attempts.append([item["tx_hash"] for item in payloads])
+        if len(self.attempts) <= self.outage:
+            return None
+        if self.bad.intersection(item["tx_hash"] for item in payloads):
+            url = URL("http://backend/internal/payments/notify")
+            request = aiohttp.RequestInfo(url, "POST", CIMultiDictProxy(CIMultiDict()), url)
+            raise aiohttp.ClientResponseError(request, (), status=422, message="Unprocessable Entity")
+        self.accepted.extend(item["tx_hash"] for item in payloads)
+        return [item["tx_hash"] for item in payloads if self.pays is None or item["tx_hash"] in self.pays]
+
+
+async def delivered(outbox, backend, count, timeout=10.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while len(backend.accepted) < count and asyncio.get_running_loop().time() < deadline:
+        await asyncio.sleep(0.02)
+    await outbox.stop()
+
+
+def test_refused_notifications_are_retried_until_accepted(redis_client):
+    backend = StandInBackend(outage=2)
+    outbox = NotificationOutbox(redis_client, backend.send, concurrency=1, backoff_base=0.05, backoff_max=0.1)
+
+    async def run():
+        await outbox.start()
+        await outbox.append(payload("t1"))
+        await delivered(outbox, backend, 1)
+        return (await redis_client.xlen(STREAM_KEY), await redis_client.zcard(RETRY_KEY),
+                await redis_client.zcard(INDEX_KEY))
+
+    assert asyncio.run(run()) == (0, 0, 0)
+    assert backend.attempts == [["t1"], ["t1"], ["t1"]]
+
+
+def test_in_memory_outbox_retries_too():
+    backend = StandInBackend(outage=1)
+    outbox = NotificationOutbox(None, backend.send, concurrency=1, backoff_base=0.05, backoff_max=0.1)
+
+    async def run():
+        await outbox.start()
+        await outbox.append(payload("t1"))
+        await delivered(outbox, backend, 1)
+
+    asyncio.run(run())
+    assert backend.attempts == [["t1"], ["t1"]]
+
+
+def test_transfer_to_paid_counts_only_notifications_that_paid_an_order():
+    backend = StandInBackend(pays={"paid"})
+    outbox = NotificationOutbox(None, backend.send, concurrency=1)
+
+    async def run():
+        await outbox.start()
+        for tx_hash in ("no-match", "paid", "duplicate"):
+            await outbox.append(payload(tx_hash))
+        await delivered(outbox, backend, 3)
+
+    asyncio.run(run())
+    assert backend.accepted == ["no-match", "paid", "duplicate"]
+    assert len(outbox._transfer_to_paid) == 1
+    assert outbox.median_transfer_to_paid() is not None
+
+
+def test_a_rejected_payload_is_dead_lettered_without_holding_back_its_batch(redis_client):
+    backend = StandInBackend(bad={"t3"})
+    outbox = NotificationOutbox(redis_client, backend.send, concurrency=1, batch_size=4, backoff_base=0.05)
+
+    async def run():
+        for i in range(1, 5):
+            await outbox.append(payload(f"t{i}"))
+        await outbox.start()
+        await delivered(outbox, backend, 3)
+        return (await redis_client.xlen(STREAM_KEY), await redis_client.zcard(RETRY_KEY),
+                await redis_client.zcard(INDEX_KEY), await outbox.dead_letters())
+
+    stream, retries, index, dead = asyncio.run(run())
+    assert (stream, retries, index) == (0, 0, 0)
+    assert sorted(backend.accepted) == ["t1", "t2", "t4"]
+    # The whole batch, then its halves, then the half holding t3 one by one; t3 is never retried
+    assert backend.attempts == [["t1", "t2", "t3", "t4"], ["t1", "t2"], ["t3", "t4"], ["t3"], ["t4"]]
+    assert [letter["entry"]["payload"]["tx_hash"] for letter in dead] == ["t3"]
+    assert "422" in dead[0]["error"]
+
+
+def test_notifications_still_refused_after_max_attempts_are_dead_lettered_and_can_be_requeued(redis_client):
+    backend = StandInBackend(outage=3)
+    outbox = NotificationOutbox(redis_client, backend.send, concurrency=1, backoff_base=0.05,
+                                backoff_max=0.1, max_attempts=3)
+
+    async def run():
+        await outbox.start()
+        await outbox.append(payload("t1"))
+        deadline = asyncio.get_running_loop().time() + 10
+        while not await redis_client.xlen(DEAD_LETTER_KEY) and asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(0.02)
+        dead = await outbox.dead_letters()
+        index = await redis_client.zcard(INDEX_KEY)
+
+        assert await outbox.requeue_dead(dead[0]["id"])
+        await delivered(outbox, backend, 1)
+        return dead, index, await redis_client.xlen(DEAD_LETTER_KEY)
+
+    dead, index, dead_after_requeue = asyncio.run(run())
+    assert [(letter["entry"]["payload"]["tx_hash"], letter["attempts"]) for letter in dead] == [("t1", "3")]
+    assert index == 0
+    assert dead_after_requeue == 0
+    assert backend.attempts == [["t1"]] * 4
+    assert backend.accepted == ["t1"]
+
+
+def test_in_memory_outbox_dead_letters_too():
+    backend = StandInBackend(bad={"t1"})
+    outbox = NotificationOutbox(None, backend.send, concurrency=1)
+
+    async def run():
+        await outbox.start()
+        await outbox.append(payload("t1"))
+        await outbox.append(payload("t2"))
+        await delivered(outbox, backend, 1)
+        return await outbox.dead_letters()
+
+    dead = asyncio.run(run())
+    assert [letter["entry"]["payload"]["tx_hash"] for letter in dead] == ["t1"]
+    assert backend.accepted == ["t2"]
@@ -0,0 +1,65 @@
+import asyncio
+
+from pipeline import Pipeline
+
+
+def test_join_reports_items_a_stage_failed_on():
+    notified = []
+
+    async def parse(item):
+        if item == "bad-parse":
+            raise ValueError("unparsable")
+        return [item]
+
+    async def notify(item):
+        if item == "bad-notify":
+            raise ConnectionError("backend down")
+        notified.append(item)
+        return [item]
+
+    async def run():
+        pipeline = Pipeline().add_stage("parse", parse, 2).add_stage("notify", notify, 2)
+        for item in ("a", "bad-parse", "b", "bad-notify"):
+            await pipeline.put(item)
+        failed = await pipeline.join()
+        await pipeline.close()
+        return failed, pipeline.stats()
+
+    failed, stats = asyncio.run(run())
+    assert sorted(failed) == [("notify", "bad-notify"), ("parse", "bad-parse")]
+    assert sorted(notified) == ["a", "b"]
+    assert stats["parse"]["error"] == 1 and stats["notify"]["error"] == 1
+
+
+def test_failures_are_reported_once():
+    async def explode(item):
+        raise RuntimeError("boom")
+
+    async def run():
+        pipeline = Pipeline().add_stage("only", explode)
+        await pipeline.put(1)
+        first = await pipeline.join()
+        await pipeline.put(2)
+        second = await pipeline.join()
+        third = await pipeline.join()
+        await pipeline.close()
+        return first, second, third
+
+    assert asyncio.run(run()) == ([("only", 1)], [("only", 2)], [])
+
+
+def test_items_put_into_a_later_stage_report_failures_too():
+    async def passthrough(item):
+        return [item]
+
+    async def notify(item):
+        raise ConnectionError("backend down")
+
+    async def run():
+        pipeline = Pipeline().add_stage("filter", passthrough).add_stage("notify", notify)
+        await pipeline.put("released", stage="notify")
+        failed = await pipeline.join()
+        await pipeline.close()
+        return failed
+
+    assert asyncio.run(run()) == [("notify", "released")]
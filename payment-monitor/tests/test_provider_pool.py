@@ -0,0 +1,146 @@
+import asyncio
+import time
+
+import aiohttp
+
+from provider_pool import ProviderPool, TronNode
+
+FAST, SLOW = "http://fast", "http://slow"
+
+
+class StandInResponse:
+    def __init__(self, status):
+        self.status = status
+        self.headers = {}
+
+    async def read(self):
+        return b"{}"
+
+
+class StandInSession:
+    """Answers each node after its delay with its status, or fails while the node is down
+
+    Records when each request started and which ones were cancelled.
+    """
+
+    def __init__(self, delays, down=()):
+        self.delays = delays
+        self.down = set(down)
+        self.started = []
+        self.cancelled = []
+        self._epoch = time.monotonic()
+
+    def request(self, method, url, **kwargs):
+        return self._answer(url.split("/wallet")[0])
+
+    def _answer(self, node):
+        session = self
+
+        class Answer:
+            async def __aenter__(self):
+                session.started.append((node, time.monotonic() - session._epoch))
+                if node in session.down:
+                    raise aiohttp.ClientConnectionError(f"{node} is down")
+                try:
+                    await asyncio.sleep(session.delays[node])
+                except asyncio.CancelledError:
+                    session.cancelled.append(node)
+                    raise
+                return StandInResponse(200)
+
+            async def __aexit__(self, *exc):
+                return False
+
+        return Answer()
+
+
+def measured(pool, url, seconds, count=20):
+    """Give a node a latency history, so its p95 is known"""
+    health = next(h for h in pool.nodes if h.node.url == url)
+    for _ in range(count):
+        pool._record_success(health, seconds)
+    return health
+
+
+def test_a_read_slower_than_the_p95_is_hedged_and_the_first_answer_wins():
+    pool = ProviderPool([TronNode(SLOW), TronNode(FAST)], hedge_default=5.0)
+    measured(pool, SLOW, 0.05)
+    measured(pool, FAST, 0.2)  # ranks the slow node first
+    session = StandInSession({SLOW: 1.0, FAST: 0.01})
+
+    async def run():
+        started = time.monotonic()
+        response = await pool.request(session, "POST", "/wallet/getnowblock")
+        return response, time.monotonic() - started
+
+    response, elapsed = asyncio.run(run())
+    assert response.node == FAST
+    assert elapsed < 0.5
+    # The hedge went out once the primary had taken its p95, not before
+    (first, _), (second, hedged_at) = session.started
+    assert (first, second) == (SLOW, FAST)
+    assert hedged_at >= 0.05
+    assert session.cancelled == [SLOW]
+
+
+def test_a_primary_answering_before_the_hedge_wins_and_the_hedge_is_cancelled():
+    pool = ProviderPool([TronNode(FAST), TronNode(SLOW)])
+    measured(pool, FAST, 0.02)
+    measured(pool, SLOW, 0.5)
+    session = StandInSession({FAST: 0.1, SLOW: 1.0})
+
+    async def run():
+        return await pool.request(session, "POST", "/wallet/getnowblock")
+
+    assert asyncio.run(run()).node == FAST
+    assert [node for node, _ in session.started] == [FAST, SLOW]
+    assert session.cancelled == [SLOW]
+
+
+def test_a_node_failing_eject_failures_times_is_ejected_then_readmitted_after_a_good_trial():
+    pool = ProviderPool([TronNode(SLOW), TronNode(FAST)], eject_failures=3, eject_error_rate=1.0, eject_base=15)
+    failing = next(h for h in pool.nodes if h.node.url == SLOW)
+    session = StandInSession({SLOW: 0.0, FAST: 0.0}, down={SLOW})
+
+    async def read():
+        return await pool.request(session, "POST", "/wallet/getnowblock", hedge=False)
+
+    async def run():
+        for _ in range(2):
+            assert (await read()).node == FAST
+        assert failing.ejections == 0
+        assert (await read()).node == FAST
+        assert failing.ejections == 1 and failing.ejected_until > time.monotonic()
+
+        # Ejected nodes get no requests
+        session.started.clear()
+        await read()
+        assert [node for node, _ in session.started] == [FAST]
+
+        # The ejection ran out and the node is back: the trial request readmits it
+        failing.ejected_until = time.monotonic() - 1
+        session.down.clear()
+        assert (await read()).node == SLOW
+
+    asyncio.run(run())
+    assert failing.ejections == 0
+    assert failing.error_rate == 0.0
+    assert failing in pool.ranked("/wallet/getnowblock")
+
+
+def test_a_failed_trial_ejects_the_node_for_twice_as_long():
+    pool = ProviderPool([TronNode(SLOW), TronNode(FAST)], eject_failures=1, eject_error_rate=1.0, eject_base=15)
+    failing = next(h for h in pool.nodes if h.node.url == SLOW)
+    session = StandInSession({SLOW: 0.0, FAST: 0.0}, down={SLOW})
+
+    async def run():
+        await pool.request(session, "POST", "/wallet/getnowblock", hedge=False)
+        first = failing.ejected_until - time.monotonic()
+        failing.ejected_until = time.monotonic() - 1
+        await pool.request(session, "POST", "/wallet/getnowblock", hedge=False)
+        return first, failing.ejected_until - time.monotonic()
+
+    first, second = asyncio.run(run())
+    assert 14 < first <= 15
+    assert 29 < second <= 30
+    assert failing.ejections == 2
@@ -0,0 +1,212 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from block_scanner import ScannedBlock, Token, TokenTransfer
+from chain_head import ChainHeadTracker
+from tron_monitor import TronPaymentMonitor
+from trongrid_history import CURSOR_KEY_PREFIX
+
+USDT = Token("TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t", "USDT", 6)
+ADDRESS = "TQn9Y2khEsLJW1ChVWFMSMeRDow5KcbLSE"
+
+
+class StandInScanner:
+    """Serves a fixed run of blocks for any requested range"""
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+
+    async def scan(self, start, end, concurrency=1):
+        return [block for block in self.blocks if start <= block.number < end]
+
+
+def transfer(tx_hash, number):
+    return TokenTransfer(tx_hash, number, number * 3000, USDT, "TSender", ADDRESS, 1_000_000, 0)
+
+
+def block(number, *transfers):
+    return ScannedBlock(number, f"h{number}", f"h{number - 1}", number * 3000, list(transfers))
+
+
+@pytest.fixture
+def monitor(monkeypatch):
+    monkeypatch.setenv("MONITOR_COORDINATION", "none")
+    monkeypatch.setenv("CONFIRMATION_BLOCKS", "1")
+    monitor = TronPaymentMonitor()
+    monitor.notified = []
+    monitor.refuse = set()
+
+    async def handle_payment_event(event):
+        if event.tx_hash in monitor.refuse:
+            raise ConnectionError("outbox unavailable")
+        monitor.notified.append(event.tx_hash)
+
+    monitor.handle_payment_event = handle_payment_event
+    return monitor
+
+
+def test_scan_checkpoints_in_front_of_a_transfer_that_failed(monitor):
+    monitor.scanner = StandInScanner([
+        block(101, transfer("t1", 101)),
+        block(102),
+        block(103, transfer("t2", 103)),
+        block(104, transfer("t3", 104))
+    ])
+    monitor.last_processed_block = 100
+    monitor.refuse = {"t2"}
+
+    async def run():
+        first = await monitor.scan_blocks(104, 10)
+        position = monitor.checkpoints.checkpoint.number
+        monitor.refuse = set()
+        second = await monitor.scan_blocks(104, 10)
+        await monitor.pipeline.close()
+        return first, position, second
+
+    first, position, second = asyncio.run(run())
+    assert (first, position) == (2, 102)
+    assert second == 2 and monitor.checkpoints.checkpoint.number == 104
+    # t3 was notified the first time and is not queued again
+    assert sorted(monitor.notified) == ["t1", "t2", "t3"]
+
+
+def test_scan_does_not_move_when_the_first_block_failed(monitor):
+    monitor.scanner = StandInScanner([block(101, transfer("t1", 101))])
+    monitor.last_processed_block = 100
+    monitor.refuse = {"t1"}
+
+    async def run():
+        scanned = await monitor.scan_blocks(101, 10)
+        await monitor.pipeline.close()
+        return scanned
+
+    assert asyncio.run(run()) == 0
+    assert monitor.last_processed_block == 100 and monitor.checkpoints.checkpoint is None
+
+
+class StandInTronGrid:
+    """A TRC20 history listing with the block each transfer was mined in"""
+
+    def __init__(self, transfers):
+        self.transfers = transfers  # (block_timestamp, tx_hash, block_number or None)
+
+    async def request(self, session, method, path, params=None, priority=None):
+        page = [
+            {"block_timestamp": timestamp, "transaction_id": tx_hash, "from": "TSender", "to": ADDRESS,
+             "value": "1000000", "token_info": {"symbol": "USDT", "decimals": 6}}
+            for timestamp, tx_hash, _ in self.transfers if timestamp >= params["min_timestamp"]
+        ]
+        body = {"data": page, "meta": {}}
+        return SimpleNamespace(status=200, body=json.dumps(body).encode(), json=lambda: body)
+
+    async def block_of(self, tx_hash):
+        return next(number for _, candidate, number in self.transfers if candidate == tx_hash)
+
+
+def history_monitor(monkeypatch, redis_client, tron_grid, head):
+    """A history-mode monitor reading tron_grid, with its cursor in redis_client"""
+    monkeypatch.setenv("MONITOR_COORDINATION", "none")
+    monkeypatch.setenv("CONFIRMATION_BLOCKS", "3")
+    monitor = TronPaymentMonitor()
+    monitor.notified = []
+
+    async def handle_payment_event(event):
+        monitor.notified.append(event.tx_hash)
+
+    async def latest_block():
+        return head[0]
+
+    monitor.handle_payment_event = handle_payment_event
+    monitor.get_transaction_block = tron_grid.block_of
+    monitor.chain_head = ChainHeadTracker(latest_block)
+    monitor.last_processed_block = 0
+    for history in monitor.histories.values():
+        history.pool = tron_grid
+        history.redis = redis_client
+        history.fence = None
+        history.initial_lookback = 10 ** 12
+    return monitor
+
+
+async def tick(*monitors):
+    """One check_for_payments per monitor, then close what they opened"""
+    for monitor in monitors:
+        await monitor.check_for_payments()
+    for monitor in monitors:
+        await monitor.pipeline.close()
+        if monitor.session:
+            await monitor.session.close()
+
+
+async def persisted_cursor(redis_client):
+    return json.loads(await redis_client.get(f"{CURSOR_KEY_PREFIX}:{ADDRESS}:TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t"))
+
+
+def test_cursor_holds_at_transfers_waiting_for_confirmations_across_a_restart(monkeypatch, redis_client):
+    tron_grid = StandInTronGrid([(1000, "t1", 100), (2000, "t2", 101)])
+    head = [101]
+
+    async def run():
+        first = history_monitor(monkeypatch, redis_client, tron_grid, head)
+        await tick(first)
+        assert first.notified == [] and set(first.pending_confirmations) == {"t1", "t2"}
+        assert (await persisted_cursor(redis_client))["last_ids"] == []
+
+        # A restarted replica starts with nothing pending; it fetches both transfers again
+        head[0] = 102
+        second = history_monitor(monkeypatch, redis_client, tron_grid, head)
+        await tick(second)
+        assert second.notified == ["t1"] and set(second.pending_confirmations) == {"t2"}
+        cursor = await persisted_cursor(redis_client)
+        assert (cursor["last_timestamp"], cursor["last_ids"]) == (1000, ["t1"])
+
+        head[0] = 103
+        await tick(second)
+        assert second.notified == ["t1", "t2"]
+        assert (await persisted_cursor(redis_client))["last_ids"] == ["t2"]
+
+    asyncio.run(run())
+
+
+def test_cursor_holds_at_transfers_whose_block_is_not_known(monkeypatch, redis_client):
+    tron_grid = StandInTronGrid([(1000, "t1", None), (2000, "t2", 100)])
+    head = [102]
+
+    async def run():
+        monitor = history_monitor(monkeypatch, redis_client, tron_grid, head)
+        await tick(monitor)
+        assert monitor.notified == ["t2"] and monitor.awaiting_block == {"t1"}
+        assert (await persisted_cursor(redis_client))["last_ids"] == []
+
+        tron_grid.transfers[0] = (1000, "t1", 100)
+        head[0] = 103
+        await tick(monitor)
+        assert monitor.notified == ["t2", "t1"] and not monitor.awaiting_block
+        assert (await persisted_cursor(redis_client))["last_ids"] == ["t2"]
+
+    asyncio.run(run())
+
+
+def test_a_replica_taking_an_address_over_finishes_its_waiting_transfers(monkeypatch, redis_client):
+    tron_grid = StandInTronGrid([(1000, "t1", 100)])
+    head = [101]
+
+    async def run():
+        old_owner = history_monitor(monkeypatch, redis_client, tron_grid, head)
+        await tick(old_owner)
+        assert set(old_owner.pending_confirmations) == {"t1"}
+
+        # The lease moved: the old owner forgets t1 and never notifies it
+        old_owner.hand_over({ADDRESS})
+        head[0] = 102
+        assert await old_owner.release_confirmed(head[0]) == []
+        await old_owner.pipeline.close()
+
+        new_owner = history_monitor(monkeypatch, redis_client, tron_grid, head)
+        await tick(new_owner)
+        return old_owner.notified, new_owner.notified
+
+    assert asyncio.run(run()) == ([], ["t1"])
@@ -1,16 +1,33 @@
 import asyncio
+import functools
 import logging
 import os
 from decimal import Decimal
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Set, Tuple
 from datetime import datetime, timedelta
 import aiohttp
 import json
+import redis.asyncio as redis
 from tronpy import Tron
 from tronpy.providers import HTTPProvider
 import structlog
 from dataclasses import dataclass
 
+from notification_outbox import NotificationOutbox
+from coordination import MonitorCoordinator
+from balance_reader import USDT_CONTRACT, BalanceReader
+from poll_scheduler import PollScheduler
+from chain_head import ChainHeadTracker, PendingConfirmations
+from trongrid_history import TronGridHistory
+from block_scanner import BlockScanner, NodeBlockSource, Token, TokenTransfer
+from block_checkpoint import BlockCheckpoint, CheckpointStore
+from tx_dedup import SeenTransactions
+from pipeline import Pipeline
+from provider_pool import ProviderPool, nodes_from_env
+from rate_limiter import PRIORITY_PAYMENT, limiter_from_env
+from loop_lag import LoopLagProbe
+from prometheus_client import start_http_server
+
 logger = structlog.get_logger()
 
 
@@ -31,31 +48,150 @@ class TronPaymentMonitor:
     """TRON blockchain payment monitoring service"""
     
     def __init__(self):
-        self.tron_node_url = os.getenv("TRON_NODE_URL", "https://api.trongrid.io")
         self.payment_address = os.getenv("PAYMENT_ADDRESS", "TQn9Y2khEsLJW1ChVWFMSMeRDow5KcbLSE")
+        # PAYMENT_ADDRESSES watches several addresses (comma separated); shard mode splits them over replicas
+        self.payment_addresses = [
+            address.strip() for address in os.getenv("PAYMENT_ADDRESSES", "").split(",") if address.strip()
+        ] or [self.payment_address]
+        self.payment_address = self.payment_addresses[0]
+        self.watched_addresses = {address.lower() for address in self.payment_addresses}
         self.usdt_contract = "TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t"  # USDT-TRC20
         self.backend_api_url = os.getenv("BACKEND_API_URL", "http://localhost:8000")
         self.internal_api_token = os.getenv("INTERNAL_API_TOKEN", "dev-internal-token")
         self.confirmation_blocks = int(os.getenv("CONFIRMATION_BLOCKS", "1"))
-        self.polling_interval = int(os.getenv("POLLING_INTERVAL", "30"))  # seconds
+        self.polling_interval = int(os.getenv("POLLING_INTERVAL", "30"))  # seconds, without Redis order events
+        self.poll_active_interval = float(os.getenv("POLL_ACTIVE_INTERVAL", "3"))  # while orders await payment
+        self.poll_burst_interval = float(os.getenv("POLL_BURST_INTERVAL", "1"))  # right after an order is created
+        self.poll_burst_seconds = float(os.getenv("POLL_BURST_SECONDS", "60"))
+        self.poll_idle_max = float(os.getenv("POLL_IDLE_MAX", "300"))  # idle polls back off up to this
+        self.notify_batch_size = int(os.getenv("NOTIFY_BATCH_SIZE", "1"))  # > 1 sends waiting notifications in batches
+        self.outbox_workers = int(os.getenv("OUTBOX_WORKERS", "4"))  # concurrent deliveries to the backend
+        self.outbox_backoff_max = float(os.getenv("OUTBOX_BACKOFF_MAX", "300"))  # seconds between retries, at most
+        self.outbox_max_attempts = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "20"))  # then the entry is dead-lettered
+        self.redis_url = os.getenv("REDIS_URL")  # persists monitor state across restarts when set
+        self.monitor_mode = os.getenv("MONITOR_MODE", "history")  # "blocks" walks every block instead
+        self.scan_max_blocks = int(os.getenv("SCAN_MAX_BLOCKS", "200"))  # per tick in blocks mode
+        self.catchup_blocks = int(os.getenv("SCAN_CATCHUP_BLOCKS", "1000"))  # per checkpointed range when behind
+        self.catchup_concurrency = int(os.getenv("SCAN_CATCHUP_CONCURRENCY", "8"))  # parallel block reads when behind
+        self.reorg_rewind = int(os.getenv("SCAN_REORG_REWIND", "20"))  # blocks rescanned after a hash mismatch
+        self.pipeline_queue_size = int(os.getenv("PIPELINE_QUEUE_SIZE", "100"))  # per stage
+        self.filter_workers = int(os.getenv("PIPELINE_FILTER_WORKERS", "2"))
+        self.confirm_workers = int(os.getenv("PIPELINE_CONFIRM_WORKERS", "8"))  # concurrent block lookups
+        self.notify_workers = int(os.getenv("PIPELINE_NOTIFY_WORKERS", "4"))  # concurrent backend notifications
+        # Replicas sharing Redis: "leader" (one active, others on standby), "shard" (addresses split) or "none"
+        self.coordination_mode = os.getenv("MONITOR_COORDINATION", "leader" if self.redis_url else "none")
+        self.lease_ttl = float(os.getenv("MONITOR_LEASE_TTL", "2"))  # seconds until a crashed replica's work moves
+        
+        self.redis = redis.from_url(self.redis_url) if self.redis_url else None
+        self.session = None
+        
+        # TRON_NODE_URLS / TRON_FULL_NODE_URLS list several nodes; reads go to the healthiest.
+        # TronGrid calls share the TRON_API_KEYS rate limit with other processes through Redis.
+        self.pool = ProviderPool(nodes_from_env(), limiter=limiter_from_env(self.redis))
+        
+        # Payments are stored before the backend is notified and retried until it accepts them
+        self.outbox = NotificationOutbox(
+            self.redis,
+            self.send_notifications,
+            concurrency=self.outbox_workers,
+            batch_size=self.notify_batch_size,
+            backoff_max=self.outbox_backoff_max,
+            max_attempts=self.outbox_max_attempts
+        )
         
-        # Initialize Tron client
-        self.tron = Tron(HTTPProvider(self.tron_node_url))
+        self.loop_lag = LoopLagProbe()
+        
+        # Poll every block while orders await payment, back off while none do
+        self.scheduler = PollScheduler(
+            self.redis,
+            self.payment_addresses,
+            active_interval=self.poll_active_interval,
+            burst_interval=self.poll_burst_interval,
+            burst_seconds=self.poll_burst_seconds,
+            idle_max=self.poll_idle_max,
+            fallback_interval=self.polling_interval
+        )
         self.last_processed_block = None
-        self.processed_transactions = set()
+        # Notified transactions within the dedup window, shared with other replicas through Redis
+        self.processed_transactions = SeenTransactions(
+            self.redis, window=float(os.getenv("DEDUP_WINDOW_SECONDS", "172800"))
+        )
+        
+        # Chain head fetched once per tick; transfers wait in block order for their confirmations.
+        # The history cursors stay in front of waiting transfers, so they are fetched again after a
+        # restart or by the replica that takes the address over
+        self.chain_head = ChainHeadTracker(self.get_latest_block_number)
+        self.pending_confirmations = PendingConfirmations(self.confirmation_blocks)
+        self.awaiting_block: Set[str] = set()
+        
+        # Fetched transfers are filtered, wait for their block and are notified by concurrent stages;
+        # a full stage queue makes the stage before it wait
+        self.pipeline = (
+            Pipeline()
+            .add_stage("filter", self.filter_transaction, self.filter_workers, self.pipeline_queue_size)
+            .add_stage("confirm", self.confirm_transaction, self.confirm_workers, self.pipeline_queue_size)
+            .add_stage("notify", self.notify_payment, self.notify_workers, self.pipeline_queue_size)
+        )
+        
+        # Block scanning reads every block whatever it watches, so it is not worth sharding
+        if self.monitor_mode == "blocks" and self.coordination_mode == "shard":
+            logger.warning("Shard coordination does not apply to blocks mode, electing a leader instead")
+            self.coordination_mode = "leader"
+        
+        # Decides which addresses this replica handles; taking over some wakes the loop at once
+        self.coordinator = MonitorCoordinator(
+            self.redis,
+            self.coordination_mode,
+            self.payment_addresses,
+            ttl=self.lease_ttl,
+            replica_id=os.getenv("REPLICA_ID"),
+            on_change=self.scheduler.wake
+        )
+        
+        # Only transfers newer than the persisted cursor are downloaded; the cursor is written under the lease
+        self.histories = {
+            address: TronGridHistory(
+                f"{address}:{self.usdt_contract}",
+                self.pool,
+                f"/v1/accounts/{address}/transactions/trc20",
+                params={"contract_address": self.usdt_contract, "only_to": "true"},
+                redis_client=self.redis,
+                fence=functools.partial(self.coordinator.fenced_set, address)
+            )
+            for address in self.payment_addresses
+        }
+        
+        # Or decode USDT transfers from every block: the reads per block do not grow with watched addresses
+        self.scanner = None
+        self.checkpoints = CheckpointStore(
+            "payment-scanner", self.redis, fence=functools.partial(self.coordinator.fenced_set, None)
+        )
+        self.last_block_hash: Optional[str] = None
+        if self.monitor_mode == "blocks":
+            self.scanner = BlockScanner(
+                NodeBlockSource(self.pool, self.get_session),
+                [Token(self.usdt_contract, "USDT", 6)],
+                self.payment_addresses
+            )
         
         logger.info("TronPaymentMonitor initialized", 
-                   payment_address=self.payment_address,
-                   node_url=self.tron_node_url)
+                   payment_addresses=self.payment_addresses,
+                   mode=self.monitor_mode,
+                   coordination=self.coordinator.mode,
+                   nodes=[node["node"] for node in self.pool.stats()])
     
     async def start_monitoring(self):
         """Start the payment monitoring loop"""
         logger.info("Starting TRON payment monitoring")
+        self.loop_lag.start()
+        await self.outbox.start()
+        self.scheduler.start()
+        await self.coordinator.start()
         
         # Get starting block
         if not self.last_processed_block:
             try:
-                latest_block = await self.get_latest_block_number()
+                latest_block = await self.chain_head.refresh()
                 self.last_processed_block = latest_block - 100  # Start 100 blocks back
                 logger.info("Starting from block", block=self.last_processed_block)
             except Exception as e:
@@ -65,16 +201,24 @@ class TronPaymentMonitor:
         while True:
             try:
                 await self.check_for_payments()
-                await asyncio.sleep(self.polling_interval)
+                await self.scheduler.wait()
             except Exception as e:
                 logger.error("Error in monitoring loop", error=str(e))
                 await asyncio.sleep(60)  # Wait longer on error
     
+    def _notify_headers(self) -> Dict[str, str]:
+        return {
+            "Content-Type": "application/json",
+            "X-Internal-Token": self.internal_api_token
+        }
+    
     async def get_latest_block_number(self) -> int:
         """Get the latest block number"""
         try:
-            block = self.tron.get_latest_block()
-            return block['block_header']['raw_data']['number']
+            response = await self.pool.request(await self.get_session(), "POST", "/wallet/getnowblock", priority=PRIORITY_PAYMENT)
+            if response.status != 200:
+                raise RuntimeError(f"getnowblock returned {response.status}")
+            return response.json()['block_header']['raw_data']['number']
         except Exception as e:
             logger.error("Error getting latest block", error=str(e))
             raise
@@ -82,166 +226,334 @@ class TronPaymentMonitor:
     async def check_for_payments(self):
         """Check for new payments to our address"""
         try:
-            latest_block = await self.get_latest_block_number()
+            self.hand_over(self.coordinator.take_lost())
+            # Standby: another replica handles every address
+            if not self.coordinator.owned:
+                return
+            await self.take_over(self.coordinator.take_gained())
+            
+            latest_block = await self.chain_head.refresh()
             
             if latest_block <= self.last_processed_block:
                 return
             
             logger.debug("Checking blocks for payments", 
                         from_block=self.last_processed_block,
-                        to_block=latest_block)
+                        to_block=latest_block,
+                        poll_mode=self.scheduler.mode(),
+                        owned_addresses=len(self.coordinator.owned),
+                        transfer_to_paid_median=self.outbox.median_transfer_to_paid(),
+                        loop_lag_max_ms=round(self.loop_lag.snapshot()["max"] * 1000))
             
-            # Get transactions for our address
-            transactions = await self.get_address_transactions(
-                self.payment_address,
-                self.last_processed_block + 1,
-                latest_block
-            )
+            if self.scanner:
+                await self.scan_blocks(latest_block, self.scan_max_blocks)
+                logger.debug("Scanner position", block=self.last_processed_block,
+                             **self.checkpoints.report_lag(latest_block))
+                return
+            
+            # Everything after the committed cursors, including transfers still waiting from earlier ticks
+            self.awaiting_block.clear()
+            addresses = sorted(self.coordinator.owned)
+            with self.pipeline.timed("fetch"):
+                transactions = await self.get_new_transactions(addresses)
             
             for tx in transactions:
-                await self.process_transaction(tx)
+                await self.pipeline.put(tx)
+            failed = self.failed_hashes(await self.pipeline.join())
+            failed |= self.failed_hashes(await self.release_confirmed(latest_block))
             
+            # The cursors only move past transfers that were notified; the rest are fetched again
+            unhandled = failed | self.awaiting_block | set(self.pending_confirmations)
+            for address in addresses:
+                await self.histories[address].commit(unhandled)
             self.last_processed_block = latest_block
             
         except Exception as e:
             logger.error("Error checking for payments", error=str(e))
     
-    async def get_address_transactions(self, address: str, from_block: int, to_block: int) -> List[Dict]:
-        """Get transactions for an address in block range"""
+    async def take_over(self, addresses: set):
+        """Reload the persisted position of work this replica just became responsible for
+        
+        The previous owner may have moved the cursors or the scanner
+        checkpoint since this replica last read them.
+        """
+        if not addresses:
+            return
         try:
-            # Use TronGrid API for transaction history
-            url = f"{self.tron_node_url}/v1/accounts/{address}/transactions/trc20"
-            params = {
-                'limit': 200,
-                'contract_address': self.usdt_contract
-            }
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, params=params) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return data.get('data', [])
-                    else:
-                        logger.error("Error fetching transactions", status=response.status)
-                        return []
-        except Exception as e:
-            logger.error("Error getting address transactions", error=str(e))
-            return []
+            if self.scanner:
+                await self.resume_scanner()
+            else:
+                for address in addresses:
+                    await self.histories[address].load()
+        except Exception:
+            self.coordinator.gained |= addresses  # retried next tick
+            raise
+        logger.info("Took over payment monitoring", addresses=sorted(addresses))
     
-    async def process_transaction(self, tx_data: Dict):
-        """Process a single transaction"""
-        try:
-            tx_hash = tx_data.get('transaction_id')
-            
-            # Skip if already processed
-            if tx_hash in self.processed_transactions:
-                return
-            
-            # Extract transaction details
-            to_address = tx_data.get('to')
-            from_address = tx_data.get('from')
-            amount_raw = tx_data.get('value', '0')
-            block_timestamp = tx_data.get('block_timestamp', 0)
-            
-            # Skip if not to our payment address
-            if to_address.lower() != self.payment_address.lower():
-                return
-            
-            # Convert amount (USDT has 6 decimals)
-            amount = Decimal(amount_raw) / Decimal('1000000')
-            
-            # Get transaction details for confirmations
-            confirmations = await self.get_transaction_confirmations(tx_hash)
-            
-            if confirmations < self.confirmation_blocks:
-                logger.debug("Transaction not confirmed yet", 
-                           tx_hash=tx_hash, 
-                           confirmations=confirmations)
+    def hand_over(self, addresses: set):
+        """Forget the waiting transfers of addresses another replica took over
+        
+        The cursors were not committed past them, so the new owner fetches
+        them again and notifies them once they are confirmed.
+        """
+        if not addresses:
+            return
+        lost = {address.lower() for address in addresses}
+        for tx_hash, tx_data in self.pending_confirmations.items():
+            if tx_data.get('to', '').lower() in lost:
+                self.pending_confirmations.discard(tx_hash)
+        logger.info("Handed over payment monitoring", addresses=sorted(addresses))
+    
+    async def resume_scanner(self):
+        """Continue from the persisted checkpoint, then catch up to the head"""
+        head = await self.chain_head.refresh()
+        checkpoint = await self.checkpoints.load()
+        if checkpoint is None:
+            self.last_processed_block = head - 100  # Start 100 blocks back
+            logger.info("No block checkpoint, starting from block", block=self.last_processed_block)
+        else:
+            blocks = await self.scanner.source.get_blocks(checkpoint.number, checkpoint.number + 1)
+            if blocks and blocks[0].get("blockID") != checkpoint.hash:
+                self.rewind(checkpoint.number, "Checkpoint block hash changed")
+            else:
+                self.last_processed_block = checkpoint.number
+                self.last_block_hash = checkpoint.hash
+                logger.info("Resuming from block checkpoint", block=checkpoint.number,
+                            **self.checkpoints.report_lag(head))
+        await self.catch_up()
+    
+    async def catch_up(self):
+        """Scan checkpointed ranges with parallel block reads until the normal per-tick budget suffices"""
+        while True:
+            head = await self.chain_head.refresh()
+            behind = head - self.confirmation_blocks + 1 - self.last_processed_block
+            if behind <= self.scan_max_blocks:
                 return
-            
-            # Create payment event
-            payment_event = PaymentEvent(
-                tx_hash=tx_hash,
-                from_address=from_address,
-                to_address=to_address,
-                token="USDT-TRC20",
-                amount=amount,
-                confirmations=confirmations,
-                block_number=tx_data.get('block', 0),
-                timestamp=datetime.fromtimestamp(block_timestamp / 1000)
+            logger.info("Catching up", block=self.last_processed_block, behind=behind)
+            if not await self.scan_blocks(head, self.catchup_blocks, self.catchup_concurrency):
+                return  # the node did not serve the range; regular ticks retry it
+            self.checkpoints.report_lag(head)
+    
+    async def scan_blocks(self, head: int, max_blocks: int, concurrency: int = 1) -> int:
+        """Walk confirmed blocks after last_processed_block, notify their transfers and checkpoint
+        
+        Only blocks that already have the required confirmations are scanned,
+        so everything found is notified in the same pass and the checkpoint
+        never moves past a transfer that is still waiting. Returns the
+        number of blocks scanned.
+        """
+        confirmed_head = head - self.confirmation_blocks + 1
+        end = min(confirmed_head, self.last_processed_block + max_blocks) + 1
+        if end <= self.last_processed_block + 1:
+            return 0
+        blocks = await self.scanner.scan(self.last_processed_block + 1, end, concurrency)
+        if not blocks:
+            return 0
+        if self.last_block_hash and blocks[0].parent_hash != self.last_block_hash:
+            self.rewind(self.last_processed_block, "Chain reorganised under the scanner")
+            return 0
+        
+        for block in blocks:
+            for transfer in block.transfers:
+                await self.queue_transfer(transfer)
+        failed = await self.release_confirmed(head)
+        if failed:
+            # Checkpoint in front of the oldest transfer that was not notified so it is scanned
+            # again; the transfers notified after it are deduplicated
+            oldest = min(event.block_number for _, event in failed)
+            blocks = [block for block in blocks if block.number < oldest]
+            if not blocks:
+                return 0
+        
+        last = blocks[-1]
+        self.last_processed_block = last.number
+        self.last_block_hash = last.hash
+        await self.checkpoints.save(BlockCheckpoint(last.number, last.hash, last.timestamp))
+        return len(blocks)
+    
+    def rewind(self, block: int, reason: str):
+        """Rescan the last reorg_rewind blocks; already notified transfers are deduplicated"""
+        self.last_processed_block = block - self.reorg_rewind
+        self.last_block_hash = None
+        logger.warning(reason, block=block, rescan_from=self.last_processed_block + 1)
+    
+    async def queue_transfer(self, transfer: TokenTransfer):
+        """Queue a decoded transfer for confirmations, in the shape of a TronGrid history item"""
+        if await self.processed_transactions.contains(transfer.tx_hash):
+            return
+        self.pending_confirmations.add(transfer.tx_hash, transfer.block_number, {
+            "transaction_id": transfer.tx_hash,
+            "from": transfer.from_address,
+            "to": transfer.to_address,
+            "value": str(transfer.value),
+            "block_timestamp": transfer.block_timestamp,
+            "token_info": {"symbol": transfer.token.symbol, "decimals": transfer.token.decimals}
+        })
+    
+    async def get_session(self) -> aiohttp.ClientSession:
+        """Shared keepalive HTTP session for TronGrid and the backend API"""
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit_per_host=20, keepalive_timeout=30, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=15, connect=5)
             )
-            
-            # Process payment
-            await self.handle_payment_event(payment_event)
-            
-            # Mark as processed
-            self.processed_transactions.add(tx_hash)
-            
-            logger.info("Payment processed", 
-                       tx_hash=tx_hash,
-                       amount=str(amount),
-                       from_address=from_address)
-            
-        except Exception as e:
-            logger.error("Error processing transaction", error=str(e), tx_data=tx_data)
+        return self.session
+    
+    async def close(self):
+        """Flush notifications and release connections"""
+        await self.loop_lag.stop()
+        await self.scheduler.stop()
+        await self.pipeline.close()
+        await self.coordinator.stop()  # a standby takes over without waiting for the leases to expire
+        await self.outbox.stop()
+        if self.session:
+            await self.session.close()
+        if self.redis:
+            await self.redis.close()
+    
+    async def get_new_transactions(self, addresses: List[str]) -> List[Dict]:
+        """USDT transfers to these addresses since their history cursors, following pagination"""
+        session = await self.get_session()
+        
+        async def fetch(address: str) -> List[Dict]:
+            try:
+                return await self.histories[address].fetch_new(session)
+            except Exception as e:
+                logger.error("Error getting address transactions", address=address, error=str(e))
+                return []
+        
+        results = await asyncio.gather(*(fetch(address) for address in addresses))
+        return [tx for transactions in results for tx in transactions]
+    
+    async def filter_transaction(self, tx_data: Dict) -> Optional[List[Dict]]:
+        """Pipeline stage: drop transfers already handled or not to a watched payment address"""
+        tx_hash = tx_data.get('transaction_id')
+        
+        # Skip if already processed or already waiting for confirmations (fetched again while it waits)
+        if tx_hash in self.pending_confirmations or await self.processed_transactions.contains(tx_hash):
+            return None
+        
+        # Skip if not to one of our payment addresses
+        if tx_data.get('to', '').lower() not in self.watched_addresses:
+            return None
+        
+        return [tx_data]
     
-    async def get_transaction_confirmations(self, tx_hash: str) -> int:
-        """Get number of confirmations for a transaction"""
+    async def confirm_transaction(self, tx_data: Dict) -> List[PaymentEvent]:
+        """Pipeline stage: queue a transfer until it has enough confirmations, passing on what is ready"""
+        tx_hash = tx_data.get('transaction_id')
+        
+        # Resolved once per transaction; confirmations are then derived from the chain head
+        block_number = await self.get_transaction_block(tx_hash)
+        if not block_number:
+            # The history cursor stops in front of it, so it is looked up again next tick
+            logger.debug("Transaction not in a block yet", tx_hash=tx_hash)
+            self.awaiting_block.add(tx_hash)
+            return []
+        
+        self.pending_confirmations.add(tx_hash, block_number, tx_data)
+        head = self.chain_head.head
+        return [self.payment_event(item, confirmations, head)
+                for item, confirmations in self.pending_confirmations.ready(head)]
+    
+    async def release_confirmed(self, head: int) -> List[Tuple[str, Any]]:
+        """Notify every queued transfer that reached the required confirmations at this head
+        
+        Returns the pipeline items that failed, as Pipeline.join does.
+        """
+        for tx_data, confirmations in self.pending_confirmations.ready(head):
+            await self.pipeline.put(self.payment_event(tx_data, confirmations, head), stage="notify")
+        return await self.pipeline.join()
+    
+    @staticmethod
+    def failed_hashes(failed: List[Tuple[str, Any]]) -> Set[str]:
+        """Tx hashes of failed pipeline items: history items before the notify stage, events in it"""
+        return {
+            item.tx_hash if isinstance(item, PaymentEvent) else item.get('transaction_id')
+            for _, item in failed
+        }
+    
+    def payment_event(self, tx_data: Dict, confirmations: int, head: int) -> PaymentEvent:
+        return PaymentEvent(
+            tx_hash=tx_data.get('transaction_id'),
+            from_address=tx_data.get('from'),
+            to_address=tx_data.get('to'),
+            token="USDT-TRC20",
+            # Convert amount (USDT has 6 decimals)
+            amount=Decimal(tx_data.get('value', '0')) / Decimal('1000000'),
+            confirmations=confirmations,
+            block_number=head - confirmations + 1,
+            timestamp=datetime.fromtimestamp(tx_data.get('block_timestamp', 0) / 1000)
+        )
+    
+    async def notify_payment(self, payment_event: PaymentEvent) -> List[PaymentEvent]:
+        """Pipeline stage: hand the payment to the outbox and mark the transaction processed"""
+        await self.handle_payment_event(payment_event)
+        await self.processed_transactions.add(payment_event.tx_hash)
+        
+        logger.info("Payment processed", 
+                   tx_hash=payment_event.tx_hash,
+                   amount=str(payment_event.amount),
+                   from_address=payment_event.from_address,
+                   confirmations=payment_event.confirmations)
+        return [payment_event]
+    
+    async def get_transaction_block(self, tx_hash: str) -> Optional[int]:
+        """Block number a transaction was mined in, None while it is unconfirmed"""
         try:
-            tx_info = self.tron.get_transaction(tx_hash)
-            if not tx_info:
-                return 0
-            
-            current_block = await self.get_latest_block_number()
-            tx_block = tx_info.get('blockNumber', 0)
-            
-            if tx_block == 0:
-                return 0
-            
-            return max(0, current_block - tx_block + 1)
-            
+            response = await self.pool.request(
+                await self.get_session(), "POST", "/wallet/gettransactioninfobyid", json_body={"value": tx_hash},
+                priority=PRIORITY_PAYMENT
+            )
+            tx_info = response.json() if response.status == 200 else None
+            return tx_info.get('blockNumber') if tx_info else None
         except Exception as e:
-            logger.error("Error getting confirmations", error=str(e))
-            return 0
+            logger.error("Error getting transaction block", tx_hash=tx_hash, error=str(e))
+            return None
     
     async def handle_payment_event(self, payment: PaymentEvent):
-        """Handle confirmed payment event"""
-        try:
-            # Notify backend API about payment
-            payment_data = {
-                "tx_hash": payment.tx_hash,
-                "from_address": payment.from_address,
-                "to_address": payment.to_address,
-                "token": payment.token,
-                "amount": str(payment.amount),
-                "confirmations": payment.confirmations,
-                "block_number": payment.block_number,
-                "timestamp": payment.timestamp.isoformat()
-            }
-            
-            headers = {
-                "Content-Type": "application/json",
-                "X-Internal-Token": self.internal_api_token
-            }
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f"{self.backend_api_url}/internal/payments/notify",
-                    json=payment_data,
-                    headers=headers
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        logger.info("Payment notification sent", 
-                                   tx_hash=payment.tx_hash,
-                                   matched_orders=result.get('matched_orders', []))
-                    else:
-                        logger.error("Failed to notify backend", 
-                                   status=response.status,
-                                   tx_hash=payment.tx_hash)
+        """Store a confirmed payment in the outbox, which notifies the backend"""
+        payment_data = {
+            "tx_hash": payment.tx_hash,
+            "from_address": payment.from_address,
+            "to_address": payment.to_address,
+            "token": payment.token,
+            "amount": str(payment.amount),
+            "confirmations": payment.confirmations,
+            "block_number": payment.block_number,
+            "timestamp": payment.timestamp.isoformat()
+        }
+        await self.outbox.append(payment_data)
+    
+    async def send_notifications(self, payloads: List[Dict]) -> Optional[List[str]]:
+        """Post outbox entries to the backend, one at a time or as a batch
         
-        except Exception as e:
-            logger.error("Error handling payment event", error=str(e))
+        Returns the tx hashes whose orders were marked paid once the backend
+        accepted the entries; raises aiohttp.ClientResponseError if it did not.
+        """
+        session = await self.get_session()
+        if len(payloads) == 1:
+            url, body = f"{self.backend_api_url}/internal/payments/notify", payloads[0]
+        else:
+            url, body = f"{self.backend_api_url}/internal/payments/notify-batch", payloads
+        
+        async with session.post(url, json=body, headers=self._notify_headers()) as response:
+            if response.status != 200:
+                logger.error("Failed to notify backend", 
+                           status=response.status,
+                           tx_hashes=[payload["tx_hash"] for payload in payloads])
+                # The outbox tells a rejected payload (4xx) from a backend that is down
+                response.raise_for_status()
+            result = await response.json()
+            if len(payloads) == 1:
+                logger.info("Payment notification sent", 
+                           tx_hash=payloads[0]["tx_hash"],
+                           status=result.get('status'))
+                return [payloads[0]["tx_hash"]] if result.get('status') == "success" else []
+            logger.info("Payment notification batch sent",
+                        size=len(payloads),
+                        matched=result.get('matched', 0))
+            return [item["tx_hash"] for item in result.get('results', []) if item.get('status') == "success"]
 
 
 class PaymentAmountGenerator:
@@ -268,33 +580,43 @@ class TronWalletManager:
     """Manage TRON wallet operations"""
     
     def __init__(self):
-        self.tron = Tron(HTTPProvider(os.getenv("TRON_NODE_URL", "https://api.trongrid.io")))
+        self.tron = Tron(HTTPProvider(nodes_from_env()[0].url))
         self.payment_address = os.getenv("PAYMENT_ADDRESS", "TQn9Y2khEsLJW1ChVWFMSMeRDow5KcbLSE")
+        self.session = None
+        
+        # Balances of many addresses are read concurrently through the provider pool and cached briefly
+        self.balance_reader = BalanceReader(
+            ProviderPool(nodes_from_env(), limiter=limiter_from_env()),
+            self.get_session,
+            concurrency=int(os.getenv("BALANCE_READ_CONCURRENCY", "32")),
+            ttl=float(os.getenv("BALANCE_CACHE_TTL", "10"))
+        )
+    
+    async def get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit_per_host=32, keepalive_timeout=30, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=15, connect=5)
+            )
+        return self.session
     
     async def get_balance(self, address: str = None) -> Dict[str, Decimal]:
         """Get TRX and USDT balance for address"""
-        try:
-            addr = address or self.payment_address
-            
-            # Get TRX balance
-            trx_balance = self.tron.get_account_balance(addr)
-            
-            # Get USDT balance
-            usdt_contract = "TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t"
-            try:
-                usdt_balance_raw = self.tron.get_contract(usdt_contract).functions.balanceOf(addr).call()
-                usdt_balance = Decimal(usdt_balance_raw) / Decimal('1000000')
-            except:
-                usdt_balance = Decimal('0')
-            
-            return {
-                "TRX": Decimal(str(trx_balance)),
-                "USDT": usdt_balance
-            }
-            
-        except Exception as e:
-            logger.error("Error getting balance", error=str(e))
-            return {"TRX": Decimal('0'), "USDT": Decimal('0')}
+        addr = address or self.payment_address
+        balances = (await self.get_balances([addr]))[addr]
+        return {asset: balance if balance is not None else Decimal('0') for asset, balance in balances.items()}
+    
+    async def get_balances(self, addresses: List[str]) -> Dict[str, Dict[str, Optional[Decimal]]]:
+        """TRX and USDT balances of many addresses in about one round trip; None where a read failed"""
+        trx, usdt = await asyncio.gather(
+            self.balance_reader.trx_balances(addresses),
+            self.balance_reader.trc20_balances(addresses, USDT_CONTRACT)
+        )
+        return {address: {"TRX": trx[address], "USDT": usdt[address]} for address in addresses}
+    
+    async def close(self):
+        if self.session:
+            await self.session.close()
     
     def validate_address(self, address: str) -> bool:
         """Validate TRON address format"""
@@ -306,8 +628,15 @@ class TronWalletManager:
 
 async def main():
     """Main function to start payment monitoring"""
+    metrics_port = os.getenv("METRICS_PORT")
+    if metrics_port:
+        start_http_server(int(metrics_port))
+    
     monitor = TronPaymentMonitor()
-    await monitor.start_monitoring()
+    try:
+        await monitor.start_monitoring()
+    finally:
+        await monitor.close()
 
 
 if __name__ == "__main__":
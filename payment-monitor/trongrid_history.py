@@ -0,0 +1,193 @@
+"""
+Incremental TronGrid account history
+
+Walks a TronGrid /v1/accounts/... listing in ascending block_timestamp
+order starting at a persisted cursor, so a steady-state poll only returns
+what is new (usually nothing but the boundary item) and a burst larger
+than one page is followed through its `fingerprint` continuation tokens
+instead of being cut off at the page limit.
+
+Usage per tick: `items = await history.fetch_new(session)`, process them,
+then `await history.commit(unhandled)` with the ids of the items that could
+not be handled yet. The cursor only moves on commit, and only up to the
+first unhandled item, so items fetched by a tick that crashed or failed
+part-way are fetched again. When several replicas
+share the cursor, `fence(key, value)` persists it instead of a plain SET
+and returns False once this replica no longer owns the listing.
+"""
+
+import json
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Awaitable, Callable, Collection, Dict, List, Optional, Tuple
+
+import aiohttp
+import structlog
+
+from provider_pool import ProviderPool
+from rate_limiter import PRIORITY_PAYMENT
+
+logger = structlog.get_logger()
+
+CURSOR_KEY_PREFIX = "monitor:history-cursor"
+
+
+@dataclass
+class HistoryCursor:
+    """Position in an account history listing"""
+    since: int = 0  # min_timestamp (ms) of the current walk
+    fingerprint: Optional[str] = None  # continuation token when a walk was cut short
+    last_timestamp: int = 0  # newest block_timestamp seen
+    last_ids: List[str] = field(default_factory=list)  # items seen at last_timestamp
+
+
+class TronGridHistory:
+    """Cursor-based incremental fetch of one TronGrid history listing"""
+
+    def __init__(
+        self,
+        name: str,
+        pool: ProviderPool,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        id_field: str = "transaction_id",
+        redis_client=None,
+        page_size: int = 200,
+        max_pages: int = 10,
+        initial_lookback: float = 600,
+        priority: int = PRIORITY_PAYMENT,
+        fence: Optional[Callable[[str, str], Awaitable[bool]]] = None
+    ):
+        self.name = name
+        self.pool = pool
+        self.path = path
+        self.params = params or {}
+        self.id_field = id_field
+        self.redis = redis_client
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.initial_lookback = initial_lookback
+        self.priority = priority
+        self.fence = fence
+
+        self.cursor: Optional[HistoryCursor] = None
+        self._pending: Optional[HistoryCursor] = None
+        self._fetched: List[Tuple[int, str]] = []  # (block_timestamp, id) of the last fetch_new's items
+        self.last_fetch_bytes = 0
+
+    async def load(self) -> HistoryCursor:
+        """Restore the persisted cursor, or start initial_lookback seconds back"""
+        if self.redis is not None:
+            try:
+                raw = await self.redis.get(f"{CURSOR_KEY_PREFIX}:{self.name}")
+                if raw:
+                    self.cursor = HistoryCursor(**json.loads(raw))
+                    logger.info("History cursor restored", name=self.name, since=self.cursor.since)
+            except Exception as e:
+                logger.warning("Failed to load history cursor", name=self.name, error=str(e))
+
+        if self.cursor is None:
+            since = int((time.time() - self.initial_lookback) * 1000)
+            self.cursor = HistoryCursor(since=since, last_timestamp=since)
+        return self.cursor
+
+    async def fetch_new(self, session: aiohttp.ClientSession) -> List[Dict]:
+        """Items added since the committed cursor, oldest first"""
+        if self.cursor is None:
+            await self.load()
+
+        cursor = HistoryCursor(**asdict(self.cursor))
+        seen = set(cursor.last_ids)
+        params = {
+            **self.params,
+            "order_by": "block_timestamp,asc",
+            "min_timestamp": cursor.since,
+            "limit": self.page_size
+        }
+        if cursor.fingerprint:
+            params["fingerprint"] = cursor.fingerprint
+
+        items = []
+        fetched = []
+        self.last_fetch_bytes = 0
+        for page in range(self.max_pages):
+            response = await self.pool.request(session, "GET", self.path, params=params, priority=self.priority)
+            if response.status != 200:
+                logger.error("Error fetching history page", name=self.name, status=response.status, page=page)
+                break
+            self.last_fetch_bytes += len(response.body)
+            data = response.json()
+
+            for item in data.get("data", []):
+                timestamp = item.get("block_timestamp", 0)
+                item_id = item.get(self.id_field)
+                if timestamp < cursor.last_timestamp or (timestamp == cursor.last_timestamp and item_id in seen):
+                    continue
+                if timestamp > cursor.last_timestamp:
+                    cursor.last_timestamp = timestamp
+                    seen = set()
+                seen.add(item_id)
+                items.append(item)
+                fetched.append((timestamp, item_id))
+
+            fingerprint = data.get("meta", {}).get("fingerprint")
+            if not fingerprint or len(data.get("data", [])) < self.page_size:
+                # Walk complete: the next one starts at the newest item seen
+                cursor.fingerprint = None
+                cursor.since = cursor.last_timestamp
+                break
+            cursor.fingerprint = params["fingerprint"] = fingerprint
+        else:
+            logger.warning("History burst exceeds page budget, continuing next tick",
+                           name=self.name, pages=self.max_pages)
+
+        cursor.last_ids = sorted(seen)
+        self._pending = cursor
+        self._fetched = fetched
+
+        if items:
+            logger.debug("Fetched new history items", name=self.name, items=len(items), bytes=self.last_fetch_bytes)
+        return items
+
+    async def commit(self, unhandled: Collection[str] = ()):
+        """Advance and persist the cursor past what the last fetch_new returned
+
+        The cursor stops in front of the first item whose id is in unhandled,
+        so that item and everything after it are fetched again next time.
+        """
+        if self._pending is None:
+            return
+        stop = next((i for i, (_, item_id) in enumerate(self._fetched) if item_id in unhandled), None)
+        self.cursor = self._pending if stop is None else self._cursor_through(stop)
+        self._pending, self._fetched = None, []
+
+        if self.redis is not None:
+            try:
+                key, value = f"{CURSOR_KEY_PREFIX}:{self.name}", json.dumps(asdict(self.cursor))
+                if self.fence is None:
+                    await self.redis.set(key, value)
+                elif not await self.fence(key, value):
+                    logger.warning("History cursor write refused, lease lost", name=self.name)
+            except Exception as e:
+                logger.warning("Failed to persist history cursor", name=self.name, error=str(e))
+
+    def discard(self):
+        """Forget the last fetch_new without moving the cursor; its items are fetched again"""
+        self._pending, self._fetched = None, []
+
+    def _cursor_through(self, count: int) -> HistoryCursor:
+        """The committed cursor moved past the first count items of the last fetch_new"""
+        cursor = HistoryCursor(**asdict(self.cursor))
+        if count == 0:
+            return cursor
+        seen = set(cursor.last_ids)
+        for timestamp, item_id in self._fetched[:count]:
+            if timestamp > cursor.last_timestamp:
+                cursor.last_timestamp = timestamp
+                seen = set()
+            seen.add(item_id)
+        # A new walk from the last handled item brings the rest back
+        cursor.since = cursor.last_timestamp
+        cursor.fingerprint = None
+        cursor.last_ids = sorted(seen)
+        return cursor
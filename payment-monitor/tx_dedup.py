@@ -0,0 +1,154 @@
+"""
+Recent-window transaction dedup
+
+Replaces the per-process processed_transactions sets. Every handled
+transaction hash goes into a Redis sorted set, scored by when it was
+added, so all replicas share one view. Entries older than the window are
+trimmed by score, so the oldest go first, and membership inside the
+window is exact.
+
+A bounded local LRU sits in front and answers repeat lookups (history
+polls return the same transfers over and over) without a Redis round
+trip. Without Redis the LRU alone is the store; its capacity then has to
+cover the window's volume for dedup to stay exact.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Iterable, List
+
+import structlog
+from prometheus_client import Counter
+
+logger = structlog.get_logger()
+
+DEDUP_LOOKUPS = Counter(
+    "tx_dedup_lookups_total",
+    "Transaction dedup lookups by where they were answered",
+    ["result"]
+)
+
+# Record a hash unless it is already there and inside the window; 1 when newly recorded
+CLAIM_SCRIPT = """
+local score = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if score and tonumber(score) >= tonumber(ARGV[3]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+return 1
+"""
+
+
+class SeenTransactions:
+    """Time-ordered, bounded set of recently handled transaction hashes"""
+
+    def __init__(
+        self,
+        redis_client=None,
+        key: str = "monitor:seen-tx",
+        window: float = 172800,
+        local_capacity: int = 100000,
+        trim_every: int = 1000
+    ):
+        self.redis = redis_client
+        self.key = key
+        self.window = window
+        self.local_capacity = local_capacity
+        self.trim_every = trim_every
+        self._local: "OrderedDict[str, float]" = OrderedDict()
+        self._claim = redis_client.register_script(CLAIM_SCRIPT) if redis_client else None
+        self._adds = 0
+
+    def __len__(self) -> int:
+        return len(self._local)
+
+    async def contains(self, tx_hash: str) -> bool:
+        now = time.time()
+        added_at = self._local.get(tx_hash)
+        if added_at is not None and added_at >= now - self.window:
+            self._local.move_to_end(tx_hash)
+            DEDUP_LOOKUPS.labels(result="local").inc()
+            return True
+
+        if self.redis is not None:
+            try:
+                score = await self.redis.zscore(self.key, tx_hash)
+                if score is not None and score >= now - self.window:
+                    self._remember(tx_hash, score)
+                    DEDUP_LOOKUPS.labels(result="redis").inc()
+                    return True
+            except Exception as e:
+                logger.warning("Dedup store unavailable, using local entries only", error=str(e))
+
+        DEDUP_LOOKUPS.labels(result="miss").inc()
+        return False
+
+    async def filter_new(self, tx_hashes: Iterable[str]) -> List[str]:
+        """The hashes not seen within the window, checking Redis in one round trip"""
+        now = time.time()
+        unknown = []
+        for tx_hash in tx_hashes:
+            added_at = self._local.get(tx_hash)
+            if added_at is not None and added_at >= now - self.window:
+                self._local.move_to_end(tx_hash)
+                DEDUP_LOOKUPS.labels(result="local").inc()
+            else:
+                unknown.append(tx_hash)
+        if not unknown or self.redis is None:
+            DEDUP_LOOKUPS.labels(result="miss").inc(len(unknown))
+            return unknown
+
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for tx_hash in unknown:
+                    pipe.zscore(self.key, tx_hash)
+                scores = await pipe.execute()
+        except Exception as e:
+            logger.warning("Dedup store unavailable, using local entries only", error=str(e))
+            return unknown
+
+        new = []
+        for tx_hash, score in zip(unknown, scores):
+            if score is not None and score >= now - self.window:
+                self._remember(tx_hash, score)
+                DEDUP_LOOKUPS.labels(result="redis").inc()
+            else:
+                new.append(tx_hash)
+                DEDUP_LOOKUPS.labels(result="miss").inc()
+        return new
+
+    async def add(self, tx_hash: str) -> bool:
+        """Record a handled transaction; False if it was already recorded within the window (by any replica)"""
+        now = time.time()
+        added = True
+        if self._claim is not None:
+            try:
+                added = bool(await self._claim(keys=[self.key], args=[tx_hash, now, now - self.window]))
+            except Exception as e:
+                logger.warning("Dedup store unavailable, recording locally", error=str(e))
+        self._remember(tx_hash, now)
+
+        self._adds += 1
+        if self._adds % self.trim_every == 0:
+            await self.trim()
+        return added
+
+    async def trim(self):
+        """Drop entries older than the window: by score in Redis, from the cold end of the LRU locally"""
+        cutoff = time.time() - self.window
+        while self._local:
+            tx_hash, added_at = next(iter(self._local.items()))
+            if added_at >= cutoff:
+                break
+            self._local.popitem(last=False)
+        if self.redis is not None:
+            try:
+                await self.redis.zremrangebyscore(self.key, "-inf", f"({cutoff}")
+            except Exception as e:
+                logger.warning("Failed to trim dedup store", error=str(e))
+
+    def _remember(self, tx_hash: str, added_at: float):
+        self._local[tx_hash] = added_at
+        self._local.move_to_end(tx_hash)
+        if len(self._local) > self.local_capacity:
+            self._local.popitem(last=False)